@@ -0,0 +1,70 @@
+import hashlib
+from typing import Dict, Optional
+
+
+DISSERTATION_SYSTEM_PROMPT = """You are an impartial academic evaluator - an expert in analyzing the summarized dissertation provided to you.
+Your task is to assess the quality of the provided summarized dissertation in relation to specific evaluation criteria."""
+
+FEEDBACK_INSTRUCTION = "IMPORTANT(The following feedback was provided by an expert. Consider the feedback properly, and ensure your evaluation follows this feedback)"
+
+
+class CriterionPromptBuilder:
+    """
+    Builds the per-criterion analysis prompts of one evaluation so that every prompt
+    starts with the same byte-identical prefix (system prompt + summary + author/field
+    context + expert feedback). Only the criterion block differs between prompts, and it
+    always comes last, which lets vLLM automatic prefix caching reuse the KV cache of the
+    summary for criteria 2..N.
+    """
+
+    def __init__(
+        self,
+        summary: str,
+        name_of_author: str,
+        degree_of_student: str,
+        feedback: Optional[str] = None,
+        system_prompt: str = DISSERTATION_SYSTEM_PROMPT
+    ):
+        self.system_prompt = system_prompt
+        self.shared_prefix = self._build_shared_prefix(summary, name_of_author, degree_of_student, feedback)
+        self.prefix_hash = hashlib.sha256(
+            f"{self.system_prompt}\x00{self.shared_prefix}".encode("utf-8")
+        ).hexdigest()[:16]
+
+    @staticmethod
+    def _build_shared_prefix(summary: str, name_of_author: str, degree_of_student: str, feedback: Optional[str]) -> str:
+        prefix = f"""
+# Input Materials
+## Dissertation Text
+{summary}
+
+## Evaluation Context
+- Author: {name_of_author}
+- Academic Field: {degree_of_student}
+"""
+        if feedback:
+            prefix += f"\n{FEEDBACK_INSTRUCTION}: {feedback}\n"
+        return prefix
+
+    def build(self, criterion: str, explanation: Dict[str, str]) -> str:
+        """
+        Build the user prompt for a single criterion.
+
+        Args:
+            criterion: Name of the rubric criterion
+            explanation: Rubric entry holding 'criteria_explanation' and 'criteria_output'
+
+        Returns:
+            The shared prefix followed by the criterion-specific block
+        """
+        return self.shared_prefix + f"""
+## Assessment Criterion and its explanation
+### {criterion}:
+#### Explanation: {explanation['criteria_explanation']}
+
+{explanation['criteria_output']}
+
+Please make sure that you critique the work heavily, including all improvements that can be made.
+
+DO NOT SCORE THE DISSERTATION, YOU ARE TO PROVIDE ONLY DETAILED ANALYSIS, AND NO SCORES ASSOCIATED WITH IT.
+"""
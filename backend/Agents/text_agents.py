@@ -1,13 +1,16 @@
 ## could refine by using PromptTemplates fr user prompts
 
 from backend.Agents.agent_utils import chunk_text, get_first_n_words
+from backend.Agents.prompt_builder import CriterionPromptBuilder
 from backend.InferenceEngine.inference_engines import ModelType, SpandaLLM
+from backend.src.durations import record_stage
 from backend.src.utils import process_docx, process_pdf
 
 import asyncio
 from langgraph.graph import StateGraph
 import logging
 import re
+import time
 from typing import List, TypedDict
 
 
@@ -212,36 +215,20 @@ Topic: {topic}
     return {'final_summary': final_summary}
 
 async def analysis_agent(state):
-    system_prompt = """You are an impartial academic evaluator - an expert in analyzing the summarized dissertation provided to you. 
-Your task is to assess the quality of the provided summarized dissertation in relation to specific evaluation criteria."""
-    llm = SpandaLLM(system_prompt=system_prompt, model_type=ModelType.ANALYSIS)
+    prompt_builder = CriterionPromptBuilder(
+        summary=state['final_summary'],
+        name_of_author=state['name'],
+        degree_of_student=state['degree'],
+        feedback=state.get('feedback')
+    )
+    llm = SpandaLLM(system_prompt=prompt_builder.system_prompt, model_type=ModelType.ANALYSIS)
 
     for criterion in state['criteria']:
-        user_prompt = f"""
-# Input Materials
-## Dissertation Text
-{state['final_summary']}
-
-## Evaluation Context
-- Author: {state['name']}
-- Academic Field: {state['degree']}
-
-## Assessment Criterion and its explanation
-### {criterion}:
-#### Explanation: {state[criterion]['criteria_explanation']}
-
-{state[criterion]['criteria_output']}
-
-Please make sure that you critique the work heavily, including all improvements that can be made.
-
-DO NOT SCORE THE DISSERTATION, YOU ARE TO PROVIDE ONLY DETAILED ANALYSIS, AND NO SCORES ASSOCIATED WITH IT.
-"""
-        if 'feedback' in state:
-            user_prompt += f'\nIMPORTANT(The following feedback was provided by an expert. Consider the feedback properly, and ensure your evaluation follows this feedback): {state['feedback']}'
+        user_prompt = prompt_builder.build(criterion, state[criterion])
 
         # Stream analysis results to the client
         try:
-            state['criteria'][criterion]['analysis'] = await llm.ainvoke(user_prompt=user_prompt)
+            state['criteria'][criterion]['analysis'] = await llm.ainvoke(user_prompt, affinity_key=prompt_builder.prefix_hash)
         except Exception as e:
             logger.error(f"Error processing criterion {criterion}: {str(e)}")
     return
@@ -497,12 +484,14 @@ async def summarize_and_analyze_agent(thesis: str, topic: str) -> str:
     chunks = chunk_text(thesis, chunk_size=1000)
     
     # Process chunks in batches
+    started = time.monotonic()
     summarized_chunks = await process_chunks_in_batch(
         chunks=chunks,
         topic=topic,
         system_prompt=summarize_system_prompt,
         batch_size=5
     )
+    record_stage("chunk", len(chunks), time.monotonic() - started)
     
     # Combine all summarized chunks into a final summary
     final_summary = " ".join(filter(None, summarized_chunks)).replace("\n", "")
@@ -1,3 +1,6 @@
+from backend.InferenceEngine.circuit_breaker import CircuitOpenError, get_breaker, is_backend_failure
+from backend.InferenceEngine.request_policy import default_policy, call_with_retries, InferenceError, InferenceHTTPError
+
 import aiohttp
 import base64
 from dotenv import load_dotenv
@@ -26,7 +29,8 @@ vllm_model_for_image = os.getenv("VLLM_MODEL_FOR_IMAGE")
 async def analyze_image(image_data: bytes) -> Dict[str, Any]:
     """
     Unified method to analyze images using either VLLM or Ollama based on available environment variables.
-    VLLM takes precedence if both are configured.
+    VLLM takes precedence if both are configured; while its circuit is open (or a call fails
+    because it is unhealthy) the request fails over to Ollama.
     
     Args:
         image_data: Image bytes to analyze
@@ -36,6 +40,7 @@ async def analyze_image(image_data: bytes) -> Dict[str, Any]:
     
     Raises:
         ValueError: If neither VLLM nor Ollama environment variables are configured
+        InferenceError: If the image could not be analyzed after retries
     """
     # Check VLLM configuration
     has_vllm = all([
@@ -57,18 +62,37 @@ async def analyze_image(image_data: bytes) -> Dict[str, Any]:
             "(OLLAMA_URL, OLLAMA_MODEL_FOR_IMAGE) environment variables."
         )
     
-    try:
-        # Prefer VLLM if available
-        if has_vllm:
-            logger.info("Using VLLM for image analysis")
-            return await analyze_image_vllm(image_data)
-        else:
-            logger.info("Using Ollama for image analysis")
-            return await analyze_image_ollama(image_data)
-            
-    except Exception as e:
-        logger.error(f"Error in analyze_image: {str(e)}")
-        return {"response": f"Failed to analyze image: {str(e)}"}
+    # Prefer VLLM if available
+    backends = []
+    if has_vllm:
+        backends.append(("vllm", analyze_image_vllm))
+    if has_ollama:
+        backends.append(("ollama", analyze_image_ollama))
+
+    last_error: InferenceError = CircuitOpenError("All image analysis backends are unavailable")
+    for backend, analyze in backends:
+        breaker = get_breaker(backend, "IMAGE")
+        if not breaker.allow_request():
+            continue
+
+        logger.info(f"Using {backend} for image analysis")
+        try:
+            result = await analyze(image_data)
+        except InferenceError as e:
+            if not is_backend_failure(e):
+                breaker.release()
+                raise
+            breaker.record_failure()
+            last_error = e
+            continue
+        except BaseException:
+            breaker.release()
+            raise
+        # Whole generations are left out of the slow-call rate, as in invoke_llm
+        breaker.record_success()
+        return result
+
+    raise last_error
 
 
 ###############################################################################################################################################################
@@ -129,37 +153,32 @@ async def analyze_image_ollama(image_data: bytes):
 ###############################################################################################################################################################
 
 async def generate_from_image_ollama(image_data: bytes, prompt: str):
-    try:
-        # Encode the binary image data to Base64
-        encoded_image = base64.b64encode(image_data).decode('utf-8')
-        
-        data = {
-            "model": ollama_model_for_image,
-            "prompt": prompt,
-            "images": [encoded_image],
-            "options": {
-                "top_k": 1, 
-                "top_p": 0, 
-                "temperature": 0,
-                "seed": 100
-            },
-            "stream": False
-        }
-        
-        async with aiohttp.ClientSession() as session:
+    # Encode the binary image data to Base64
+    encoded_image = base64.b64encode(image_data).decode('utf-8')
+    
+    data = {
+        "model": ollama_model_for_image,
+        "prompt": prompt,
+        "images": [encoded_image],
+        "options": {
+            "top_k": 1, 
+            "top_p": 0, 
+            "temperature": 0,
+            "seed": 100
+        },
+        "stream": False
+    }
+
+    async def call():
+        async with aiohttp.ClientSession(timeout=default_policy.aiohttp_timeout()) as session:
             async with session.post(f"{ollama_url}/api/generate", json=data) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    print("########################################")
-                    print(result)
-                    return result
-                else:
+                if response.status != 200:
                     error_text = await response.text()
                     logger.error(f"Image analysis failed with status {response.status}: {error_text}")
-                    return {"response": "Failed to analyze image"}
-    except Exception as e:
-        logger.error(f"Error in generate_from_image: {str(e)}")
-        return {"response": "Failed to analyze image"}
+                    raise InferenceHTTPError(response.status, error_text)
+                return await response.json()
+
+    return await call_with_retries(call, default_policy, "Ollama image analysis")
 
 
 
@@ -193,17 +212,13 @@ async def generate_from_image(
         }
     ]
 
-    try:
-        response = await send_multimodal_chat_message(
-            messages=messages,
-            image_bytes=image_data,
-            model=model,
-            base_url=base_url
-        )
-        return {"response": response}
-    except Exception as e:
-        logger.error(f"Error in generate_from_image: {str(e)}")
-        return {"response": "Failed to analyze image"}
+    response = await send_multimodal_chat_message(
+        messages=messages,
+        image_bytes=image_data,
+        model=model,
+        base_url=base_url
+    )
+    return {"response": response}
 
 
 async def send_multimodal_chat_message(
@@ -258,20 +273,17 @@ async def send_multimodal_chat_message(
         "stream": False
     }
     
-    try:
-        async with aiohttp.ClientSession() as session:
+    async def call() -> str:
+        async with aiohttp.ClientSession(timeout=default_policy.aiohttp_timeout()) as session:
             async with session.post(endpoint, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result["choices"][0]["message"]["content"]
-                else:
+                if response.status != 200:
                     error_text = await response.text()
                     logger.error(f"API request failed with status {response.status}: {error_text}")
-                    raise aiohttp.ClientError(f"API request failed: {error_text}")
-                    
-    except Exception as e:
-        logger.error(f"Error making API request: {str(e)}")
-        raise
+                    raise InferenceHTTPError(response.status, error_text)
+                result = await response.json()
+                return result["choices"][0]["message"]["content"]
+
+    return await call_with_retries(call, default_policy, f"VLLM image analysis at {endpoint}")
 
 
 async def encode_bytes_to_base64(image_bytes: bytes) -> str:
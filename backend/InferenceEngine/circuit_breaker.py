@@ -0,0 +1,170 @@
+from backend.InferenceEngine.metrics import counter, gauge
+from backend.InferenceEngine.request_policy import (
+    InferenceError,
+    InferenceHTTPError,
+    InferenceConnectionError,
+    InferenceTimeoutError,
+    DeadlineExceededError
+)
+
+from collections import deque
+from enum import Enum
+import logging
+import os
+import time
+from typing import Deque, Dict, Optional, Tuple
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CIRCUIT_WINDOW_SIZE = int(os.getenv("CIRCUIT_WINDOW_SIZE", 20))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", 5))
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", 0.5))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", 120))
+CIRCUIT_SLOW_CALL_RATE = float(os.getenv("CIRCUIT_SLOW_CALL_RATE", 0.8))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", 30))
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", 1))
+
+
+circuit_state_gauge = gauge(
+    "inference_circuit_state",
+    "Circuit breaker state per backend and model type (0=closed, 1=half_open, 2=open)"
+)
+circuit_transitions = counter(
+    "inference_circuit_transitions_total",
+    "Circuit breaker state transitions per backend and model type"
+)
+circuit_rejections = counter(
+    "inference_circuit_rejections_total",
+    "Calls skipped because the backend circuit was open"
+)
+
+
+class CircuitState(Enum):
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class CircuitOpenError(InferenceError):
+    """Every backend able to serve the request has an open circuit."""
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    """Errors that say something about the health of the backend (not about the request)."""
+    if isinstance(error, DeadlineExceededError):
+        return False
+    if isinstance(error, InferenceHTTPError):
+        return error.status_code >= 500 or error.status_code == 429
+    return isinstance(error, (InferenceConnectionError, InferenceTimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open circuit breaker over a rolling window of call outcomes.
+
+    The circuit opens when, over the last CIRCUIT_WINDOW_SIZE calls, the error rate or the
+    rate of calls slower than CIRCUIT_SLOW_CALL_SECONDS crosses its threshold. After
+    CIRCUIT_OPEN_SECONDS it lets CIRCUIT_HALF_OPEN_PROBES calls through; a successful probe
+    closes the circuit again, a failed one re-opens it.
+    """
+
+    def __init__(
+        self,
+        backend: str,
+        model_type: str,
+        window_size: int = CIRCUIT_WINDOW_SIZE,
+        min_calls: int = CIRCUIT_MIN_CALLS,
+        error_rate: float = CIRCUIT_ERROR_RATE,
+        slow_call_seconds: float = CIRCUIT_SLOW_CALL_SECONDS,
+        slow_call_rate: float = CIRCUIT_SLOW_CALL_RATE,
+        open_seconds: float = CIRCUIT_OPEN_SECONDS,
+        half_open_probes: int = CIRCUIT_HALF_OPEN_PROBES
+    ):
+        self.backend = backend
+        self.model_type = model_type
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        # Each outcome is (failed, slow)
+        self.outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=window_size)
+        self.state = CircuitState.CLOSED
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        circuit_state_gauge.set(self.state.value, backend=backend, model_type=model_type)
+
+    def _transition(self, state: CircuitState):
+        if state is self.state:
+            return
+        logger.warning(f"Circuit for {self.backend}/{self.model_type}: {self.state.name} -> {state.name}")
+        self.state = state
+        circuit_state_gauge.set(state.value, backend=self.backend, model_type=self.model_type)
+        circuit_transitions.inc(backend=self.backend, model_type=self.model_type, to_state=state.name.lower())
+        if state is CircuitState.OPEN:
+            self.opened_at = time.monotonic()
+        elif state is CircuitState.CLOSED:
+            self.outcomes.clear()
+        self.probes_in_flight = 0
+
+    def allow_request(self) -> bool:
+        """Whether a call may be sent to the backend now. Reserves a probe when half-open."""
+        if self.state is CircuitState.OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                circuit_rejections.inc(backend=self.backend, model_type=self.model_type)
+                return False
+            self._transition(CircuitState.HALF_OPEN)
+
+        if self.state is CircuitState.HALF_OPEN:
+            if self.probes_in_flight >= self.half_open_probes:
+                circuit_rejections.inc(backend=self.backend, model_type=self.model_type)
+                return False
+            self.probes_in_flight += 1
+        return True
+
+    def _is_slow(self, duration: Optional[float]) -> bool:
+        # Calls whose latency was not measured never count as slow
+        return duration is not None and duration >= self.slow_call_seconds
+
+    def record_success(self, duration: Optional[float] = None):
+        slow = self._is_slow(duration)
+        if self.state is CircuitState.HALF_OPEN:
+            self._transition(CircuitState.OPEN if slow else CircuitState.CLOSED)
+            return
+        self.outcomes.append((False, slow))
+        self._evaluate()
+
+    def record_failure(self, duration: Optional[float] = None):
+        if self.state is CircuitState.HALF_OPEN:
+            self._transition(CircuitState.OPEN)
+            return
+        self.outcomes.append((True, self._is_slow(duration)))
+        self._evaluate()
+
+    def release(self):
+        """Forget a call whose outcome says nothing about backend health (cancelled, bad request)."""
+        if self.state is CircuitState.HALF_OPEN and self.probes_in_flight > 0:
+            self.probes_in_flight -= 1
+
+    def _evaluate(self):
+        if self.state is not CircuitState.CLOSED or len(self.outcomes) < self.min_calls:
+            return
+        failures = sum(1 for failed, _ in self.outcomes if failed)
+        slow_calls = sum(1 for _, slow in self.outcomes if slow)
+        if failures / len(self.outcomes) >= self.error_rate or slow_calls / len(self.outcomes) >= self.slow_call_rate:
+            self._transition(CircuitState.OPEN)
+
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+
+def get_breaker(backend: str, model_type: str) -> CircuitBreaker:
+    """Return the process-wide breaker for a backend serving a model type."""
+    key = (backend, model_type)
+    if key not in _breakers:
+        _breakers[key] = CircuitBreaker(backend, model_type)
+    return _breakers[key]
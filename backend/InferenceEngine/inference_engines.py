@@ -1,16 +1,37 @@
+from contextlib import aclosing
 from dotenv import load_dotenv
 from enum import Enum
 import httpx
 import json
+from backend.InferenceEngine.circuit_breaker import CircuitBreaker, CircuitOpenError, get_breaker, is_backend_failure
+from backend.InferenceEngine.metrics import counter
+from backend.InferenceEngine.request_policy import (
+    RequestPolicy,
+    default_policy,
+    call_with_retries,
+    stream_with_retries,
+    InferenceError,
+    InferenceHTTPError,
+    NoBackendAvailableError
+)
+from backend.InferenceEngine.routing import get_router, parse_replica_urls
+from backend.InferenceEngine.stream_decoder import NDJSONDecoder, SSEDecoder
 from langchain_core.language_models.llms import LLM
+import logging
 import os
 from pydantic import BaseModel, Field
+import time
 from typing import AsyncGenerator, Optional
 
 
 # Load environment variables from .env file
 load_dotenv()
 
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+failovers = counter("inference_failovers_total", "Calls served by a secondary backend because the primary failed or its circuit was open")
+
 # Access the environment variables
 # ollama_url = os.getenv("OLLAMA_URL")
 # vllm_url = os.getenv("VLLM_URL_FOR_ANALYSIS")
@@ -19,9 +40,21 @@ load_dotenv()
 class CancellationToken:
     def __init__(self):
         self.is_cancelled = False
+        self._callbacks = []
 
     def cancel(self):
+        if self.is_cancelled:
+            return
         self.is_cancelled = True
+        for callback in self._callbacks:
+            callback()
+
+    def add_callback(self, callback):
+        """Run callback (e.g. task.cancel) as soon as the token is cancelled"""
+        if self.is_cancelled:
+            callback()
+        else:
+            self._callbacks.append(callback)
 
 class ModelType(Enum):
     ANALYSIS = "ANALYSIS"
@@ -30,6 +63,10 @@ class ModelType(Enum):
     IMAGE = "IMAGE"
     SCORING = "SCORING"
 
+class Backend(Enum):
+    VLLM = "vllm"
+    OLLAMA = "ollama"
+
 class UrlType(Enum):
     ANALYSIS = "ANALYSIS"
     EXTRACTION = "EXTRACTION"
@@ -75,17 +112,30 @@ class EnvConfig:
         """Check if Ollama is configured and available for specific model type"""
         return bool(self.ollama_url and self.ollama_models.get(model_type))
     
+    def get_vllm_replicas(self, model_type: ModelType) -> list[str]:
+        """VLLM_URL_FOR_* may hold a comma separated list of replicas serving the same model"""
+        url_type = UrlType[model_type.value]
+        return parse_replica_urls(self.vllm_urls.get(url_type))
+
     def get_model_and_url(self, model_type: ModelType) -> tuple[Optional[str], Optional[str]]:
         """Get the appropriate model and URL based on availability"""
         # First try VLLM
         if self.is_vllm_available(model_type):
-            url_type = UrlType[model_type.value]  # Convert ModelType to corresponding UrlType
-            return self.vllm_models[model_type], self.vllm_urls[url_type]
+            return self.vllm_models[model_type], self.get_vllm_replicas(model_type)[0]
         # Then try Ollama
         elif self.is_ollama_available(model_type):
             return self.ollama_models[model_type], self.ollama_url
         return None, None
 
+    def get_backends(self, model_type: ModelType) -> list[Backend]:
+        """Backends able to serve a model type, in failover order (VLLM first)"""
+        backends = []
+        if self.is_vllm_available(model_type):
+            backends.append(Backend.VLLM)
+        if self.is_ollama_available(model_type):
+            backends.append(Backend.OLLAMA)
+        return backends
+
 
 class SpandaLLM(LLM, BaseModel):
     model_type: ModelType = Field(..., description="Model type for the LLM")
@@ -110,11 +160,12 @@ class SpandaLLM(LLM, BaseModel):
         system_prompt: {self.system_prompt}"""
 
     async def _acall(self, prompt: str, **kwargs) -> str:
-        """Asynchronous call to the LLM"""
-        if self.config.is_vllm_available(self.model_type):
-            return await self.invoke_llm_vllm(prompt)
-        else:
-            return await self.invoke_llm_ollama(prompt)
+        """Asynchronous call to the LLM, failing over between backends"""
+        response = await invoke_llm(
+            self.system_prompt, prompt, self.model_type,
+            config=self.config, affinity_key=kwargs.get("affinity_key")
+        )
+        return response["answer"]
         
     def _call(self, prompt: str, **kwargs) -> str:
         """Synchronous call to the LLM"""
@@ -124,12 +175,11 @@ class SpandaLLM(LLM, BaseModel):
     async def _astream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
         """Asynchronous streaming call to the LLM"""
         cancellation_token = kwargs.get("cancellation_token", CancellationToken())
-        if self.config.is_vllm_available(self.model_type):
-            async for chunk in self.stream_llm_vllm(prompt, cancellation_token):
-                yield chunk
-        else:
-            async for chunk in self.stream_llm_ollama(prompt, cancellation_token):
-                yield chunk
+        async for chunk in stream_llm(
+            self.system_prompt, prompt, self.model_type, cancellation_token,
+            config=self.config, affinity_key=kwargs.get("affinity_key")
+        ):
+            yield chunk
     
     async def invoke_llm_vllm(
         self,
@@ -137,47 +187,17 @@ class SpandaLLM(LLM, BaseModel):
         temperature: float = 0.0, 
         top_p: float = 0.1,
         top_k: int = 1,   
-        seed: int = 42
+        seed: int = 42,
+        affinity_key: Optional[str] = None
     ) -> str:
         """Invoke the LLM with specified sampling parameters and return the final non-streaming response."""
-        system_prompt = self.system_prompt
-        vllm_model = self.model
-        vllm_url = self.url
-        
-        # Define the payload for the request with sampling parameters
-        payload = {
-            "model": vllm_model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            "temperature": temperature,
-            "top_p": top_p,
-            "top_k": top_k,
-            "seed": seed,
-            "stream": False  # Set stream to False for non-streaming
-        }
-        
-        try:
-            async with httpx.AsyncClient() as client:
-                # Use the provided VLLM URL
-                response = await client.post(vllm_url, json=payload, timeout=None)
-                
-                if response.status_code == 200:
-                    response_data = json.loads(response.content)
-                    ai_msg = response_data.get('choices', [{}])[0].get('message', {}).get('content', '')
-                    return ai_msg
-                else:
-                    print(f"Error: {response.status_code} - {response.text}")
-                    return response.text
-        
-        except httpx.TimeoutException:
-            print("Request timed out.")
-            return "Request timed out"
-        
-        except Exception as e:
-            print(f"An error occurred: {str(e)}")
-            return str(e)
+        router = get_router(self.config.get_vllm_replicas(self.model_type))
+        async with router.lease(affinity_key) as vllm_url:
+            response = await invoke_llm_vllm(
+                self.system_prompt, user_prompt, self.model, vllm_url,
+                temperature=temperature, top_p=top_p, top_k=top_k, seed=seed
+            )
+        return response["answer"]
 
     async def stream_llm_vllm(
         self,
@@ -186,100 +206,21 @@ class SpandaLLM(LLM, BaseModel):
         temperature: float = 0.0,
         top_p: float = 0.1,
         top_k: int = 1,   
-        seed: int = 42
+        seed: int = 42,
+        affinity_key: Optional[str] = None
     ) -> AsyncGenerator[str, None]:
         """Stream responses from the LLM with cancellation support"""
-        system_prompt = self.system_prompt
-        vllm_model = self.model
-        vllm_url = self.url
-        
-        payload = {
-            "model": vllm_model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            "temperature": temperature,
-            "top_p": top_p,
-            "top_k": top_k,
-            "seed": seed,
-            "stream": True
-        }
-
-        async with httpx.AsyncClient() as client:
-            try:
-                async with client.stream('POST', vllm_url, json=payload, timeout=None) as response:
-                    if response.status_code == 200:
-                        async for line in response.aiter_lines():
-                            if cancellation_token.is_cancelled:
-                                # Close the connection explicitly
-                                await response.aclose()
-                                break
-                                
-                            if line:
-                                raw_line = line.lstrip("data: ").strip()
-                                
-                                if raw_line == "[DONE]":
-                                    break
-                                
-                                try:
-                                    data = json.loads(raw_line)
-                                    content = data.get('choices', [{}])[0].get('delta', {}).get('content', '')
-                                    if content:
-                                        yield content
-                                except json.JSONDecodeError:
-                                    continue
-                    else:
-                        print(f"Request failed with status code {response.status_code}")
-            except Exception as e:
-                print(f"Error during streaming: {str(e)}")
-                raise
+        router = get_router(self.config.get_vllm_replicas(self.model_type))
+        async with router.lease(affinity_key) as vllm_url:
+            async for chunk in stream_llm_vllm(
+                self.system_prompt, user_prompt, self.model, vllm_url, cancellation_token,
+                temperature=temperature, top_p=top_p, top_k=top_k, seed=seed
+            ):
+                yield chunk
 
     async def invoke_llm_ollama(self, user_prompt):
-        system_prompt = self.system_prompt
-        ollama_model = self.model
-        ollama_url = self.url
-
-        prompt = f"""
-    {system_prompt}
-
-    {user_prompt}
-    """
-        payload = {
-            # "messages": [
-            #     {"role": "system", "content": system_prompt},
-            #     {"role": "user", "content": user_prompt}
-            # ],
-            "prompt": prompt,
-            "model": ollama_model,
-            "options": {
-                "top_k": 1, 
-                "top_p": 0, 
-                "temperature": 0,
-                "seed": 100,
-                "num_ctx": 4096
-            },
-            "stream": False
-        }
-
-        try:
-            async with httpx.AsyncClient() as client:
-                # Use the global ollama_url here
-                response = await client.post(f"{ollama_url}/api/generate", json=payload, timeout=None)
-                response_data = json.loads(response.content)
-
-            if response.status_code == 200:
-                ai_msg = response_data['response']
-                return ai_msg
-            else:
-                print(f"Error: {response.status_code} - {response.text}")
-                return response.text
-        except httpx.TimeoutException:
-            print("Request timed out. This should not happen with unlimited timeout.")
-            return "Request timed out"
-        except Exception as e:
-            print(f"An error occurred: {str(e)}")
-            return str(e)
+        response = await invoke_llm_ollama(self.system_prompt, user_prompt, self.model, self.url)
+        return response["answer"]
 
     async def stream_llm_ollama(
         self, 
@@ -287,69 +228,75 @@ class SpandaLLM(LLM, BaseModel):
         cancellation_token: CancellationToken
     ) -> AsyncGenerator[str, None]:
         """Stream responses from Ollama with cancellation support"""
-        system_prompt = self.system_prompt
-        ollama_model = self.model
-        ollama_url = self.url
-        prompt = f"""
-        {system_prompt}
-        {user_prompt}
-        """
-        payload = {
-            "prompt": prompt,
-            "model": ollama_model,
-            "options": {
-                "top_k": 1,
-                "top_p": 0,
-                "temperature": 0,
-                "seed": 100,
-                "num_ctx": 4096
-            },
-            "stream": True
-        }
-        
-        async with httpx.AsyncClient() as client:
-            try:
-                async with client.stream('POST', f"{ollama_url}/api/generate", json=payload, timeout=None) as response:
-                    async for line in response.aiter_lines():
-                        if cancellation_token.is_cancelled:
-                            # Close the connection explicitly
-                            await response.aclose()
-                            break
-                            
-                        if line:
-                            try:
-                                data = json.loads(line)
-                                if 'response' in data:
-                                    yield data['response']
-                            except json.JSONDecodeError:
-                                continue
-            except Exception as e:
-                print(f"Error during streaming: {str(e)}")
-                raise
+        async for chunk in stream_llm_ollama(self.system_prompt, user_prompt, self.model, self.url, cancellation_token):
+            yield chunk
 
 
 async def invoke_llm(
     system_prompt: str,
     user_prompt: str,
     model_type: ModelType,
-    config: Optional[EnvConfig] = None
+    config: Optional[EnvConfig] = None,
+    affinity_key: Optional[str] = None
 ) -> dict:
     """
-    Unified interface for invoking LLM models. Automatically chooses between VLLM and Ollama
-    based on availability, with priority given to VLLM.
+    Unified interface for invoking LLM models. Backends are tried in priority order (VLLM,
+    then Ollama); a backend whose circuit is open is skipped, and a call that fails because
+    the backend is unhealthy fails over to the next one. Requests sharing an affinity key
+    (evaluation id or prompt prefix hash) are routed to the same VLLM replica. These calls do
+    not count towards a backend's slow-call rate: their duration is that of the whole
+    generation, which says more about the output length than about the backend.
+
+    Raises:
+        InferenceError: When no backend is configured or every backend failed
     """
     if config is None:
         config = EnvConfig()
-    
-    model, url = config.get_model_and_url(model_type)
-    
-    if not model or not url:
-        return {"error": f"No LLM service available for model type {model_type.value}"}
-    
-    if config.is_vllm_available(model_type):
-        return await invoke_llm_vllm(system_prompt, user_prompt, model, url)
-    else:
-        return await invoke_llm_ollama(system_prompt, user_prompt, model)
+
+    backends = config.get_backends(model_type)
+    if not backends:
+        raise NoBackendAvailableError(f"No LLM service available for model type {model_type.value}")
+
+    last_error: InferenceError = CircuitOpenError(f"All backends for model type {model_type.value} are unavailable")
+    for position, backend in enumerate(backends):
+        breaker = get_breaker(backend.value, model_type.value)
+        if not breaker.allow_request():
+            continue
+
+        try:
+            response = await _invoke_backend(backend, system_prompt, user_prompt, model_type, config, affinity_key)
+        except InferenceError as e:
+            if not is_backend_failure(e):
+                breaker.release()
+                raise
+            breaker.record_failure()
+            logger.warning(f"{backend.value} failed for {model_type.value}: {e}")
+            last_error = e
+            continue
+        except BaseException:
+            breaker.release()
+            raise
+
+        breaker.record_success()
+        if position > 0:
+            failovers.inc(model_type=model_type.value, backend=backend.value)
+        return response
+
+    raise last_error
+
+
+async def _invoke_backend(
+    backend: Backend,
+    system_prompt: str,
+    user_prompt: str,
+    model_type: ModelType,
+    config: EnvConfig,
+    affinity_key: Optional[str]
+) -> dict:
+    if backend is Backend.VLLM:
+        async with get_router(config.get_vllm_replicas(model_type)).lease(affinity_key) as vllm_url:
+            return await invoke_llm_vllm(system_prompt, user_prompt, config.vllm_models[model_type], vllm_url)
+    return await invoke_llm_ollama(system_prompt, user_prompt, config.ollama_models[model_type], config.ollama_url)
     
     
 async def stream_llm(
@@ -357,24 +304,110 @@ async def stream_llm(
     user_prompt: str,
     model_type: ModelType,
     cancellation_token: CancellationToken,
-    config: Optional[EnvConfig] = None
+    config: Optional[EnvConfig] = None,
+    affinity_key: Optional[str] = None
 ) -> AsyncGenerator[str, None]:
-    """Unified streaming interface with cancellation support"""
+    """
+    Unified streaming interface with cancellation support, replica affinity and failover.
+    A stream only fails over while it has not produced any token, so output is never mixed
+    between backends. Latency is measured as time to first token; a stream that fails after
+    it counts as a failure of its backend, but is not failed over.
+    """
     if config is None:
         config = EnvConfig()
-    
-    model, url = config.get_model_and_url(model_type)
-    
-    if not model or not url:
-        yield f"Error: No LLM service available for model type {model_type.value}"
+
+    backends = config.get_backends(model_type)
+    if not backends:
+        raise NoBackendAvailableError(f"No LLM service available for model type {model_type.value}")
+
+    last_error: InferenceError = CircuitOpenError(f"All backends for model type {model_type.value} are unavailable")
+    for position, backend in enumerate(backends):
+        breaker = get_breaker(backend.value, model_type.value)
+        if not breaker.allow_request():
+            continue
+
+        started = time.monotonic()
+        first_token_after: Optional[float] = None
+        try:
+            async with aclosing(_stream_backend(backend, system_prompt, user_prompt, model_type, config, cancellation_token, affinity_key)) as stream:
+                async for chunk in stream:
+                    if first_token_after is None:
+                        first_token_after = time.monotonic() - started
+                        if position > 0:
+                            failovers.inc(model_type=model_type.value, backend=backend.value)
+                    yield chunk
+        except InferenceError as e:
+            if not is_backend_failure(e):
+                _record_stream_end(breaker, first_token_after)
+                raise
+            if first_token_after is not None:
+                # Part of the output was handed on already; another backend cannot continue it
+                breaker.record_failure(first_token_after)
+                raise
+            breaker.record_failure(time.monotonic() - started)
+            logger.warning(f"{backend.value} stream failed for {model_type.value}: {e}")
+            last_error = e
+            continue
+        except BaseException:
+            _record_stream_end(breaker, first_token_after)
+            raise
+
+        _record_stream_end(breaker, first_token_after)
         return
-    
-    if config.is_vllm_available(model_type):
-        async for chunk in stream_llm_vllm(system_prompt, user_prompt, model, url, cancellation_token):
-            yield chunk
+
+    raise last_error
+
+
+def _record_stream_end(breaker: CircuitBreaker, first_token_after: Optional[float]):
+    if first_token_after is None:
+        # Stream ended (or was cancelled) without output: nothing learned about the backend
+        breaker.release()
     else:
-        async for chunk in stream_llm_ollama(system_prompt, user_prompt, model, cancellation_token):
-            yield chunk
+        breaker.record_success(first_token_after)
+
+
+async def _stream_backend(
+    backend: Backend,
+    system_prompt: str,
+    user_prompt: str,
+    model_type: ModelType,
+    config: EnvConfig,
+    cancellation_token: CancellationToken,
+    affinity_key: Optional[str]
+) -> AsyncGenerator[str, None]:
+    if backend is Backend.VLLM:
+        async with get_router(config.get_vllm_replicas(model_type)).lease(affinity_key) as vllm_url:
+            stream = stream_llm_vllm(system_prompt, user_prompt, config.vllm_models[model_type], vllm_url, cancellation_token)
+            async with aclosing(stream):
+                async for chunk in stream:
+                    yield chunk
+    else:
+        stream = stream_llm_ollama(system_prompt, user_prompt, config.ollama_models[model_type], config.ollama_url, cancellation_token)
+        async with aclosing(stream):
+            async for chunk in stream:
+                yield chunk
+
+# Streams are read with aiter_raw(), so ask the server not to compress them
+RAW_STREAM_HEADERS = {"Accept-Encoding": "identity"}
+
+
+async def decode_stream(
+    response: httpx.Response,
+    decoder: SSEDecoder | NDJSONDecoder,
+    cancellation_token: CancellationToken
+) -> AsyncGenerator[str, None]:
+    """Feed raw response bytes through an incremental decoder, yielding the tokens of each network read as one string"""
+    async for raw in response.aiter_raw():
+        if cancellation_token.is_cancelled:
+            return
+        tokens = decoder.feed(raw)
+        if tokens:
+            yield tokens[0] if len(tokens) == 1 else "".join(tokens)
+        if decoder.done:
+            return
+    tokens = decoder.flush()
+    if tokens:
+        yield "".join(tokens)
 
 ##############################################################################################################################
 ##############################################################################################################################
@@ -385,24 +418,19 @@ async def stream_llm(
 async def invoke_llm_vllm(
     system_prompt: str, 
     user_prompt: str, 
-    ollama_model: str,
+    vllm_model: str,
     vllm_url: str,
     temperature: float = 0.0, 
     top_p: float = 0.1,
     top_k: int = 1,   
-    seed: int = 42
+    seed: int = 42,
+    policy: RequestPolicy = default_policy
 ) -> dict:
     """Invoke the LLM with specified sampling parameters and return the final non-streaming response."""
     
-    # Create the full prompt
-    prompt = f"""
-    {system_prompt}
-    {user_prompt}
-    """
-    
     # Define the payload for the request with sampling parameters
     payload = {
-        "model": ollama_model,
+        "model": vllm_model,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
@@ -413,44 +441,37 @@ async def invoke_llm_vllm(
         "seed": seed,
         "stream": False  # Set stream to False for non-streaming
     }
-    
-    try:
-        async with httpx.AsyncClient() as client:
-            # Use the provided VLLM URL
-            response = await client.post(vllm_url, json=payload, timeout=None)
-            
-            if response.status_code == 200:
-                response_data = json.loads(response.content)
-                ai_msg = response_data.get('choices', [{}])[0].get('message', {}).get('content', '')
-                return {"answer": ai_msg}
-            else:
-                print(f"Error: {response.status_code} - {response.text}")
-                return {"error": response.text}
-    
-    except httpx.TimeoutException:
-        print("Request timed out.")
-        return {"error": "Request timed out"}
-    
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        return {"error": str(e)}
+
+    async def call() -> dict:
+        async with httpx.AsyncClient(timeout=policy.httpx_timeout()) as client:
+            response = await client.post(vllm_url, json=payload)
+
+        if response.status_code != 200:
+            raise InferenceHTTPError(response.status_code, response.text)
+
+        response_data = json.loads(response.content)
+        ai_msg = response_data.get('choices', [{}])[0].get('message', {}).get('content', '')
+        return {"answer": ai_msg}
+
+    return await call_with_retries(call, policy, f"VLLM request to {vllm_url}")
     
 
 async def stream_llm_vllm(
     system_prompt: str, 
     user_prompt: str, 
-    ollama_model: str,
+    vllm_model: str,
     vllm_url: str,
     cancellation_token: CancellationToken,
     temperature: float = 0.0,
     top_p: float = 0.1,
     top_k: int = 1,   
-    seed: int = 42
+    seed: int = 42,
+    policy: RequestPolicy = default_policy
 ) -> AsyncGenerator[str, None]:
     """Stream responses from the LLM with cancellation support"""
     
     payload = {
-        "model": ollama_model,
+        "model": vllm_model,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
@@ -462,34 +483,19 @@ async def stream_llm_vllm(
         "stream": True
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            async with client.stream('POST', vllm_url, json=payload, timeout=None) as response:
-                if response.status_code == 200:
-                    async for line in response.aiter_lines():
-                        if cancellation_token.is_cancelled:
-                            # Close the connection explicitly
-                            await response.aclose()
-                            break
-                            
-                        if line:
-                            raw_line = line.lstrip("data: ").strip()
-                            
-                            if raw_line == "[DONE]":
-                                break
-                            
-                            try:
-                                data = json.loads(raw_line)
-                                content = data.get('choices', [{}])[0].get('delta', {}).get('content', '')
-                                if content:
-                                    yield content
-                            except json.JSONDecodeError:
-                                continue
-                else:
-                    print(f"Request failed with status code {response.status_code}")
-        except Exception as e:
-            print(f"Error during streaming: {str(e)}")
-            raise
+    async def open_stream() -> AsyncGenerator[str, None]:
+        async with httpx.AsyncClient(timeout=policy.httpx_timeout()) as client:
+            async with client.stream('POST', vllm_url, json=payload, headers=RAW_STREAM_HEADERS) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise InferenceHTTPError(response.status_code, response.text)
+
+                async for content in decode_stream(response, SSEDecoder(), cancellation_token):
+                    yield content
+
+    async with aclosing(stream_with_retries(open_stream, policy, f"VLLM stream from {vllm_url}")) as stream:
+        async for chunk in stream:
+            yield chunk
 
 ##############################################################################################################################
 ##############################################################################################################################
@@ -503,18 +509,19 @@ async def stream_llm_vllm(
 ################################################OLLAMA GENERATION FUNCTIONS START#############################################
 ##############################################################################################################################
 
-# Use the global ollama_url directly inside the function
-async def invoke_llm_ollama(system_prompt, user_prompt, ollama_model):
+async def invoke_llm_ollama(
+    system_prompt: str,
+    user_prompt: str,
+    ollama_model: str,
+    ollama_url: str,
+    policy: RequestPolicy = default_policy
+) -> dict:
     prompt = f"""
 {system_prompt}
 
 {user_prompt}
 """
     payload = {
-        # "messages": [
-        #     {"role": "system", "content": system_prompt},
-        #     {"role": "user", "content": user_prompt}
-        # ],
         "prompt": prompt,
         "model": ollama_model,
         "options": {
@@ -527,37 +534,33 @@ async def invoke_llm_ollama(system_prompt, user_prompt, ollama_model):
         "stream": False
     }
 
-    try:
-        async with httpx.AsyncClient() as client:
-            # Use the global ollama_url here
-            response = await client.post(f"{ollama_url}/api/generate", json=payload, timeout=None)
-            response_data = json.loads(response.content)
+    async def call() -> dict:
+        async with httpx.AsyncClient(timeout=policy.httpx_timeout()) as client:
+            response = await client.post(f"{ollama_url}/api/generate", json=payload)
 
-        if response.status_code == 200:
-            ai_msg = response_data['response']
-            return {"answer": ai_msg}
-        else:
-            print(f"Error: {response.status_code} - {response.text}")
-            return {"error": response.text}
-    except httpx.TimeoutException:
-        print("Request timed out. This should not happen with unlimited timeout.")
-        return {"error": "Request timed out"}
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        return {"error": str(e)}
+        if response.status_code != 200:
+            raise InferenceHTTPError(response.status_code, response.text)
+
+        response_data = json.loads(response.content)
+        return {"answer": response_data['response']}
+
+    return await call_with_retries(call, policy, f"Ollama request to {ollama_url}")
 
 
 async def stream_llm_ollama(
     system_prompt: str, 
     user_prompt: str, 
     ollama_model: str,
-    cancellation_token: CancellationToken
+    ollama_url: str,
+    cancellation_token: CancellationToken,
+    policy: RequestPolicy = default_policy
 ) -> AsyncGenerator[str, None]:
     """Stream responses from Ollama with cancellation support"""
     prompt = f"""
-    {system_prompt}
-    {user_prompt}
-    """
+{system_prompt}
+
+{user_prompt}
+"""
     payload = {
         "prompt": prompt,
         "model": ollama_model,
@@ -570,30 +573,24 @@ async def stream_llm_ollama(
         },
         "stream": True
     }
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            async with client.stream('POST', f"{ollama_url}/api/generate", json=payload, timeout=None) as response:
-                async for line in response.aiter_lines():
-                    if cancellation_token.is_cancelled:
-                        # Close the connection explicitly
-                        await response.aclose()
-                        break
-                        
-                    if line:
-                        try:
-                            data = json.loads(line)
-                            if 'response' in data:
-                                yield data['response']
-                        except json.JSONDecodeError:
-                            continue
-        except Exception as e:
-            print(f"Error during streaming: {str(e)}")
-            raise
+
+    async def open_stream() -> AsyncGenerator[str, None]:
+        async with httpx.AsyncClient(timeout=policy.httpx_timeout()) as client:
+            async with client.stream('POST', f"{ollama_url}/api/generate", json=payload, headers=RAW_STREAM_HEADERS) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise InferenceHTTPError(response.status_code, response.text)
+
+                async for content in decode_stream(response, NDJSONDecoder(), cancellation_token):
+                    yield content
+
+    async with aclosing(stream_with_retries(open_stream, policy, f"Ollama stream from {ollama_url}")) as stream:
+        async for chunk in stream:
+            yield chunk
 
 
 
 ##############################################################################################################################
 ##############################################################################################################################
 ################################################OLLAMA GENERATION FUNCTIONS STOP##############################################
-##############################################################################################################################
\ No newline at end of file
+##############################################################################################################################
@@ -0,0 +1,74 @@
+import threading
+from typing import Dict, Tuple
+
+
+class _Metric:
+    def __init__(self, name: str, description: str, kind: str):
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self.values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0.0)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.values.items()):
+            label_text = ",".join(f'{name}="{label}"' for name, label in key)
+            lines.append(f"{self.name}{{{label_text}}} {value}" if label_text else f"{self.name} {value}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description, "counter")
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description, "gauge")
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+_registry: Dict[str, _Metric] = {}
+
+
+def counter(name: str, description: str) -> Counter:
+    """Get or create a process-wide counter."""
+    if name not in _registry:
+        _registry[name] = Counter(name, description)
+    return _registry[name]
+
+
+def gauge(name: str, description: str) -> Gauge:
+    """Get or create a process-wide gauge."""
+    if name not in _registry:
+        _registry[name] = Gauge(name, description)
+    return _registry[name]
+
+
+def render_prometheus() -> str:
+    """Render every registered metric in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in _registry.values()) + "\n"
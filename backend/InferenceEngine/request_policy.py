@@ -0,0 +1,231 @@
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import logging
+import os
+import random
+import time
+from typing import AsyncGenerator, Awaitable, Callable, Iterator, Optional, TypeVar
+
+import aiohttp
+import httpx
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# HTTP statuses worth retrying: the request never produced an answer and is safe to repeat
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class InferenceError(Exception):
+    """Base class for failures talking to an inference backend."""
+    retryable = False
+
+
+class NoBackendAvailableError(InferenceError):
+    """No backend is configured for the requested model type."""
+
+
+class InferenceConnectionError(InferenceError):
+    """The backend could not be reached or dropped the connection."""
+    retryable = True
+
+
+class InferenceTimeoutError(InferenceError):
+    """The backend did not answer within the connect/read/first-token timeout."""
+    retryable = True
+
+
+class DeadlineExceededError(InferenceTimeoutError):
+    """The overall deadline of the job ran out. Never retried."""
+    retryable = False
+
+
+class InferenceHTTPError(InferenceError):
+    """The backend answered with a non-success status code."""
+
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"Inference backend returned {status_code}: {body[:500]}")
+        self.status_code = status_code
+        self.body = body
+        self.retryable = status_code in RETRYABLE_STATUS_CODES
+
+
+@dataclass
+class RequestPolicy:
+    """
+    Timeouts and retry behaviour for calls to the inference backends.
+
+    Every timeout is additionally clipped to whatever is left of the deadline of the
+    current job (see deadline_scope), so a single call can never outlive the job.
+    """
+    connect_timeout: float = field(default_factory=lambda: float(os.getenv("INFERENCE_CONNECT_TIMEOUT", 10)))
+    read_timeout: float = field(default_factory=lambda: float(os.getenv("INFERENCE_READ_TIMEOUT", 300)))
+    first_token_timeout: float = field(default_factory=lambda: float(os.getenv("INFERENCE_FIRST_TOKEN_TIMEOUT", 120)))
+    max_attempts: int = field(default_factory=lambda: int(os.getenv("INFERENCE_MAX_ATTEMPTS", 3)))
+    backoff_base: float = field(default_factory=lambda: float(os.getenv("INFERENCE_BACKOFF_BASE", 0.5)))
+    backoff_max: float = field(default_factory=lambda: float(os.getenv("INFERENCE_BACKOFF_MAX", 8)))
+
+    def _clip(self, timeout: float) -> float:
+        remaining = remaining_time()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise DeadlineExceededError("Job deadline exceeded")
+        return min(timeout, remaining)
+
+    def httpx_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self._clip(self.connect_timeout),
+            read=self._clip(self.read_timeout),
+            write=self._clip(self.connect_timeout),
+            pool=self._clip(self.connect_timeout)
+        )
+
+    def aiohttp_timeout(self) -> aiohttp.ClientTimeout:
+        remaining = remaining_time()
+        return aiohttp.ClientTimeout(
+            total=None if remaining is None else self._clip(remaining),
+            sock_connect=self._clip(self.connect_timeout),
+            sock_read=self._clip(self.read_timeout)
+        )
+
+    def first_token_wait(self) -> float:
+        return self._clip(self.first_token_timeout)
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter for the given (zero based) retry attempt."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+default_policy = RequestPolicy()
+
+
+################################################ deadlines ################################################
+
+_deadline: ContextVar[Optional[float]] = ContextVar("inference_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Bound every inference call made inside the block (including tasks spawned from it)
+    by an overall deadline. Nested scopes can only shorten the deadline.
+    """
+    if seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left until the current deadline, or None when no deadline is set."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline():
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceededError("Job deadline exceeded")
+
+
+################################################ retries ################################################
+
+def as_inference_error(error: Exception) -> InferenceError:
+    """Translate transport exceptions from httpx/aiohttp into typed inference errors."""
+    if isinstance(error, InferenceError):
+        return error
+    if isinstance(error, (httpx.TimeoutException, asyncio.TimeoutError)):
+        return InferenceTimeoutError(str(error) or type(error).__name__)
+    if isinstance(error, (httpx.TransportError, aiohttp.ClientConnectionError)):
+        return InferenceConnectionError(str(error) or type(error).__name__)
+    if isinstance(error, aiohttp.ClientResponseError):
+        return InferenceHTTPError(error.status, error.message)
+    return InferenceError(str(error) or type(error).__name__)
+
+
+def _raise(error: InferenceError, cause: Exception):
+    if error is cause:
+        raise error
+    raise error from cause
+
+
+async def _sleep_before_retry(policy: RequestPolicy, attempt: int, description: str, error: InferenceError):
+    delay = policy.backoff(attempt)
+    remaining = remaining_time()
+    if remaining is not None and delay >= remaining:
+        raise DeadlineExceededError(f"{description}: no time left to retry after: {error}") from error
+    logger.warning(f"{description} failed ({error}), retrying in {delay:.2f}s")
+    await asyncio.sleep(delay)
+
+
+async def call_with_retries(
+    call: Callable[[], Awaitable[T]],
+    policy: RequestPolicy = default_policy,
+    description: str = "Inference call"
+) -> T:
+    """
+    Run an idempotent backend call, retrying retryable failures with jittered exponential
+    backoff until the attempts or the job deadline run out.
+
+    Raises:
+        InferenceError: The typed failure of the last attempt
+    """
+    for attempt in range(policy.max_attempts):
+        check_deadline()
+        try:
+            return await call()
+        except Exception as e:
+            error = as_inference_error(e)
+            if not error.retryable or attempt == policy.max_attempts - 1:
+                _raise(error, e)
+            await _sleep_before_retry(policy, attempt, description, error)
+
+
+async def stream_with_retries(
+    open_stream: Callable[[], AsyncGenerator[str, None]],
+    policy: RequestPolicy = default_policy,
+    description: str = "Inference stream"
+) -> AsyncGenerator[str, None]:
+    """
+    Stream tokens from a backend with a first-token timeout. A stream is only retried
+    while no token has been handed to the caller yet, so nothing is ever emitted twice.
+
+    Raises:
+        InferenceError: The typed failure of the last attempt
+    """
+    for attempt in range(policy.max_attempts):
+        check_deadline()
+        stream = open_stream()
+        started = False
+        try:
+            async with asyncio.timeout(policy.first_token_wait()):
+                first = await stream.__anext__()
+            started = True
+            yield first
+            async for chunk in stream:
+                check_deadline()
+                yield chunk
+            return
+        except StopAsyncIteration:
+            return
+        except Exception as e:
+            error = as_inference_error(e)
+            if started or not error.retryable or attempt == policy.max_attempts - 1:
+                _raise(error, e)
+            await _sleep_before_retry(policy, attempt, description, error)
+        finally:
+            await stream.aclose()
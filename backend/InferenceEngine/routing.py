@@ -0,0 +1,95 @@
+from contextlib import asynccontextmanager
+import hashlib
+import logging
+import os
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Maximum number of requests a single vLLM replica should be given before an
+# evaluation spills over to the next replica in its preference order
+VLLM_MAX_INFLIGHT_PER_REPLICA = int(os.getenv("VLLM_MAX_INFLIGHT_PER_REPLICA", 8))
+
+
+def parse_replica_urls(urls: Optional[str]) -> List[str]:
+    """Split a comma separated list of replica URLs, dropping empty entries."""
+    if not urls:
+        return []
+    return [url.strip() for url in urls.split(",") if url.strip()]
+
+
+class ReplicaRouter:
+    """
+    Cache-affinity router for a group of inference replicas serving the same model.
+
+    Requests carrying the same affinity key (an evaluation/session id or a prompt
+    prefix hash) are mapped onto the same replica with rendezvous hashing, so the
+    per-criterion calls of one thesis hit a warm prefix cache. Adding or removing a
+    replica only remaps the keys that were owned by that replica. A request only
+    spills over to the next replica in the key's preference order when its home
+    replica is saturated.
+    """
+
+    def __init__(self, replicas: List[str], max_inflight_per_replica: int = VLLM_MAX_INFLIGHT_PER_REPLICA):
+        if not replicas:
+            raise ValueError("ReplicaRouter needs at least one replica")
+        self.replicas = list(replicas)
+        self.max_inflight_per_replica = max_inflight_per_replica
+        self.inflight: Dict[str, int] = {replica: 0 for replica in self.replicas}
+        self.spillovers = 0
+
+    @staticmethod
+    def _weight(key: str, replica: str) -> int:
+        digest = hashlib.blake2b(f"{key}|{replica}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def rank(self, key: str) -> List[str]:
+        """Replicas ordered by preference for the given affinity key."""
+        return sorted(self.replicas, key=lambda replica: self._weight(key, replica), reverse=True)
+
+    def pick(self, key: Optional[str] = None) -> str:
+        """
+        Pick the replica for a request.
+
+        Args:
+            key: Affinity key. Requests without a key go to the least loaded replica.
+
+        Returns:
+            URL of the chosen replica
+        """
+        if key is None:
+            return min(self.replicas, key=lambda replica: self.inflight[replica])
+
+        preferred = self.rank(key)
+        for position, replica in enumerate(preferred):
+            if self.inflight[replica] < self.max_inflight_per_replica:
+                if position > 0:
+                    self.spillovers += 1
+                    logger.info(f"Replica {preferred[0]} saturated, spilling key {key} over to {replica}")
+                return replica
+
+        # Every replica is saturated: queue on the home replica to keep the prefix cache warm
+        return preferred[0]
+
+    @asynccontextmanager
+    async def lease(self, key: Optional[str] = None) -> AsyncIterator[str]:
+        """Pick a replica and count the request as in flight on it until the block exits."""
+        replica = self.pick(key)
+        self.inflight[replica] += 1
+        try:
+            yield replica
+        finally:
+            self.inflight[replica] -= 1
+
+
+_routers: Dict[Tuple[str, ...], ReplicaRouter] = {}
+
+
+def get_router(replicas: List[str]) -> ReplicaRouter:
+    """Return the process-wide router for a replica group, creating it on first use."""
+    group = tuple(replicas)
+    if group not in _routers:
+        _routers[group] = ReplicaRouter(list(group))
+    return _routers[group]
@@ -0,0 +1,140 @@
+from typing import List
+
+# Use orjson when it is installed; it parses bytes directly and is several times faster
+try:
+    import orjson
+    _loads = orjson.loads
+    _JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    import json
+    _loads = json.loads
+    _JSONDecodeError = json.JSONDecodeError
+
+
+def _openai_delta(event) -> str:
+    try:
+        return event["choices"][0]["delta"].get("content") or ""
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return ""
+
+
+class SSEDecoder:
+    """
+    Incremental decoder for the OpenAI-compatible server-sent events stream returned by vLLM.
+
+    Works on raw byte chunks as they come off the socket (response.aiter_raw()), so no per-line
+    text decoding happens. Events are separated by a blank line and the payload of an event is
+    the concatenation of its "data:" fields, with exactly the "data:" prefix (and one optional
+    space) removed. Comments and other fields are ignored. A "[DONE]" payload sets done.
+    """
+
+    def __init__(self):
+        self.done = False
+        self._buffer = b""
+        self._data: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> List[str]:
+        """
+        Decode a chunk of raw bytes.
+
+        Args:
+            chunk: Bytes as received, possibly ending in the middle of a line
+
+        Returns:
+            The content tokens of the events completed by this chunk
+        """
+        tokens = []
+        buffer = self._buffer + chunk if self._buffer else chunk
+        start = 0
+        while not self.done:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+            line = buffer[start:end]
+            start = end + 1
+            if line.endswith(b"\r"):
+                line = line[:-1]
+
+            if not line:
+                # Blank line: dispatch the event collected so far
+                if self._data:
+                    token = self._dispatch()
+                    if token:
+                        tokens.append(token)
+            elif line.startswith(b"data:"):
+                value = line[6:] if line.startswith(b"data: ") else line[5:]
+                if value == b"[DONE]":
+                    self.done = True
+                else:
+                    self._data.append(value)
+
+        self._buffer = b"" if self.done else buffer[start:]
+        return tokens
+
+    def _dispatch(self) -> str:
+        payload = self._data[0] if len(self._data) == 1 else b"\n".join(self._data)
+        self._data = []
+        try:
+            return _openai_delta(_loads(payload))
+        except _JSONDecodeError:
+            return ""
+
+    def flush(self) -> List[str]:
+        """Dispatch an event left over when the connection closed without a trailing blank line."""
+        tokens = self.feed(b"\n") if self._buffer else []
+        if self._data:
+            token = self._dispatch()
+            if token:
+                tokens.append(token)
+        return tokens
+
+
+class NDJSONDecoder:
+    """
+    Incremental decoder for Ollama's newline-delimited JSON stream. Works on raw byte chunks;
+    the object carrying "done": true sets done.
+    """
+
+    def __init__(self):
+        self.done = False
+        self._buffer = b""
+
+    def feed(self, chunk: bytes) -> List[str]:
+        """
+        Decode a chunk of raw bytes.
+
+        Args:
+            chunk: Bytes as received, possibly ending in the middle of an object
+
+        Returns:
+            The response tokens of the objects completed by this chunk
+        """
+        tokens = []
+        buffer = self._buffer + chunk if self._buffer else chunk
+        start = 0
+        while not self.done:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+            line = buffer[start:end]
+            start = end + 1
+            if not line.strip():
+                continue
+            try:
+                event = _loads(line)
+            except _JSONDecodeError:
+                continue
+            if not isinstance(event, dict):
+                continue
+            token = event.get("response")
+            if token:
+                tokens.append(token)
+            if event.get("done"):
+                self.done = True
+
+        self._buffer = b"" if self.done else buffer[start:]
+        return tokens
+
+    def flush(self) -> List[str]:
+        """Decode an object left over when the connection closed without a trailing newline."""
+        return self.feed(b"\n") if self._buffer.strip() else []
@@ -0,0 +1,132 @@
+"""
+Microbenchmark of the streaming response parsers.
+
+Compares the previous per-line path (bytes decoded to text, split into lines, json.loads on
+every line and chained .get calls) with the incremental byte decoders in stream_decoder.
+
+    python -m backend.InferenceEngine.stream_decoder_bench [--tokens 20000] [--chunk-size 512]
+"""
+import argparse
+import json
+import time
+from typing import Callable, Iterator, List
+
+from backend.InferenceEngine.stream_decoder import NDJSONDecoder, SSEDecoder, _loads
+
+
+def build_sse_stream(tokens: int) -> bytes:
+    events = []
+    for i in range(tokens):
+        event = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "bench-model",
+            "choices": [{"index": 0, "delta": {"content": f" token{i}"}, "logprobs": None, "finish_reason": None}]
+        }
+        events.append(b"data: " + json.dumps(event).encode("utf-8") + b"\n\n")
+    events.append(b"data: [DONE]\n\n")
+    return b"".join(events)
+
+
+def build_ndjson_stream(tokens: int) -> bytes:
+    lines = [
+        json.dumps({"model": "bench-model", "created_at": "2024-01-01T00:00:00Z", "response": f" token{i}", "done": False}).encode("utf-8") + b"\n"
+        for i in range(tokens)
+    ]
+    lines.append(json.dumps({"model": "bench-model", "response": "", "done": True}).encode("utf-8") + b"\n")
+    return b"".join(lines)
+
+
+def chunked(data: bytes, chunk_size: int) -> List[bytes]:
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+def _lines(chunks: List[bytes]) -> Iterator[str]:
+    # Equivalent of httpx's aiter_lines(): incremental text decoding and line splitting
+    pending = ""
+    for chunk in chunks:
+        pending += chunk.decode("utf-8")
+        *lines, pending = pending.split("\n")
+        yield from lines
+    if pending:
+        yield pending
+
+
+def legacy_sse(chunks: List[bytes]) -> List[str]:
+    out = []
+    for line in _lines(chunks):
+        if line:
+            raw_line = line.lstrip("data: ").strip()
+            if raw_line == "[DONE]":
+                break
+            try:
+                data = json.loads(raw_line)
+                content = data.get('choices', [{}])[0].get('delta', {}).get('content', '')
+                if content:
+                    out.append(content)
+            except json.JSONDecodeError:
+                continue
+    return out
+
+
+def legacy_ndjson(chunks: List[bytes]) -> List[str]:
+    out = []
+    for line in _lines(chunks):
+        if line:
+            try:
+                data = json.loads(line)
+                if 'response' in data and data['response']:
+                    out.append(data['response'])
+            except json.JSONDecodeError:
+                continue
+    return out
+
+
+def decoder_run(decoder_factory: Callable) -> Callable[[List[bytes]], List[str]]:
+    def run(chunks: List[bytes]) -> List[str]:
+        decoder = decoder_factory()
+        out = []
+        for chunk in chunks:
+            tokens = decoder.feed(chunk)
+            if tokens:
+                out.append(tokens[0] if len(tokens) == 1 else "".join(tokens))
+            if decoder.done:
+                return out
+        out.extend(decoder.flush())
+        return out
+    return run
+
+
+def bench(name: str, parser: Callable[[List[bytes]], List[str]], chunks: List[bytes], tokens: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parser(chunks)
+        best = min(best, time.perf_counter() - started)
+    print(f"{name:<28} {best * 1000:9.2f} ms   {tokens / best:12,.0f} tokens/s")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=512, help="bytes per network read")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"JSON backend: {_loads.__module__}")
+    for label, stream, legacy, decoder in (
+        ("SSE (vLLM)", build_sse_stream(args.tokens), legacy_sse, decoder_run(SSEDecoder)),
+        ("NDJSON (Ollama)", build_ndjson_stream(args.tokens), legacy_ndjson, decoder_run(NDJSONDecoder)),
+    ):
+        chunks = chunked(stream, args.chunk_size)
+        assert "".join(legacy(chunks)) == "".join(decoder(chunks)), f"{label}: decoders disagree"
+        print(f"\n{label}: {args.tokens} tokens, {len(stream):,} bytes in {len(chunks)} reads")
+        old = bench("per-line json.loads", legacy, chunks, args.tokens, args.repeat)
+        new = bench("incremental byte decoder", decoder, chunks, args.tokens, args.repeat)
+        print(f"{'speedup':<28} {old / new:9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+from backend.InferenceEngine.inference_engines import EnvConfig, ModelType
+from backend.InferenceEngine.metrics import gauge
+from backend.InferenceEngine.routing import VLLM_MAX_INFLIGHT_PER_REPLICA, get_router
+
+import asyncio
+import httpx
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# A vLLM replica counts as saturated once this many requests wait in its own queue...
+ADMISSION_MAX_WAITING_REQUESTS = int(os.getenv("ADMISSION_MAX_WAITING_REQUESTS", 4))
+# ...or its KV cache is this full (0-1); beyond that it preempts and recomputes requests
+ADMISSION_MAX_KV_CACHE_USAGE = float(os.getenv("ADMISSION_MAX_KV_CACHE_USAGE", 0.9))
+# How long a scrape of the backends' load is reused
+ADMISSION_SCRAPE_SECONDS = float(os.getenv("ADMISSION_SCRAPE_SECONDS", 2))
+# New submissions are refused with 429 once this many analyses wait (0: never)
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", 200))
+# Lower bound of the Retry-After sent with a 429
+ADMISSION_MIN_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_MIN_RETRY_AFTER_SECONDS", 30))
+
+backend_waiting_gauge = gauge("dissertation_admission_backend_waiting", "Requests waiting in each inference replica's queue")
+backend_kv_cache_gauge = gauge("dissertation_admission_backend_kv_cache_usage", "KV cache usage of each vLLM replica (0-1)")
+headroom_gauge = gauge("dissertation_admission_headroom", "Analyses the inference backends can take before saturating")
+
+_WAITING_METRIC = "vllm:num_requests_waiting"
+# vLLM renamed the KV cache metric; both report a fraction between 0 and 1
+_KV_CACHE_METRICS = ("vllm:kv_cache_usage_perc", "vllm:gpu_cache_usage_perc")
+
+
+def parse_prometheus(text: str, names: List[str]) -> Dict[str, float]:
+    """Sum the samples of the given metrics (over all label sets) in a Prometheus text exposition."""
+    values: Dict[str, float] = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name = line.split("{", 1)[0].split(" ", 1)[0]
+        if name in names:
+            try:
+                values[name] = values.get(name, 0.0) + float(line.rsplit(" ", 1)[-1])
+            except ValueError:
+                continue
+    return values
+
+
+def metrics_url(replica_url: str) -> str:
+    """The /metrics URL of the server behind a chat completions URL."""
+    parts = urlsplit(replica_url)
+    return f"{parts.scheme}://{parts.netloc}/metrics"
+
+
+class AdmissionController:
+    """
+    Decides whether a new analysis may start now, from how loaded the inference backends really
+    are rather than from a fixed number of concurrent analyses. Each vLLM replica's /metrics is
+    scraped for its queue depth and KV cache usage; a replica whose metrics cannot be read is
+    judged by this process's own in-flight requests to it. Ollama has no queue to measure, so
+    with Ollama only (or no backend) analyses are admitted while it answers and the analysis
+    slots alone cap how many run at once, as they do in every case.
+    """
+
+    def __init__(
+        self,
+        config: Optional[EnvConfig] = None,
+        model_type: ModelType = ModelType.ANALYSIS,
+        max_waiting: int = ADMISSION_MAX_WAITING_REQUESTS,
+        max_kv_cache_usage: float = ADMISSION_MAX_KV_CACHE_USAGE,
+        scrape_seconds: float = ADMISSION_SCRAPE_SECONDS
+    ):
+        self.config = config or EnvConfig()
+        self.model_type = model_type
+        self.max_waiting = max_waiting
+        self.max_kv_cache_usage = max_kv_cache_usage
+        self.scrape_seconds = scrape_seconds
+        # None: nothing to measure, the analysis slots are the only bound
+        self.headroom: Optional[int] = 0
+        self.scraped_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    async def _replica_headroom(self, client: httpx.AsyncClient, replica: str) -> int:
+        try:
+            response = await client.get(metrics_url(replica))
+            response.raise_for_status()
+            values = parse_prometheus(response.text, [_WAITING_METRIC, *_KV_CACHE_METRICS])
+        except (httpx.HTTPError, ValueError) as e:
+            logger.debug(f"Could not scrape {metrics_url(replica)}: {e}")
+            values = {}
+
+        if _WAITING_METRIC not in values:
+            # No metrics: fall back to the requests this process has in flight on the replica
+            inflight = get_router(self.config.get_vllm_replicas(self.model_type)).inflight.get(replica, 0)
+            return max(VLLM_MAX_INFLIGHT_PER_REPLICA - inflight, 0)
+
+        waiting = values[_WAITING_METRIC]
+        kv_cache_usage = next((values[name] for name in _KV_CACHE_METRICS if name in values), 0.0)
+        backend_waiting_gauge.set(waiting, replica=replica)
+        backend_kv_cache_gauge.set(kv_cache_usage, replica=replica)
+        if kv_cache_usage >= self.max_kv_cache_usage:
+            return 0
+        return max(int(self.max_waiting - waiting), 0)
+
+    async def _ollama_headroom(self, client: httpx.AsyncClient) -> Optional[int]:
+        try:
+            response = await client.get(f"{self.config.ollama_url.rstrip('/')}/api/ps")
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning(f"Ollama is not answering, holding new analyses back: {e}")
+            return 0
+        # Ollama does not expose its queue; the analysis slots alone bound the load
+        return None
+
+    async def _scrape(self) -> Optional[int]:
+        async with httpx.AsyncClient(timeout=self.scrape_seconds) as client:
+            if self.config.is_vllm_available(self.model_type):
+                replicas = self.config.get_vllm_replicas(self.model_type)
+                return sum(await asyncio.gather(*(self._replica_headroom(client, replica) for replica in replicas)))
+            if self.config.is_ollama_available(self.model_type):
+                return await self._ollama_headroom(client)
+        # No backend to watch
+        return None
+
+    async def admits(self) -> bool:
+        """
+        Whether a new analysis may start now. Each admitted analysis uses up one unit of the
+        headroom measured by the last scrape, so a burst is not let through before the backends
+        report the load it adds.
+        """
+        async with self._lock:
+            if time.monotonic() - self.scraped_at >= self.scrape_seconds:
+                self.headroom = await self._scrape()
+                self.scraped_at = time.monotonic()
+            if self.headroom is None:
+                return True
+            headroom_gauge.set(self.headroom)
+            if self.headroom <= 0:
+                return False
+            self.headroom -= 1
+            return True
+
+    async def wait_until_admitted(self):
+        while not await self.admits():
+            await asyncio.sleep(self.scrape_seconds)
+
+
+def retry_after_if_full(status: Dict, max_queued: int = ADMISSION_MAX_QUEUED) -> Optional[int]:
+    """
+    Seconds a client should wait before submitting again, given the queue status, or None if
+    the queue still takes new analyses.
+    """
+    if not max_queued or status["waiting"] < max_queued:
+        return None
+    return max(int(status["eta_seconds_for_new_job"]), ADMISSION_MIN_RETRY_AFTER_SECONDS)
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """Return the process-wide admission controller."""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
@@ -0,0 +1,167 @@
+from backend.src.job_queue import QUEUE_BACKEND
+from backend.src.redis_client import get_redis
+
+from abc import ABC, abstractmethod
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Optional
+import zlib
+
+# Compress blobs with zstd when it is installed, zlib otherwise; the first byte records which
+try:
+    import zstandard
+    _zstd_compressor = zstandard.ZstdCompressor(level=3)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+except ImportError:
+    zstandard = None
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Queues that consumers on other hosts read from
+_SHARED_QUEUE_BACKENDS = ("kafka", "redis")
+# Where queued request payloads are kept: "disk" (a volume every consumer mounts) or "redis";
+# defaults to redis when the queue is read from other hosts, as they cannot see local disk
+BLOB_STORE_BACKEND = os.getenv("BLOB_STORE_BACKEND", "redis" if QUEUE_BACKEND in _SHARED_QUEUE_BACKENDS else "disk").lower()
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "/tmp/dissertation_blobs")
+# Blobs are kept at least this long after their last write
+BLOB_TTL_SECONDS = int(os.getenv("BLOB_TTL_SECONDS", 7 * 24 * 3600))
+
+_ZSTD = b"z"
+_ZLIB = b"d"
+
+
+def compress(data: bytes) -> bytes:
+    if zstandard is not None:
+        return _ZSTD + _zstd_compressor.compress(data)
+    return _ZLIB + zlib.compress(data, 6)
+
+
+def decompress(blob: bytes) -> bytes:
+    codec, body = blob[:1], blob[1:]
+    if codec == _ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Blob is zstd-compressed but zstandard is not installed")
+        return _zstd_decompressor.decompress(body)
+    if codec == _ZLIB:
+        return zlib.decompress(body)
+    raise ValueError(f"Unknown blob codec {codec!r}")
+
+
+def content_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore(ABC):
+    """
+    Content-addressed store for large payloads. put() returns the sha256 of the data, so
+    identical payloads are stored once; blobs are compressed at rest.
+    """
+
+    @abstractmethod
+    async def put(self, data: bytes) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes:
+        """Raises KeyError if the blob does not exist (or has expired)."""
+        raise NotImplementedError
+
+    async def put_json(self, obj) -> str:
+        return await self.put(json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+    async def get_json(self, key: str):
+        return json.loads(await self.get(key))
+
+
+class DiskBlobStore(BlobStore):
+    """Blobs as files under root (e.g. a volume shared by the replicas), sharded by key prefix."""
+
+    def __init__(self, root: str = BLOB_STORE_DIR, ttl_seconds: int = BLOB_TTL_SECONDS):
+        self.root = Path(root)
+        self.ttl_seconds = ttl_seconds
+        self._last_sweep = -3600.0
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def _write(self, key: str, data: bytes):
+        path = self._path(key)
+        if path.exists():
+            # Already stored: refresh its age so the expiry sweep keeps it
+            path.touch()
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(compress(data))
+        os.replace(tmp, path)
+
+    def _read(self, key: str) -> bytes:
+        try:
+            return decompress(self._path(key).read_bytes())
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def _sweep(self):
+        cutoff = time.time() - self.ttl_seconds
+        for path in self.root.glob("*/*"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    async def put(self, data: bytes) -> str:
+        key = content_key(data)
+        await asyncio.to_thread(self._write, key, data)
+        # Expire old blobs at most once an hour
+        if time.monotonic() - self._last_sweep > 3600:
+            self._last_sweep = time.monotonic()
+            await asyncio.to_thread(self._sweep)
+        return key
+
+    async def get(self, key: str) -> bytes:
+        return await asyncio.to_thread(self._read, key)
+
+
+class RedisBlobStore(BlobStore):
+    def __init__(self, client, prefix: str = "dissertation:blob:", ttl_seconds: int = BLOB_TTL_SECONDS):
+        self.client = client
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+
+    async def put(self, data: bytes) -> str:
+        key = content_key(data)
+        # Only the first writer stores the blob; later ones just extend its lifetime
+        if not await self.client.set(self.prefix + key, compress(data), ex=self.ttl_seconds, nx=True):
+            await self.client.expire(self.prefix + key, self.ttl_seconds)
+        return key
+
+    async def get(self, key: str) -> bytes:
+        blob = await self.client.get(self.prefix + key)
+        if blob is None:
+            raise KeyError(key)
+        return decompress(blob)
+
+
+_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    """Return the process-wide blob store chosen by BLOB_STORE_BACKEND."""
+    global _store
+    if _store is None:
+        if BLOB_STORE_BACKEND == "redis":
+            _store = RedisBlobStore(get_redis())
+        else:
+            if QUEUE_BACKEND in _SHARED_QUEUE_BACKENDS:
+                logger.warning(f"Queued requests are kept under {BLOB_STORE_DIR}, while the {QUEUE_BACKEND} queue is read by "
+                               "other hosts: it must be a volume shared by every replica and worker")
+            _store = DiskBlobStore()
+    return _store
@@ -0,0 +1,110 @@
+from backend.src.types import Base
+
+import logging
+import os
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from typing import AsyncIterator, Iterator, Optional
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SQLALCHEMY_DATABASE_URL = os.getenv("SQLALCHEMY_DATABASE_URL")
+# Async driver URL; derived from SQLALCHEMY_DATABASE_URL when not set (pymysql -> aiomysql, ...)
+SQLALCHEMY_ASYNC_DATABASE_URL = os.getenv("SQLALCHEMY_ASYNC_DATABASE_URL")
+# Connections kept open per process, and how many more may be opened under load
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+# Seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Connections are replaced after this many seconds, before MySQL's wait_timeout drops them
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+
+_ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_url(url: str) -> str:
+    """The URL of the same database with the async driver for its dialect."""
+    url = make_url(url)
+    driver = _ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver known for {url.drivername}; set SQLALCHEMY_ASYNC_DATABASE_URL")
+    return url.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def _pool_options(url: str) -> dict:
+    options = {"pool_pre_ping": True, "pool_recycle": DB_POOL_RECYCLE}
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+
+# Sync engine, for scripts and anything that cannot await
+engine: Optional[Engine] = None
+SessionLocal: Optional[sessionmaker] = None
+# Async engine, for the API and workers; queries never block the event loop
+async_engine: Optional[AsyncEngine] = None
+AsyncSessionLocal: Optional[async_sessionmaker] = None
+
+if SQLALCHEMY_DATABASE_URL:
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, **_pool_options(SQLALCHEMY_DATABASE_URL))
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    async_url = SQLALCHEMY_ASYNC_DATABASE_URL or async_database_url(SQLALCHEMY_DATABASE_URL)
+    async_engine = create_async_engine(async_url, **_pool_options(async_url))
+    # Objects stay readable after commit, instead of reloading lazily (which async sessions cannot)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+else:
+    logger.warning("SQLALCHEMY_DATABASE_URL is not set; the database is unavailable")
+
+
+def _create_schema(conn):
+    Base.metadata.create_all(conn)
+    # create_all skips existing tables, so add indexes introduced after a table was created
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+async def init_db():
+    """Create the tables and indexes that do not exist yet."""
+    if async_engine is None:
+        logger.warning("Database engine is not initialized. Skipping table creation.")
+        return
+    try:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(_create_schema)
+        logger.info("Database tables created successfully.")
+    except Exception as e:
+        logger.error(f"An error occurred during database initialization: {e}")
+
+
+async def close_db():
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """Provide an async database session as a dependency."""
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Database session factory is not initialized.")
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_db() -> Iterator[Session]:
+    """Provide a sync database session (for scripts; endpoints use get_async_db)."""
+    if SessionLocal is None:
+        raise RuntimeError("Database session factory is not initialized.")
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
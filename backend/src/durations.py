@@ -0,0 +1,152 @@
+from backend.InferenceEngine.metrics import counter
+from backend.src.redis_client import get_redis
+
+import asyncio
+from docx import Document
+from docx.parts.image import ImagePart
+import fitz
+from io import BytesIO
+import logging
+import math
+import os
+from typing import Dict, Optional
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# "memory" learns per process; "redis" shares the measurements between replicas and workers
+QUEUE_STATUS_BACKEND = os.getenv("QUEUE_STATUS_BACKEND", "memory").lower()
+# Weight of the newest measurement in the rolling averages
+STAGE_DURATION_SMOOTHING = float(os.getenv("STAGE_DURATION_SMOOTHING", 0.2))
+
+# Pipeline stages and what they are measured in: PDF pages extracted, images analysed,
+# summary chunks and rubric criteria evaluated. The seeds are used until there are measurements.
+STAGES = ("page", "image", "chunk", "criterion")
+_SEED_SECONDS_PER_UNIT = {"page": 0.05, "image": 4.0, "chunk": 3.0, "criterion": 45.0}
+_SEED_UNITS_PER_DOCUMENT = {"page": 80.0, "image": 15.0, "chunk": 100.0, "criterion": 6.0}
+
+# Mirrors the pipeline: process_pdf analyses images from page 7 on, and summaries are made
+# of chunks of about 1000 words (6000 characters)
+_IMAGE_ANALYSIS_START_PAGE = 6
+_CHARS_PER_CHUNK = 6000
+
+stage_seconds_counter = counter("dissertation_stage_seconds_total", "Time spent in each pipeline stage")
+stage_units_counter = counter("dissertation_stage_units_total", "Units processed by each pipeline stage")
+
+
+class DurationModel:
+    """
+    Rolling averages of how long each pipeline stage takes per unit, and of how many units a
+    document has, for estimating how long a job will take.
+    """
+
+    def __init__(self, client=None, smoothing: float = STAGE_DURATION_SMOOTHING):
+        self.client = client
+        self.key = "dissertation:stage_durations"
+        self.smoothing = smoothing
+        self.seconds_per_unit: Dict[str, float] = dict(_SEED_SECONDS_PER_UNIT)
+        self.units_per_document: Dict[str, float] = dict(_SEED_UNITS_PER_DOCUMENT)
+        self._saving: Optional[asyncio.Task] = None
+
+    def record(self, stage: str, units: float, seconds: float):
+        """Add a measurement of a stage that processed units in seconds."""
+        stage_seconds_counter.inc(seconds, stage=stage)
+        stage_units_counter.inc(units, stage=stage)
+        if units <= 0:
+            return
+        a = self.smoothing
+        self.seconds_per_unit[stage] = (1 - a) * self.seconds_per_unit[stage] + a * seconds / units
+        self.units_per_document[stage] = (1 - a) * self.units_per_document[stage] + a * units
+        if self.client is not None and (self._saving is None or self._saving.done()):
+            self._saving = asyncio.get_running_loop().create_task(self._save())
+
+    def estimate(self, **units: float) -> float:
+        """
+        Expected seconds for a job. Stages not given are assumed typical, so pass 0 for
+        stages the job skips (e.g. page=0, image=0, chunk=0 for an already pre-analysed one).
+        """
+        return sum(
+            self.seconds_per_unit[stage] * units.get(stage, self.units_per_document[stage])
+            for stage in STAGES
+        )
+
+    async def _save(self):
+        try:
+            mapping = {f"{stage}:seconds_per_unit": self.seconds_per_unit[stage] for stage in STAGES}
+            mapping.update({f"{stage}:units_per_document": self.units_per_document[stage] for stage in STAGES})
+            await self.client.hset(self.key, mapping=mapping)
+        except Exception as e:
+            logger.warning(f"Could not save stage durations: {e}")
+
+    async def refresh(self):
+        """Load the measurements shared by the other processes."""
+        if self.client is None:
+            return
+        try:
+            shared = await self.client.hgetall(self.key)
+        except Exception as e:
+            logger.warning(f"Could not load stage durations: {e}")
+            return
+        for field, value in shared.items():
+            field = field.decode() if isinstance(field, bytes) else field
+            stage, _, name = field.partition(":")
+            if stage in STAGES and name in ("seconds_per_unit", "units_per_document"):
+                getattr(self, name)[stage] = float(value)
+
+
+_model: Optional[DurationModel] = None
+
+
+def get_duration_model() -> DurationModel:
+    """Return the process-wide stage duration model chosen by QUEUE_STATUS_BACKEND."""
+    global _model
+    if _model is None:
+        _model = DurationModel(get_redis() if QUEUE_STATUS_BACKEND == "redis" else None)
+    return _model
+
+
+def record_stage(stage: str, units: float, seconds: float):
+    get_duration_model().record(stage, units, seconds)
+
+
+def _pdf_units(content: bytes) -> Dict[str, float]:
+    doc = fitz.open(stream=content, filetype="pdf")
+    try:
+        chars, images = 0, 0
+        for page_num in range(doc.page_count):
+            page = doc[page_num]
+            chars += len(page.get_text())
+            if page_num >= _IMAGE_ANALYSIS_START_PAGE:
+                images += len(page.get_images(full=True))
+        return {"page": doc.page_count, "image": images, "chunk": max(1, math.ceil(chars / _CHARS_PER_CHUNK))}
+    finally:
+        doc.close()
+
+
+def _docx_units(content: bytes) -> Dict[str, float]:
+    document = Document(BytesIO(content))
+    chars = sum(len(paragraph.text) for paragraph in document.paragraphs)
+    images = sum(1 for rel in document.part.rels.values() if isinstance(rel.target_part, ImagePart))
+    return {"page": 0, "image": images, "chunk": max(1, math.ceil(chars / _CHARS_PER_CHUNK))}
+
+
+async def document_units(filename: str, content: bytes) -> Dict[str, float]:
+    """
+    Pages, analysable images and summary chunks of a document, read from its structure without
+    running the extraction. Unknown stages are left out, so estimates treat them as typical.
+    """
+    try:
+        if filename.endswith(".pdf"):
+            return await asyncio.to_thread(_pdf_units, content)
+        if filename.endswith(".docx"):
+            return await asyncio.to_thread(_docx_units, content)
+    except Exception as e:
+        logger.warning(f"Could not read the structure of {filename}: {e}")
+    return {}
+
+
+async def predict_document_seconds(filename: str, content: bytes, rubric: dict) -> float:
+    """Expected seconds to extract, pre-analyse and evaluate a document against a rubric."""
+    units = await document_units(filename, content)
+    return get_duration_model().estimate(**units, criterion=len(rubric))
@@ -0,0 +1,553 @@
+from backend.src.redis_client import get_redis
+from backend.src.session_router import POD_ID
+
+from abc import ABC, abstractmethod
+from aiokafka import AIOKafkaProducer, AIOKafkaConsumer, ConsumerRebalanceListener, TopicPartition, OffsetAndMetadata
+from aiokafka.codec import has_lz4, has_zstd
+from aiokafka.errors import CommitFailedError
+import asyncio
+from contextlib import suppress
+from kafka.admin import KafkaAdminClient, NewPartitions, NewTopic
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, Optional
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Where queued analyses wait: "kafka", "redis" (Redis Streams), "sqlite" (one host) or
+# "memory" (one process, for local runs and load tests)
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "kafka").lower()
+QUEUE_NAME = os.getenv("QUEUE_NAME", os.getenv("KAFKA_TOPIC", "dissertation_analysis_queue"))
+QUEUE_CONSUMER_GROUP = os.getenv("QUEUE_CONSUMER_GROUP", os.getenv("KAFKA_CONSUMER_GROUP", "dissertation_analysis_consumer"))
+# redis/sqlite: a message taken by a consumer that stops renewing its claim (e.g. the pod
+# crashed) is handed to another consumer after this long
+QUEUE_CLAIM_IDLE_SECONDS = float(os.getenv("QUEUE_CLAIM_IDLE_SECONDS", 300))
+# sqlite: how often an idle consumer looks for messages published by other processes
+QUEUE_POLL_SECONDS = float(os.getenv("QUEUE_POLL_SECONDS", 1))
+QUEUE_SQLITE_PATH = os.getenv("QUEUE_SQLITE_PATH", "/tmp/dissertation_queue.sqlite3")
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092")
+# Messages only carry a reference to the request (claim check), so the default limit is plenty
+KAFKA_MAX_REQUEST_SIZE = int(os.getenv("KAFKA_MAX_REQUEST_SIZE", 1048576))
+# zstd or lz4 when the codec is installed (aiokafka[zstd] / aiokafka[lz4]); empty disables compression
+KAFKA_COMPRESSION_TYPE = os.getenv("KAFKA_COMPRESSION_TYPE", "zstd" if has_zstd() else "lz4" if has_lz4() else "") or None
+# Messages are keyed by session id and spread over the partitions; every replica consumes in
+# the same group, so at most KAFKA_NUM_PARTITIONS replicas take queued work at once
+KAFKA_NUM_PARTITIONS = int(os.getenv("KAFKA_NUM_PARTITIONS", 12))
+KAFKA_REPLICATION_FACTOR = int(os.getenv("KAFKA_REPLICATION_FACTOR", 1))
+# A consumer holding all the analyses it may stops fetching until one finishes, which can take
+# up to the analysis deadline; Kafka must not evict it from the group meanwhile
+KAFKA_MAX_POLL_INTERVAL_SECONDS = float(os.getenv("KAFKA_MAX_POLL_INTERVAL_SECONDS", 3900))
+
+
+class QueuedMessage:
+    """A message taken from the queue. token identifies it to the backend for ack()."""
+
+    def __init__(self, key: Optional[str], value: bytes, token=None):
+        self.key = key
+        self.value = value
+        self.token = token
+
+
+class QueueConsumer(ABC):
+    """
+    Takes messages one at a time. A message stays claimed by this consumer until ack(); the
+    caller acks once it has committed to processing it, which may be in a different order
+    than the messages were taken.
+    """
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @abstractmethod
+    async def get(self) -> QueuedMessage:
+        """Wait for the next message."""
+        raise NotImplementedError
+
+    def pause(self):
+        """Stop fetching ahead; the next get() is a while away."""
+
+    def resume(self):
+        pass
+
+    @abstractmethod
+    async def ack(self, message: QueuedMessage) -> bool:
+        """
+        Remove the message from the queue.
+
+        Returns:
+            False if the message is no longer this consumer's (it was handed to another
+            consumer meanwhile), in which case the caller must leave it alone
+        """
+        raise NotImplementedError
+
+    async def requeue(self, message: QueuedMessage):
+        """
+        Give back a message taken but not acked, as the consumer is stopping. Claimed messages
+        return to the queue when the consumer stops, so by default there is nothing to do.
+        """
+
+
+class ClaimingConsumer(QueueConsumer):
+    """A consumer whose unacked messages are renewed in the background so they are not reclaimed."""
+
+    def __init__(self, claim_idle_seconds: float = QUEUE_CLAIM_IDLE_SECONDS):
+        self.claim_idle_seconds = claim_idle_seconds
+        self.claimed: Dict[str, QueuedMessage] = {}
+        self._renewer: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._renewer = asyncio.create_task(self._renew_loop())
+
+    async def stop(self):
+        if self._renewer:
+            self._renewer.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._renewer
+            self._renewer = None
+
+    async def _renew_loop(self):
+        while True:
+            await asyncio.sleep(self.claim_idle_seconds / 3)
+            if not self.claimed:
+                continue
+            try:
+                await self._renew(list(self.claimed))
+            except Exception as e:
+                logger.warning(f"Could not renew claims on queued messages: {e}")
+
+    @abstractmethod
+    async def _renew(self, tokens: list):
+        raise NotImplementedError
+
+
+class JobQueue(ABC):
+    """A work queue shared by the producers and consumers of queued analyses."""
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def ensure(self):
+        """Create the queue if it does not exist."""
+
+    @abstractmethod
+    async def publish(self, key: str, value: bytes):
+        raise NotImplementedError
+
+    @abstractmethod
+    def consumer(self) -> QueueConsumer:
+        raise NotImplementedError
+
+
+class MemoryJobQueue(JobQueue):
+    """In-process queue. Nothing survives a restart and other processes cannot see it."""
+
+    def __init__(self):
+        self.messages: asyncio.Queue = asyncio.Queue()
+
+    async def publish(self, key: str, value: bytes):
+        await self.messages.put(QueuedMessage(key, value))
+
+    def consumer(self) -> QueueConsumer:
+        return MemoryQueueConsumer(self)
+
+
+class MemoryQueueConsumer(QueueConsumer):
+    def __init__(self, queue: MemoryJobQueue):
+        self.queue = queue
+
+    async def get(self) -> QueuedMessage:
+        return await self.queue.messages.get()
+
+    async def ack(self, message: QueuedMessage) -> bool:
+        return True
+
+    async def requeue(self, message: QueuedMessage):
+        await self.queue.messages.put(message)
+
+
+class KafkaJobQueue(JobQueue):
+    """
+    Kafka topic with KAFKA_NUM_PARTITIONS partitions; messages are keyed by session id and
+    consumers share them through a consumer group.
+    """
+
+    def __init__(self, topic: str = QUEUE_NAME, group_id: str = QUEUE_CONSUMER_GROUP):
+        self.topic = topic
+        self.group_id = group_id
+        self.producer: Optional[AIOKafkaProducer] = None
+
+    async def start(self):
+        if not self.producer:
+            logger.info("Initializing Kafka producer...")
+            producer = AIOKafkaProducer(
+                bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+                max_request_size=KAFKA_MAX_REQUEST_SIZE,
+                compression_type=KAFKA_COMPRESSION_TYPE
+            )
+            await producer.start()
+            self.producer = producer
+            logger.info("Kafka producer initialized.")
+
+    async def stop(self):
+        if self.producer:
+            await self.producer.stop()
+            self.producer = None
+
+    async def ensure(self):
+        # kafka-python's admin client blocks, so keep it off the event loop
+        await asyncio.to_thread(self._ensure_topic)
+
+    def _ensure_topic(self):
+        admin_client = KafkaAdminClient(
+            bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+            client_id="dissertation_analysis_admin"
+        )
+        try:
+            if self.topic not in admin_client.list_topics():
+                try:
+                    admin_client.create_topics([NewTopic(
+                        name=self.topic,
+                        num_partitions=KAFKA_NUM_PARTITIONS,
+                        replication_factor=KAFKA_REPLICATION_FACTOR
+                    )])
+                    logger.info(f"Kafka topic '{self.topic}' created with {KAFKA_NUM_PARTITIONS} partitions.")
+                except Exception as e:
+                    logger.error(f"Error creating Kafka topic: {e}")
+            else:
+                # Grow topics created before partitioning (partitions can only be added, never removed)
+                try:
+                    partitions = len(admin_client.describe_topics([self.topic])[0]["partitions"])
+                    if partitions < KAFKA_NUM_PARTITIONS:
+                        admin_client.create_partitions({self.topic: NewPartitions(total_count=KAFKA_NUM_PARTITIONS)})
+                        logger.info(f"Kafka topic '{self.topic}' grown from {partitions} to {KAFKA_NUM_PARTITIONS} partitions.")
+                    else:
+                        logger.info(f"Kafka topic '{self.topic}' already exists with {partitions} partitions.")
+                except Exception as e:
+                    logger.error(f"Error checking partitions of Kafka topic: {e}")
+        finally:
+            admin_client.close()
+
+    async def publish(self, key: str, value: bytes):
+        await self.start()
+        try:
+            await self.producer.send_and_wait(self.topic, value, key=key.encode("utf-8"))
+        except Exception as e:
+            if "UNKNOWN_TOPIC_OR_PARTITION" not in str(e):
+                raise
+            logger.info(f"Topic '{self.topic}' not found. Creating topic...")
+            await self.ensure()
+            await self.producer.send_and_wait(self.topic, value, key=key.encode("utf-8"))
+
+    def consumer(self) -> QueueConsumer:
+        return KafkaQueueConsumer(self)
+
+
+class QueueRebalanceListener(ConsumerRebalanceListener):
+    """
+    Offsets are committed as each message is fetched, so nothing is pending when partitions
+    are revoked. Newly assigned partitions are paused straight away if the consumer is paused.
+    """
+
+    def __init__(self, queue_consumer: "KafkaQueueConsumer"):
+        self.queue_consumer = queue_consumer
+
+    async def on_partitions_revoked(self, revoked):
+        if revoked:
+            logger.info(f"Kafka partitions revoked: {sorted(tp.partition for tp in revoked)}")
+
+    async def on_partitions_assigned(self, assigned):
+        logger.info(f"Kafka partitions assigned: {sorted(tp.partition for tp in assigned)}")
+        if assigned and self.queue_consumer.paused:
+            self.queue_consumer.consumer.pause(*assigned)
+
+
+class KafkaQueueConsumer(QueueConsumer):
+    """
+    Consumes this replica's share of the partitions. While paused, its partitions are paused
+    too, so Kafka hands pending work to replicas that fetch.
+
+    Messages taken ahead wait for a slot and start in whatever order the scheduler grants
+    them, while a partition's offset can only move forward. So each offset is committed as
+    its message is fetched, and the message is this consumer's from then on: ack() has
+    nothing left to do, and requeue() publishes the message again. Since offsets are committed
+    before processing, delivery is at-most-once: the analyses of a replica that dies are not
+    delivered again.
+    """
+
+    def __init__(self, queue: KafkaJobQueue):
+        self.queue = queue
+        self.paused = False
+        self.consumer = AIOKafkaConsumer(
+            bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+            group_id=queue.group_id,
+            auto_offset_reset="earliest",
+            enable_auto_commit=False,
+            max_poll_interval_ms=int(KAFKA_MAX_POLL_INTERVAL_SECONDS * 1000),
+        )
+        self.consumer.subscribe([queue.topic], listener=QueueRebalanceListener(self))
+
+    async def start(self):
+        await self.consumer.start()
+
+    async def stop(self):
+        await self.consumer.stop()
+
+    async def get(self) -> QueuedMessage:
+        while True:
+            msg = await self.consumer.getone()
+            partition = TopicPartition(msg.topic, msg.partition)
+            try:
+                await self.consumer.commit({partition: OffsetAndMetadata(msg.offset + 1, "")})
+            except CommitFailedError as e:
+                # Revoked meanwhile: the partition's new owner will deliver this message again
+                logger.warning(f"Could not commit Kafka offset {msg.offset + 1} during a rebalance: {e}")
+                continue
+            logger.info(f"Committed Kafka offset {msg.offset + 1} on partition {partition.partition}.")
+            key = msg.key.decode("utf-8") if msg.key else None
+            return QueuedMessage(key, msg.value, (partition, msg.offset))
+
+    def pause(self):
+        self.paused = True
+        self.consumer.pause(*self.consumer.assignment())
+
+    def resume(self):
+        self.paused = False
+        self.consumer.resume(*self.consumer.assignment())
+
+    async def ack(self, message: QueuedMessage) -> bool:
+        # Committed when fetched
+        return True
+
+    async def requeue(self, message: QueuedMessage):
+        await self.queue.publish(message.key, message.value)
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Redis Stream read through a consumer group. Messages a consumer took but never acked are
+    claimed by another consumer once they have been idle for QUEUE_CLAIM_IDLE_SECONDS.
+    """
+
+    def __init__(self, client, name: str = QUEUE_NAME, group: str = QUEUE_CONSUMER_GROUP):
+        self.client = client
+        self.stream = f"dissertation:queue:{name}"
+        self.group = group
+
+    async def ensure(self):
+        try:
+            await self.client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+            logger.info(f"Redis stream '{self.stream}' created with consumer group '{self.group}'.")
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def publish(self, key: str, value: bytes):
+        await self.client.xadd(self.stream, {"key": key, "value": value})
+
+    def consumer(self) -> QueueConsumer:
+        return RedisQueueConsumer(self)
+
+
+class RedisQueueConsumer(ClaimingConsumer):
+    def __init__(self, queue: RedisJobQueue):
+        super().__init__()
+        self.queue = queue
+        self.client = queue.client
+        self.name = f"{POD_ID}:{os.getpid()}"
+
+    async def start(self):
+        await self.queue.ensure()
+        await super().start()
+
+    async def stop(self):
+        await super().stop()
+        # Hand messages taken but not acked back right away instead of after the claim timeout
+        if self.claimed:
+            with suppress(Exception):
+                await self.client.xclaim(self.queue.stream, self.queue.group, self.name, 0, list(self.claimed),
+                                         idle=int(self.claim_idle_seconds * 1000), justid=True)
+            self.claimed.clear()
+
+    def _message(self, entry_id, fields) -> QueuedMessage:
+        entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+        key = fields.get(b"key", fields.get("key"))
+        value = fields.get(b"value", fields.get("value"))
+        message = QueuedMessage(key.decode() if isinstance(key, bytes) else key, value, entry_id)
+        self.claimed[entry_id] = message
+        return message
+
+    async def get(self) -> QueuedMessage:
+        stream, group = self.queue.stream, self.queue.group
+        while True:
+            # Messages abandoned by a dead consumer go first
+            _, entries, *_ = await self.client.xautoclaim(
+                stream, group, self.name, int(self.claim_idle_seconds * 1000), start_id="0-0", count=1
+            )
+            if entries:
+                logger.info(f"Claimed queued message {entries[0][0]} abandoned by another consumer")
+                return self._message(*entries[0])
+
+            response = await self.client.xreadgroup(group, self.name, {stream: ">"}, count=1, block=5000)
+            for _, entries in response or []:
+                if entries:
+                    return self._message(*entries[0])
+
+    async def _renew(self, tokens: list):
+        # Claiming our own messages resets their idle time
+        await self.client.xclaim(self.queue.stream, self.queue.group, self.name, 0, tokens, justid=True)
+
+    async def ack(self, message: QueuedMessage) -> bool:
+        self.claimed.pop(message.token, None)
+        pending = await self.client.xpending_range(
+            self.queue.stream, self.queue.group, min=message.token, max=message.token, count=1
+        )
+        owner = pending[0]["consumer"] if pending else None
+        if (owner.decode() if isinstance(owner, bytes) else owner) != self.name:
+            logger.info(f"Queued message {message.token} was claimed by another consumer")
+            return False
+        await self.client.xack(self.queue.stream, self.queue.group, message.token)
+        await self.client.xdel(self.queue.stream, message.token)
+        return True
+
+
+class SqliteJobQueue(JobQueue):
+    """
+    Queue in a SQLite file, for a single host without a broker. Every call runs in a thread
+    with its own connection.
+    """
+
+    def __init__(self, path: str = QUEUE_SQLITE_PATH, name: str = QUEUE_NAME):
+        self.path = path
+        self.name = name
+        self._published = asyncio.Event()
+        self._ensured = False
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def _run(self, statement: str, args: tuple = ()):
+        connection = self._connect()
+        try:
+            return connection.execute(statement, args).rowcount
+        finally:
+            connection.close()
+
+    async def ensure(self):
+        # Publishing creates the table too, as a fresh file may be written before any consumer starts
+        if self._ensured:
+            return
+        await asyncio.to_thread(self._run, """
+            CREATE TABLE IF NOT EXISTS queued_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                queue TEXT NOT NULL,
+                key TEXT,
+                value BLOB NOT NULL,
+                claimed_by TEXT,
+                claimed_at REAL
+            )
+        """)
+        self._ensured = True
+
+    async def publish(self, key: str, value: bytes):
+        await self.ensure()
+        await asyncio.to_thread(self._run, "INSERT INTO queued_jobs (queue, key, value) VALUES (?, ?, ?)",
+                                (self.name, key, value))
+        self._published.set()
+
+    def _claim(self, consumer: str, claim_idle_seconds: float) -> Optional[tuple]:
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = connection.execute(
+                "SELECT id, key, value FROM queued_jobs WHERE queue = ? AND (claimed_by IS NULL OR claimed_at < ?) "
+                "ORDER BY id LIMIT 1",
+                (self.name, now - claim_idle_seconds)
+            ).fetchone()
+            if row:
+                connection.execute("UPDATE queued_jobs SET claimed_by = ?, claimed_at = ? WHERE id = ?",
+                                   (consumer, now, row[0]))
+            connection.execute("COMMIT")
+            return row
+        finally:
+            connection.close()
+
+    def consumer(self) -> QueueConsumer:
+        return SqliteQueueConsumer(self)
+
+
+class SqliteQueueConsumer(ClaimingConsumer):
+    def __init__(self, queue: SqliteJobQueue):
+        super().__init__()
+        self.queue = queue
+        self.name = f"{POD_ID}:{os.getpid()}:{id(self)}"
+
+    async def start(self):
+        await self.queue.ensure()
+        await super().start()
+
+    async def stop(self):
+        await super().stop()
+        if self.claimed:
+            await asyncio.to_thread(self.queue._run, "UPDATE queued_jobs SET claimed_by = NULL WHERE claimed_by = ?",
+                                    (self.name,))
+            self.claimed.clear()
+
+    async def get(self) -> QueuedMessage:
+        while True:
+            self.queue._published.clear()
+            row = await asyncio.to_thread(self.queue._claim, self.name, self.claim_idle_seconds)
+            if row:
+                message = QueuedMessage(row[1], row[2], row[0])
+                self.claimed[row[0]] = message
+                return message
+            # Woken at once by publishes from this process, polling for other processes
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.queue._published.wait(), QUEUE_POLL_SECONDS)
+
+    async def _renew(self, tokens: list):
+        placeholders = ",".join("?" * len(tokens))
+        await asyncio.to_thread(
+            self.queue._run,
+            f"UPDATE queued_jobs SET claimed_at = ? WHERE claimed_by = ? AND id IN ({placeholders})",
+            (time.time(), self.name, *tokens)
+        )
+
+    async def ack(self, message: QueuedMessage) -> bool:
+        self.claimed.pop(message.token, None)
+        deleted = await asyncio.to_thread(self.queue._run, "DELETE FROM queued_jobs WHERE id = ? AND claimed_by = ?",
+                                          (message.token, self.name))
+        if not deleted:
+            logger.info(f"Queued job {message.token} was claimed by another consumer")
+        return bool(deleted)
+
+
+_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue chosen by QUEUE_BACKEND."""
+    global _queue
+    if _queue is None:
+        if QUEUE_BACKEND == "redis":
+            _queue = RedisJobQueue(get_redis())
+        elif QUEUE_BACKEND == "sqlite":
+            _queue = SqliteJobQueue()
+        elif QUEUE_BACKEND == "memory":
+            _queue = MemoryJobQueue()
+        else:
+            _queue = KafkaJobQueue()
+    return _queue
@@ -1,11 +1,20 @@
-from backend.src.logic import CancellationToken, process_request
+from backend.InferenceEngine.request_policy import deadline_scope
+from backend.src.blob_store import get_blob_store
+from backend.src.durations import document_units
+from backend.src.job_queue import QueueConsumer, QueuedMessage, get_job_queue
+from backend.src.logic import ANALYSIS_DEADLINE_SECONDS, process_request, start_session
+from backend.src.pipeline import process_document
+from backend.src.queue_status import estimate_job, get_queue_tracker
+from backend.src.results import Evaluation, get_results_writer
+from backend.src.session_router import get_session_router
+from backend.src.session_stream import AnalysisSession
+from backend.src.scheduler import Priority, get_scheduler
+from backend.src.slots import MAX_CONCURRENT_USERS, SlotLease
 from backend.src.types import QueryRequestThesisAndRubric
 
-from aiokafka import AIOKafkaProducer, AIOKafkaConsumer, TopicPartition, OffsetAndMetadata
-from aiokafka.admin import NewTopic
 import asyncio
+from contextlib import suppress
 import json
-from kafka.admin import KafkaAdminClient, NewTopic
 import logging 
 import os
 
@@ -16,202 +25,280 @@ logger = logging.getLogger(__name__)
 
 
 SQLALCHEMY_DATABASE_URL = os.getenv("SQLALCHEMY_DATABASE_URL")
-KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092")
-KAFKA_TOPIC = os.getenv("KAFKA_TOPIC", "dissertation_analysis_queue")
-current_users = 0
-MAX_CONCURRENT_USERS = int(os.getenv("MAX_CONCURRENT_USERS", 3))
-
-producer = None
-queue_lock = asyncio.Lock()
-user_lock = asyncio.Lock()
-
-consumer_initialized = False
-consumer_lock = asyncio.Lock()
-consumer = None  # Single consumer instance
-notification_clients = {}  # Map of session IDs to WebSocket connections
-connected_websockets = {}
-producer = None  # Single producer instance
+# Dequeued analyses this replica runs at once (as far as the analysis slots allow)
+KAFKA_CONSUMER_CONCURRENCY = int(os.getenv("KAFKA_CONSUMER_CONCURRENCY", MAX_CONCURRENT_USERS))
+# Queued analyses taken ahead, each waiting in the scheduler, so it can choose the next by
+# priority and fair share instead of in queue order; the replica stops fetching once it holds
+# this many beyond KAFKA_CONSUMER_CONCURRENCY
+KAFKA_CONSUMER_PREFETCH = int(os.getenv("KAFKA_CONSUMER_PREFETCH", 8))
+# API pods consume the queue themselves unless analysis runs on separate da-worker processes
+RUN_EMBEDDED_WORKER = os.getenv("RUN_EMBEDDED_WORKER", "true").lower() in ("1", "true", "yes")
+
 consumer_task = None  # Single consumer task
-    
-async def increment_users():
-    global current_users
-    async with user_lock:
-        current_users += 1
-        logger.info(f"Incremented users: {current_users}")
-        return current_users
-
-async def decrement_users():
-    global current_users
-    async with user_lock:
-        current_users = max(0, current_users - 1)
-        logger.info(f"Decremented users: {current_users}")
-        return current_users
-
-async def get_active_users():
-    global current_users
-    async with user_lock:
-        return current_users
-    
+running_jobs = set()  # Dequeued jobs being processed by this process
+waiting_jobs = set()  # Dequeued jobs waiting for a slot
+
+
+def start_consumer():
+    """Start this replica's queue consumer task if it is not running."""
+    global consumer_task
+    if not RUN_EMBEDDED_WORKER:
+        return
+    if not consumer_task or consumer_task.done():
+        logger.info("Starting queue consumer task...")
+        consumer_task = asyncio.create_task(consume_messages())
+
+
+async def stop_kafka():
+    """Stop consuming and close the queue's connections."""
+    global consumer_task
+    if consumer_task:
+        consumer_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await consumer_task
+        consumer_task = None
+    await get_job_queue().stop()
+
 
 async def send_to_kafka(message: dict):
     """
-    Send a message to the Kafka queue and start the consumer if needed.
+    Send a message to the analysis queue (Kafka, or the backend chosen by QUEUE_BACKEND) and
+    start the consumer if needed.
     """
-    global producer, consumer_task
-    if not producer:
-        try:
-            logger.info("Initializing Kafka producer...")
-            producer = AIOKafkaProducer(
-                bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
-                max_request_size=200000000
-            )
-            await producer.start()
-            logger.info("Kafka producer initialized.")
-        except Exception as e:
-            logger.error(f"Error initializing Kafka producer: {e}")
-            return
-
     try:
-        # Check payload size
-        payload = json.dumps(message).encode("utf-8")
-        logger.info(f"Payload size: {len(payload)} bytes")
-        
-        # Send message
-        logger.info(f"Sending message to Kafka: {message}")
-        await producer.send_and_wait(KAFKA_TOPIC, payload)
-        logger.info("Message successfully sent to Kafka.")
+        # Claim check: the request goes to the blob store and the queue only carries a reference
+        payload = json.dumps(await check_in_request(message)).encode("utf-8")
+
+        logger.info(f"Queueing request for session {message.get('session_id')} ({len(payload)} bytes)")
+        await get_job_queue().publish(message["session_id"], payload)
+        logger.info("Message successfully queued.")
+        await get_queue_tracker().enqueue(
+            message["session_id"], estimate_job(message), Priority.parse(message.get("priority")), message.get("evaluator", "unknown")
+        )
 
         # Start consumer if not already running
-        if not consumer_task or consumer_task.done():
-            logger.info("Starting Kafka consumer task...")
-            consumer_task = asyncio.create_task(consume_messages())
+        start_consumer()
     except Exception as e:
-        logger.error(f"Error sending message to Kafka: {e}")
-        if "UNKNOWN_TOPIC_OR_PARTITION" in str(e):
-            logger.info("Topic not found. Creating topic...")
-            try:
-                await create_kafka_topic()
-                await producer.send_and_wait(KAFKA_TOPIC, payload)
-                logger.info(f"Message sent successfully after creating topic '{KAFKA_TOPIC}'.")
-            except Exception as topic_creation_error:
-                logger.error(f"Error creating topic or resending message: {topic_creation_error}")
+        logger.error(f"Error queueing message: {e}")
+
+
+async def check_in_request(message: dict) -> dict:
+    """
+    Store a queued request in the blob store and return the small envelope sent through Kafka.
+    The session id stays in the envelope, so identical requests share one blob.
+    """
+    request = {k: v for k, v in message.items() if k != "session_id"}
+    blob_key = await get_blob_store().put_json(request)
+    return {"session_id": message.get("session_id"), "blob": blob_key}
 
 
-async def process_dequeued_request(data: dict, session_id: str):
+async def enqueue_document(
+    session_id: str,
+    filename: str,
+    content: bytes,
+    rubric: dict,
+    feedback: str | None = None,
+    evaluator: str = "unknown",
+    rubric_name: str | None = None
+):
     """
-    Process a dequeued Kafka request using a reconnected WebSocket.
+    Queue an uploaded document for extraction, pre-analysis and evaluation by a worker, at bulk
+    priority. The evaluation is stored when it completes, like those of batch_input.
+    """
+    units = await document_units(filename, content)
+    file_key = await get_blob_store().put(content)
+    await send_to_kafka({
+        "session_id": session_id,
+        "kind": "document",
+        "filename": filename,
+        "file": file_key,
+        "rubric": rubric,
+        "feedback": feedback,
+        "evaluator": evaluator,
+        "rubric_name": rubric_name,
+        "priority": Priority.BULK.name.lower(),
+        "units": units
+    })
+
+
+async def check_out_request(envelope: dict) -> dict:
+    """Load the request a queue envelope refers to. Messages queued before claim checks carry it inline."""
+    if "blob" not in envelope:
+        return envelope
+    request = await get_blob_store().get_json(envelope["blob"])
+    request["session_id"] = envelope["session_id"]
+    return request
+
+
+async def process_dequeued_request(data: dict, session_id: str, lease: SlotLease):
+    """
+    Process a dequeued job: a pre-analysed request to evaluate, or (kind "document") an
+    uploaded file to run through the whole pipeline. Generation starts right away into the
+    session's event log; the frontend is told to reconnect and replays it from the start. If
+    it does not attach within the resume grace period, a pre-analysed request is cancelled;
+    a document runs headless to the end and its evaluation is stored.
     """
     try:
+        headless = data.get("kind") == "document"
+        if headless:
+            content = await get_blob_store().get(data["file"])
+            work = lambda session: evaluate_document(session, data, content)
+        else:
+            request = QueryRequestThesisAndRubric(**data)
+            work = lambda session: process_request(session, request)
+
+        with deadline_scope(ANALYSIS_DEADLINE_SECONDS):
+            session = start_session(session_id, work, headless=headless)
+
         # Notify the frontend to reconnect
         await notify_frontend_to_reconnect(session_id)
 
-        # Wait for the frontend to reconnect
-        websocket = await wait_for_websocket_reconnect(session_id)
-
-        # Process the request via the reconnected WebSocket
-        request = QueryRequestThesisAndRubric(**data)
-        await process_request(websocket, request, CancellationToken())
+        await session.task
 
     except Exception as e:
         logger.error(f"Error processing dequeued request for session {session_id}: {e}")
     finally:
-        # Decrement active users after processing
-        await decrement_users()
+        # Free the analysis slot after processing
+        await lease.release()
+        await get_queue_tracker().finish(session_id)
+
+
+async def evaluate_document(session: AnalysisSession, data: dict, content: bytes):
+    """Run a queued document through the pipeline and store its evaluation."""
+    result = await process_document(session, data["filename"], content, data["rubric"], data.get("feedback"))
+    if result is None:
+        return
+    try:
+        await get_results_writer().submit(Evaluation.from_result(result, data.get("rubric_name"), data.get("evaluator", "unknown")))
+    except Exception as e:
+        logger.error(f"Error storing the evaluation of session {session.session_id}: {e}")
+        await session.publish({"type": "error", "data": {"message": f"Failed to store the evaluation: {e}"}})
 
 
+class LocalCapacity:
+    """Dequeued analyses held by this replica, with an event set whenever one finishes."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.running = 0
+        self._freed = asyncio.Event()
+
+    @property
+    def full(self) -> bool:
+        return self.running >= self.limit
+
+    def take(self):
+        self.running += 1
+
+    def give(self):
+        self.running = max(0, self.running - 1)
+        self._freed.set()
+
+    async def wait_until_free(self):
+        while self.full:
+            self._freed.clear()
+            await self._freed.wait()
+
+
+async def run_queued_job(consumer: QueueConsumer, msg: QueuedMessage, data: dict, session_id: str):
+    """Wait for the scheduler to grant a dequeued job a slot, then take it off the queue and process it."""
+    try:
+        lease = await get_scheduler().acquire(
+            session_id, data.get("evaluator", "unknown"), Priority.parse(data.get("priority")), cost=estimate_job(data)
+        )
+    except asyncio.CancelledError:
+        # The consumer is stopping before the job got a slot: leave it to another consumer
+        await consumer.requeue(msg)
+        raise
+
+    task = asyncio.current_task()
+    waiting_jobs.discard(task)
+    # Take the message off the queue before starting
+    if not await consumer.ack(msg):
+        logger.info(f"Leaving session {session_id} to the consumer that now owns it")
+        await lease.release()
+        return
+
+    running_jobs.add(task)
+    try:
+        await get_queue_tracker().start(session_id, estimate_job(data))
+        await process_dequeued_request(data, session_id, lease)
+    finally:
+        running_jobs.discard(task)
+
 
 async def consume_messages():
     """
-    Consume messages from Kafka and process them using a real WebSocket connection.
+    Consume queued requests. Messages are taken ahead of free slots, up to
+    KAFKA_CONSUMER_PREFETCH, and each waits for a slot in the scheduler on its own; a bulk job
+    at the head of a partition thus never holds back the interactive ones behind it. The
+    consumer stops fetching while this replica holds all it may, so pending work goes to
+    replicas that have room.
     """
-    global consumer
-    if consumer is None:
-        consumer = AIOKafkaConsumer(
-            KAFKA_TOPIC,
-            bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
-            group_id="dissertation_analysis_consumer",
-            auto_offset_reset="earliest",
-        )
-        await consumer.start()
+    capacity = LocalCapacity(KAFKA_CONSUMER_CONCURRENCY + KAFKA_CONSUMER_PREFETCH)
+    consumer = get_job_queue().consumer()
+    await consumer.start()
 
     try:
-        async for msg in consumer:
-            # Wait for a slot to become available
-            while await get_active_users() >= MAX_CONCURRENT_USERS:
-                await asyncio.sleep(1)
-
-            # Increment active users for dequeued requests
-            await increment_users()
+        while True:
+            if capacity.full:
+                consumer.pause()
+                await capacity.wait_until_free()
+                consumer.resume()
 
+            msg = await consumer.get()
+            session_id = None
             try:
-                # Parse Kafka message
-                data = json.loads(msg.value.decode("utf-8"))
-                session_id = data.get("session_id")
+                # Parse the message and fetch the request it refers to
+                envelope = json.loads(msg.value)
+                session_id = envelope.get("session_id")
                 if not session_id:
-                    logger.error("Session ID missing in Kafka message. Skipping.")
-                    await decrement_users()
-                    continue
-
-                # Commit the Kafka offset immediately
-                await consumer.commit({
-                    TopicPartition(KAFKA_TOPIC, msg.partition): OffsetAndMetadata(msg.offset + 1, "")
-                })
-                logger.info(f"Committed Kafka offset {msg.offset + 1} for session {session_id}.")
-
-                # Process the request in a separate task
-                asyncio.create_task(process_dequeued_request(data, session_id))
-
+                    raise ValueError("Session ID missing in queued message")
+                data = await check_out_request(envelope)
             except Exception as e:
-                logger.error(f"Error processing Kafka message: {e}")
-                await decrement_users()  # Ensure active users count is decremented in case of failure
+                logger.error(f"Error processing queued message, dropping it: {e}")
+                await consumer.ack(msg)
+                if session_id:
+                    await report_dropped_job(session_id)
+                continue
+
+            capacity.take()
+            task = asyncio.create_task(run_queued_job(consumer, msg, data, session_id))
+            waiting_jobs.add(task)
+            task.add_done_callback(waiting_jobs.discard)
+            task.add_done_callback(lambda _: capacity.give())
 
     finally:
+        # Jobs still waiting for a slot go back to the queue; running ones are left to finish
+        waiting = list(waiting_jobs)
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
         await consumer.stop()
 
 
+async def report_dropped_job(session_id: str):
+    """Tell a queued session its request could not be loaded, and stop counting it as queued."""
+    try:
+        await get_queue_tracker().finish(session_id)
+        await get_session_router().send(session_id, {
+            "type": "error",
+            "session_id": session_id,
+            "data": {"message": "The queued request could not be loaded. Please submit it again."}
+        }, wait=0)
+    except Exception as e:
+        logger.error(f"Error reporting dropped request of session {session_id}: {e}")
+
+
 async def notify_frontend_to_reconnect(session_id: str):
     """
-    Notify the frontend to reconnect for the given session ID.
+    Notify the frontend to reconnect for the given session ID, through whichever replica holds
+    its notification WebSocket.
     """
     try:
-        websocket = notification_clients.get(session_id)
-        if websocket:
-            await websocket.send_json({"type": "reconnect", "session_id": session_id})
+        if await get_session_router().send(session_id, {"type": "reconnect", "session_id": session_id}):
             logger.info(f"Notified frontend to reconnect for session {session_id}")
         else:
             logger.warning(f"No active notification WebSocket for session {session_id}")
     except Exception as e:
         logger.error(f"Error notifying frontend for session {session_id}: {e}")
-
-async def wait_for_websocket_reconnect(session_id: str, timeout: int = 30):
-    """
-    Wait for the frontend to reconnect within the timeout period.
-    """
-    logger.info(f"Waiting for frontend to reconnect for session {session_id}")
-    for _ in range(timeout):
-        if session_id in connected_websockets:
-            logger.info(f"Frontend reconnected for session {session_id}")
-            return connected_websockets[session_id]
-        await asyncio.sleep(1)
-    raise TimeoutError(f"Frontend did not reconnect for session {session_id}")
-
-async def create_kafka_topic():
-    """Ensure the Kafka topic exists."""
-    admin_client = KafkaAdminClient(
-        bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
-        client_id="dissertation_analysis_admin"
-    )
-    topic_list = admin_client.list_topics()
-    if KAFKA_TOPIC not in topic_list:
-        try:
-            admin_client.create_topics([NewTopic(
-                name=KAFKA_TOPIC,
-                num_partitions=1,
-                replication_factor=1
-            )])
-            logger.info(f"Kafka topic '{KAFKA_TOPIC}' created successfully.")
-        except Exception as e:
-            logger.error(f"Error creating Kafka topic: {e}")
-    else:
-        logger.info(f"Kafka topic '{KAFKA_TOPIC}' already exists.")
-    admin_client.close()
@@ -1,49 +1,161 @@
+from backend.Agents.prompt_builder import CriterionPromptBuilder
 from backend.Agents.text_agents import scoring_agent
 from backend.InferenceEngine.inference_engines import stream_llm, ModelType, invoke_llm
+from backend.src.durations import record_stage
+from backend.src.session_stream import AnalysisSession, create_session, find_event_log, get_session
+from backend.src.stream_coalescer import coalesce_tokens
 from backend.src.types import QueryRequestThesisAndRubric
+from backend.src.ws_sender import WebSocketSender
 
+import asyncio
+from contextlib import aclosing, suppress
 from fastapi import WebSocket, WebSocketDisconnect
+import json
 import logging
+import os
 import re
+import time
+from typing import Awaitable, Callable, Optional
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class CancellationToken:
-    def __init__(self):
-        self.is_cancelled = False
-        self.ws_closed = False
+# Overall deadline for one evaluation; every inference call of the job is bounded by it
+ANALYSIS_DEADLINE_SECONDS = float(os.getenv("ANALYSIS_DEADLINE_SECONDS", 3600))
 
-    def cancel(self):
-        self.is_cancelled = True
+async def watch_for_disconnect(websocket: WebSocket) -> bool:
+    """
+    Wait until the client disconnects or sends {"type": "cancel"}. The analysis protocol sends
+    nothing after the initial payload, so this is the only reader.
 
-    def mark_closed(self):
-        self.ws_closed = True
+    Returns:
+        True if the client asked to cancel the evaluation, False if it just went away
+    """
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return False
+            if message.get("text"):
+                try:
+                    control = json.loads(message["text"])
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(control, dict) and control.get("type") == "cancel":
+                    return True
+    except (RuntimeError, WebSocketDisconnect):
+        return False
+
+
+def start_session(session_id: str, work: Callable[[AnalysisSession], Awaitable[None]], headless: bool = False) -> AnalysisSession:
+    """
+    Start an evaluation in the background. work(session) publishes its messages to the
+    session's event log, independent of any WebSocket; clients follow them with stream_session.
+    A headless evaluation runs to the end even if no client ever attaches.
+    """
+    session = create_session(session_id, headless)
+    session.task = asyncio.create_task(_run_session(session, work))
+    return session
 
-async def safe_send(websocket: WebSocket, cancellation_token: CancellationToken, message: dict) -> bool:
-    """Safely send a message through the WebSocket if it's still open"""
-    if not cancellation_token.ws_closed:
-        try:
-            await websocket.send_json(message)
-            return True
-        except RuntimeError as e:
-            print(f"WebSocket send failed: {str(e)}")
-            cancellation_token.mark_closed()
-            return False
-    return False
+
+async def _run_session(session: AnalysisSession, work: Callable[[AnalysisSession], Awaitable[None]]):
+    # Cancelling the session unwinds the running stream, which closes the upstream HTTP
+    # connection so the inference server aborts the sequence immediately
+    session.cancellation_token.add_callback(asyncio.current_task().cancel)
+    try:
+        await session.publish({"type": "session", "data": {"session_id": session.session_id}})
+        await work(session)
+    except asyncio.CancelledError:
+        logger.info(f"Evaluation cancelled for session {session.session_id}")
+    finally:
+        await session.finish()
+        logger.info(f"Evaluation finished for session {session.session_id}: {session.stats.chunks} chunks received from the model")
+
+
+async def stream_session(websocket: WebSocket, session_id: str, last_seq: int = 0):
+    """
+    Send a session's events after last_seq to the client, then its new events as they are
+    produced, until the evaluation ends or the client goes away. Every message carries its
+    "seq", so a client that loses the connection can resume from the last one it saw.
+
+    Messages go through a bounded WebSocketSender, so a slow client never stalls generation;
+    a client that falls too far behind is dropped and can reconnect to resume.
+    """
+    session = get_session(session_id)
+    log = session.log if session else await find_event_log(session_id)
+    if log is None:
+        await websocket.send_json({"type": "error", "data": {"message": f"Unknown or expired analysis session {session_id}"}})
+        await websocket.close()
+        return
+
+    sender = WebSocketSender(websocket)
+
+    async def forward() -> bool:
+        async with aclosing(log.follow(last_seq)) as events:
+            async for seq, event in events:
+                if not sender.send({"seq": seq, **event}):
+                    return False
+        return True
+
+    forwarding = asyncio.create_task(forward())
+    watcher = asyncio.create_task(watch_for_disconnect(websocket))
+    sender.on_close(forwarding.cancel)
+    if session:
+        session.attach()
+    try:
+        done, _ = await asyncio.wait({forwarding, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if watcher in done and watcher.result():
+            logger.info(f"Client requested cancellation of session {session_id}")
+            if session:
+                session.cancel()
+    finally:
+        watcher.cancel()
+        forwarding.cancel()
+        for task in (forwarding, watcher):
+            with suppress(asyncio.CancelledError):
+                await task
+        if session:
+            session.detach()
+        await sender.aclose()
+        if forwarding.done() and not forwarding.cancelled() and forwarding.result():
+            # The evaluation is over and everything was delivered
+            with suppress(Exception):
+                await websocket.close()
+        stats = sender.stats
+        logger.info(
+            f"Analysis stream for session {session_id} closed: {stats.frames} frames "
+            f"({stats.bytes} bytes, {sender.merged} chunks merged for a slow client)"
+        )
+
+
+async def run_resumable_request(websocket: WebSocket, request: QueryRequestThesisAndRubric, session_id: str):
+    """
+    Evaluate a request for the client connected on websocket. If the connection drops, the
+    evaluation carries on and the client can resume it on the reconnect endpoint; this returns
+    once the evaluation has finished or was cancelled.
+    """
+    session = start_session(session_id, lambda session: process_request(session, request))
+    try:
+        await stream_session(websocket, session_id)
+    finally:
+        with suppress(asyncio.CancelledError):
+            await session.task
 
 
-async def process_request(websocket: WebSocket, request: QueryRequestThesisAndRubric, cancellation_token: CancellationToken):
+async def process_request(session: AnalysisSession, request: QueryRequestThesisAndRubric) -> Optional[dict]:
     """
-    Process the dissertation analysis request and stream results via the WebSocket.
+    Process the dissertation analysis request and publish results to the session's event log.
+    Returns the final results (the data of the "complete" message), or None if the evaluation
+    did not get that far.
     """
+    cancellation_token = session.cancellation_token
     try:
         # Send initial metadata to the frontend
         degree_of_student = request.pre_analysis.degree
         name_of_author = request.pre_analysis.name
         topic = request.pre_analysis.topic
 
-        await websocket.send_json({
+        await session.publish({
             "type": "metadata",
             "data": {
                 "name": name_of_author,
@@ -52,9 +164,15 @@ async def process_request(websocket: WebSocket, request: QueryRequestThesisAndRu
             }
         })
 
-        # Dissertation evaluation process
-        dissertation_system_prompt = """You are an impartial academic evaluator - an expert in analyzing the summarized dissertation provided to you. 
-Your task is to assess the quality of the provided summarized dissertation in relation to specific evaluation criteria."""
+        # Dissertation evaluation process. Every criterion prompt shares the same prefix,
+        # so the inference backend only processes the summary once per evaluation.
+        prompt_builder = CriterionPromptBuilder(
+            summary=request.pre_analysis.pre_analyzed_summary,
+            name_of_author=name_of_author,
+            degree_of_student=degree_of_student,
+            feedback=request.feedback
+        )
+        logger.info(f"Shared prompt prefix hash for {name_of_author}: {prompt_builder.prefix_hash}")
 
         evaluation_results = {}
         total_score = 0
@@ -66,96 +184,79 @@ Your task is to assess the quality of the provided summarized dissertation in re
                 break
 
             # Build the user prompt for this criterion
-            dissertation_user_prompt = f"""
-# Input Materials
-## Dissertation Text
-{request.pre_analysis.pre_analyzed_summary}
-
-## Evaluation Context
-- Author: {name_of_author}
-- Academic Field: {degree_of_student}
-
-## Assessment Criterion and its explanation
-### {criterion}:
-#### Explanation: {explanation['criteria_explanation']}
-
-{explanation['criteria_output']}
-
-Please make sure that you critique the work heavily, including all improvements that can be made.
-
-DO NOT SCORE THE DISSERTATION, YOU ARE TO PROVIDE ONLY DETAILED ANALYSIS, AND NO SCORES ASSOCIATED WITH IT.
-"""
-            if request.feedback:
-                dissertation_user_prompt += f'\nIMPORTANT(The following feedback was provided by an expert. Consider the feedback properly, and ensure your evaluation follows this feedback): {request.feedback}'
+            dissertation_user_prompt = prompt_builder.build(criterion, explanation)
 
             # Notify the frontend about the start of the criterion evaluation
-            await websocket.send_json({
+            if not await session.publish({
                 "type": "criterion_start",
                 "data": {"criterion": criterion}
-            })
+            }):
+                break
 
             # Stream analysis results to the client
             analysis_chunks = []
+            started = time.monotonic()
             try:
-                async for chunk in stream_llm(
-                    system_prompt=dissertation_system_prompt,
+                # Coalesce tokens so the client gets a few frames per second instead of one per token
+                async with aclosing(coalesce_tokens(stream_llm(
+                    system_prompt=prompt_builder.system_prompt,
                     user_prompt=dissertation_user_prompt,
                     model_type=ModelType.ANALYSIS,
-                    cancellation_token=cancellation_token
-                ):
-                    if cancellation_token.is_cancelled:
-                        logger.info(f"Streaming canceled for criterion: {criterion}")
-                        break
-
-                    analysis_chunks.append(chunk)
-                    await websocket.send_json({
-                        "type": "analysis_chunk",
-                        "data": {
-                            "criterion": criterion,
-                            "chunk": chunk
-                        }
-                    })
-
-                if not cancellation_token.is_cancelled:
-                    analyzed_dissertation = "".join(analysis_chunks)
-
-                    # Perform scoring
-                    graded_response = await scoring_agent(
-                        analyzed_dissertation, 
-                        criterion, 
-                        explanation['score_explanation'], 
-                        explanation['criteria_explanation'],
-                        request.feedback
-                    )
-
-                    # Extract score using regex
-                    pattern = r"spanda_score\s*:\s*(?:\*{1,2}\s*)?(\d+(?:\.\d+)?)\s*(?:\*{1,2})?"
-                    match = re.search(pattern, graded_response, re.IGNORECASE)
-                    score = float(match.group(1)) if match else 0
-                    total_score += score
-
-                    # Send criterion completion details
-                    await websocket.send_json({
-                        "type": "criterion_complete",
-                        "data": {
-                            "criterion": criterion,
-                            "score": score,
-                            "full_analysis": analyzed_dissertation
-                        }
-                    })
-
-                    evaluation_results[criterion] = {
-                        "feedback": analyzed_dissertation,
-                        "score": score
+                    cancellation_token=cancellation_token,
+                    affinity_key=prompt_builder.prefix_hash
+                ), stats=session.stats)) as stream:
+                    async for chunk in stream:
+                        analysis_chunks.append(chunk)
+                        if not await session.publish({
+                            "type": "analysis_chunk",
+                            "data": {
+                                "criterion": criterion,
+                                "chunk": chunk
+                            }
+                        }):
+                            logger.info(f"Streaming canceled for criterion: {criterion}")
+                            break
+
+                if cancellation_token.is_cancelled:
+                    break
+
+                analyzed_dissertation = "".join(analysis_chunks)
+
+                # Perform scoring
+                graded_response = await scoring_agent(
+                    analyzed_dissertation, 
+                    criterion, 
+                    explanation['score_explanation'], 
+                    explanation['criteria_explanation'],
+                    request.feedback
+                )
+
+                # Extract score using regex
+                pattern = r"spanda_score\s*:\s*(?:\*{1,2}\s*)?(\d+(?:\.\d+)?)\s*(?:\*{1,2})?"
+                match = re.search(pattern, graded_response, re.IGNORECASE)
+                score = float(match.group(1)) if match else 0
+                total_score += score
+
+                record_stage("criterion", 1, time.monotonic() - started)
+
+                # Send criterion completion details
+                await session.publish({
+                    "type": "criterion_complete",
+                    "data": {
+                        "criterion": criterion,
+                        "score": score,
+                        "full_analysis": analyzed_dissertation
                     }
+                })
+
+                evaluation_results[criterion] = {
+                    "feedback": analyzed_dissertation,
+                    "score": score
+                }
 
-            except WebSocketDisconnect:
-                logger.info(f"WebSocket disconnected during analysis of criterion: {criterion}")
-                cancellation_token.mark_closed()
-                break
             except Exception as e:
                 logger.error(f"Error processing criterion {criterion}: {str(e)}")
-                await websocket.send_json({
+                await session.publish({
                     "type": "error",
                     "data": {
                         "message": f"Error processing criterion {criterion}: {str(e)}",
@@ -166,21 +267,20 @@ DO NOT SCORE THE DISSERTATION, YOU ARE TO PROVIDE ONLY DETAILED ANALYSIS, AND NO
 
         # Send final evaluation results
         if not cancellation_token.is_cancelled:
-            await websocket.send_json({
-                "type": "complete",
-                "data": {
-                    "criteria_evaluations": evaluation_results,
-                    "total_score": total_score,
-                    "name": name_of_author,
-                    "degree": degree_of_student,
-                    "topic": topic
-                }
-            })
+            result = {
+                "criteria_evaluations": evaluation_results,
+                "total_score": total_score,
+                "name": name_of_author,
+                "degree": degree_of_student,
+                "topic": topic
+            }
+            if await session.publish({"type": "complete", "data": result}):
+                return result
 
     except Exception as e:
         logger.error(f"Error in process_request: {e}")
-        if not cancellation_token.ws_closed:
-            await websocket.send_json({"type": "error", "data": {"message": str(e)}})
+        await session.publish({"type": "error", "data": {"message": str(e)}})
+    return None
 
 
 async def batch_process_request(request: QueryRequestThesisAndRubric):
@@ -197,8 +297,13 @@ async def batch_process_request(request: QueryRequestThesisAndRubric):
         logger.error(f"Error in process_request: {e}")
 
     # Dissertation evaluation process
-    dissertation_system_prompt = """You are an impartial academic evaluator - an expert in analyzing the summarized dissertation provided to you. 
-Your task is to assess the quality of the provided summarized dissertation in relation to specific evaluation criteria."""
+    prompt_builder = CriterionPromptBuilder(
+        summary=request.pre_analysis.pre_analyzed_summary,
+        name_of_author=name_of_author,
+        degree_of_student=degree_of_student,
+        feedback=request.feedback
+    )
+    logger.info(f"Shared prompt prefix hash for {name_of_author}: {prompt_builder.prefix_hash}")
 
     evaluation_results = {}
     total_score = 0
@@ -207,35 +312,17 @@ Your task is to assess the quality of the provided summarized dissertation in re
     for criterion, explanation in request.rubric.items():
 
         # Build the user prompt for this criterion
-        dissertation_user_prompt = f"""
-# Input Materials
-## Dissertation Text
-{request.pre_analysis.pre_analyzed_summary}
-
-## Evaluation Context
-- Author: {name_of_author}
-- Academic Field: {degree_of_student}
-
-## Assessment Criterion and its explanation
-### {criterion}:
-#### Explanation: {explanation['criteria_explanation']}
-
-{explanation['criteria_output']}
-
-Please make sure that you critique the work heavily, including all improvements that can be made.
-
-DO NOT SCORE THE DISSERTATION, YOU ARE TO PROVIDE ONLY DETAILED ANALYSIS, AND NO SCORES ASSOCIATED WITH IT.
-"""
-        if request.feedback:
-            dissertation_user_prompt += f'\nIMPORTANT(The following feedback was provided by an expert. Consider the feedback properly, and ensure your evaluation follows this feedback): {request.feedback}'
+        dissertation_user_prompt = prompt_builder.build(criterion, explanation)
 
         # Stream analysis results to the client
+        started = time.monotonic()
         try:
-            analyzed_dissertation = await invoke_llm(
-                    system_prompt=dissertation_system_prompt,
+            analyzed_dissertation = (await invoke_llm(
+                    system_prompt=prompt_builder.system_prompt,
                     user_prompt=dissertation_user_prompt,
                     model_type=ModelType.ANALYSIS,
-                )
+                    affinity_key=prompt_builder.prefix_hash
+                ))['answer']
             
             # Perform scoring
             graded_response = await scoring_agent(
@@ -251,9 +338,10 @@ DO NOT SCORE THE DISSERTATION, YOU ARE TO PROVIDE ONLY DETAILED ANALYSIS, AND NO
             match = re.search(pattern, graded_response, re.IGNORECASE)
             score = float(match.group(1)) if match else 0
             total_score += score
+            record_stage("criterion", 1, time.monotonic() - started)
 
             evaluation_results[criterion] = {
-                "feedback": analyzed_dissertation['answer'],
+                "feedback": analyzed_dissertation,
                 "score": score
             }
 
@@ -1,10 +1,22 @@
-from backend.Agents.text_agents import summarize_and_analyze_agent, extract_scope_agent, scoped_suggestions_agent, scoring_agent
+from backend.Agents.text_agents import extract_scope_agent, scoped_suggestions_agent, scoring_agent
 from backend.InferenceEngine.inference_engines import invoke_llm, ModelType
-from backend.src.kafka_utils import increment_users, decrement_users, get_active_users, send_to_kafka, consume_messages, create_kafka_topic
-from backend.src.logic import CancellationToken, process_request, batch_process_request
+from backend.InferenceEngine.metrics import render_prometheus
+from backend.InferenceEngine.request_policy import deadline_scope
+from backend.src.admission import retry_after_if_full
+from backend.src.database import close_db, get_async_db, init_db
+from backend.src.job_queue import get_job_queue
+from backend.src.durations import predict_document_seconds
+from backend.src.kafka_utils import send_to_kafka, enqueue_document, start_consumer, stop_kafka
+from backend.src.logic import ANALYSIS_DEADLINE_SECONDS, run_resumable_request, stream_session, batch_process_request
+from backend.src.pipeline import UnsupportedFileTypeError, extract_document, pre_analyze
+from backend.src.redis_client import close_session_redis, get_session_redis, open_session_redis
+from backend.src.results import Evaluation, get_results_writer, save_evaluation, update_scores
+from backend.src.session_cache import get_session_cache
+from backend.src.session_router import get_session_router
+from backend.src.queue_status import estimate_job, get_queue_tracker, push_queue_positions
+from backend.src.scheduler import Priority, get_scheduler
 from backend.src.types import User, UserScore, Feedback
 from backend.src.types import *
-from backend.src.utils import process_pdf, process_docx, process_initial_agents
 import base64
 from fastapi import FastAPI, Request, Response, params
 from fastapi.responses import HTMLResponse, RedirectResponse
@@ -14,26 +26,23 @@ import asyncio
 from contextlib import asynccontextmanager
 from backend.src.saml_utils import *
 from dotenv import load_dotenv
-from fastapi import FastAPI, WebSocket, UploadFile, File, HTTPException ,Depends,  WebSocketDisconnect,status, Form
+from fastapi import FastAPI, WebSocket, UploadFile, File, HTTPException ,Depends,  WebSocketDisconnect,status, Form, Query
 from fastapi.middleware.cors import CORSMiddleware 
 import logging
 from multiprocessing import Pool
 import os
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import Session, sessionmaker, declarative_base
-from sqlalchemy.exc import OperationalError
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 import uvicorn
 import uuid
 import httpx
-from fastapi.responses import JSONResponse
-from sqlalchemy import Column, Integer, String, JSON, ForeignKey
-from sqlalchemy.orm import Session, relationship
+from fastapi.responses import JSONResponse, PlainTextResponse
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
 from sqlalchemy.exc import IntegrityError
 from urllib.parse import unquote
 import re
-import redis 
 import xml.etree.ElementTree as ET
 load_dotenv()
 AUTH_TOKEN = os.getenv("AUTH_TOKEN")
@@ -41,106 +50,59 @@ AUTH_TOKEN = os.getenv("AUTH_TOKEN")
 #Get the database URL from environment variables
 KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092")
 KAFKA_TOPIC = os.getenv("KAFKA_TOPIC", "dissertation_analysis_queue")
-MAX_CONCURRENT_USERS = int(os.getenv("MAX_CONCURRENT_USERS", 3))
 producer = None
 queue_lock = asyncio.Lock()
 consumer_initialized = False
 consumer_lock = asyncio.Lock()
 consumer = None  # Single consumer instance
-notification_clients = {}  # Map of session IDs to WebSocket connections
-connected_websockets = {}
 producer = None  # Single producer instance
 consumer_task = None  # Single consumer task
-semaphore = asyncio.Semaphore(5)  # Semaphore for limiting concurrent users
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)  
 
-# Configuration
-SQLALCHEMY_DATABASE_URL = os.getenv("SQLALCHEMY_DATABASE_URL")
-
-# Database Engine
-try:
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
-    print("Database connection established successfully.")
-except OperationalError as e:
-    print(f"Database connection failed: {e}")
-    engine = None
-
-# Session and Base
-if engine:
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    Base = declarative_base()
-else:
-    SessionLocal = None
-    Base = None
-
-# Initialize Database
-def init_db():
-    """Initialize the database tables."""
-    if Base and engine:
-        try:
-            Base.metadata.create_all(bind=engine)
-            print("Database tables created successfully.")
-        except Exception as e:
-            print(f"An error occurred during database initialization: {e}")
-    else:
-        print("Database engine is not initialized. Skipping table creation.")
-
-# Dependency Injection for FastAPI
-def get_db():
-    """Provide a database session as a dependency."""
-    if not SessionLocal:
-        raise RuntimeError("Database session factory is not initialized.")
-    db = SessionLocal()
-    try:
-        yield db
-    except Exception as e:
-        print(f"An error occurred during database session: {e}")
-        raise
-    finally:
-        db.close()
-
-# Initialize at startup
-init_db()
-
 @asynccontextmanager
 async def lifespan(app):
-    global producer
-
+    queue_positions_task = None
     try:
-        # Initialize Kafka Producer
-        producer = AIOKafkaProducer(
-            bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
-            max_request_size=200000000  # Large message size
-        )
-        await producer.start()
+        await init_db()
+        await open_session_redis()
+        # Drop cached sessions when they are revoked on any replica
+        await get_session_cache().start()
 
-        # Ensure Kafka topic exists
-        await create_kafka_topic()
+        # Deliver notifications for sessions whose sockets this replica holds
+        await get_session_router().start()
 
-        # Start Kafka consumer
-        consumer_task = asyncio.create_task(consume_messages())
-        yield  # Run the app
+        # Connect to the analysis queue and make sure it exists
+        await get_job_queue().start()
+        await get_job_queue().ensure()
 
-    except Exception as e:
-        print(f"Error during lifespan setup: {e}")
+        # Every replica consumes its share of the queue partitions, unless da-worker processes do
+        start_consumer()
+
+        # Keep queued users informed of their position and ETA
+        queue_positions_task = asyncio.create_task(push_queue_positions())
+        yield  # Run the app
 
     finally:
-        # Stop the Kafka producer and consumer
-        if producer:
-            await producer.stop()
-        if consumer_task:
-            consumer_task.cancel()
-            await consumer_task
+        if queue_positions_task:
+            queue_positions_task.cancel()
+        # Stop the queue consumer and producer
+        await stop_kafka()
+        await get_session_router().stop()
+        # Write the batch results still buffered
+        await get_results_writer().stop()
+        await close_db()
+        await get_session_cache().stop()
+        await close_session_redis()
 
 
 app = FastAPI(
     title="Dissertation Analysis API",
     description="API for analyzing dissertations",
     version="1.0.0",
-    app = FastAPI(lifespan=lifespan)
+    lifespan=lifespan
 )
 
 
@@ -159,47 +121,74 @@ def read_root():
     return {"message": "Hello! This is the Dissertation Analysis! Dissertation Analysis app is running!"}
 
 
+@app.get("/dissertation/api/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus metrics of this process (inference circuit breakers, failovers, ...)."""
+    return render_prometheus()
+
+
+@app.get("/dissertation/api/queue/status")
+async def queue_status(session_id: Optional[str] = None):
+    """
+    Queue length, expected wait for a new job and arrival/completion rates. With session_id,
+    also the position and ETA of that queued session.
+    """
+    tracker = get_queue_tracker()
+    status = await tracker.status()
+    if session_id:
+        status["session"] = await tracker.position(session_id)
+    return status
+
+
+async def reject_if_queue_full():
+    """Refuse a new analysis with 429 and a Retry-After while the queue is over ADMISSION_MAX_QUEUED."""
+    retry_after = retry_after_if_full(await get_queue_tracker().status())
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="The analysis queue is full. Please try again later.",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+
 @app.websocket("/dissertation/api/ws/notifications")
 async def notification_endpoint(websocket: WebSocket):
     """
     WebSocket endpoint for notifications.
     """
+    session_id = None
     try:
         await websocket.accept()
 
         # Receive the session ID from the frontend
         session_id = await websocket.receive_text()
-        notification_clients[session_id] = websocket
+        await get_session_router().register(session_id, websocket)
         logger.info(f"Notification WebSocket established for session {session_id}")
 
-        # Keep the WebSocket alive
+        # Keep the WebSocket open until the client disconnects
         while True:
-            await asyncio.sleep(10)
+            await websocket.receive_text()
     except WebSocketDisconnect:
         logger.info(f"Notification WebSocket disconnected for session {session_id}")
-        notification_clients.pop(session_id, None)
+    finally:
+        if session_id:
+            await get_session_router().unregister(session_id, websocket)
 
 
 @app.websocket("/dissertation/api/ws/dissertation_analysis_reconnect")
-async def websocket_reconnect(websocket: WebSocket, session_id: str):
+async def websocket_reconnect(websocket: WebSocket, session_id: str, last_seq: int = 0):
     """
-    Handle WebSocket reconnections for dequeued Kafka requests.
+    Attach to a running (or recently finished) analysis session: replays the events after
+    last_seq and then streams new ones live. Used for dequeued Kafka requests and to resume
+    after a dropped connection.
     """
-    try:
-        await websocket.accept()
-        connected_websockets[session_id] = websocket
-        logger.info(f"Frontend reconnected for session {session_id}")
-
-        # Keep the WebSocket connection alive until processing completes
-        while True:
-            await asyncio.sleep(10)
-    except WebSocketDisconnect:
-        logger.info(f"WebSocket disconnected for session {session_id}")
-        connected_websockets.pop(session_id, None)
+    await websocket.accept()
+    logger.info(f"Frontend reconnected for session {session_id} after seq {last_seq}")
+    await stream_session(websocket, session_id, last_seq)
 
 
 @app.post("/dissertation/api/postUserData")
-def post_user_data(postData: PostData, request: Request, db: Session = Depends(get_db)):
+async def post_user_data(postData: PostData, request: Request, db: AsyncSession = Depends(get_async_db)):
     # Get session_id from cookies
     session_id = request.cookies.get("session_id")
     
@@ -210,47 +199,32 @@ def post_user_data(postData: PostData, request: Request, db: Session = Depends(g
     if session_id:
         try:
             # Get user data from Redis
-            user_data_str = redis_client.get(session_id)
-            if user_data_str:
-                user_data = json.loads(user_data_str)
+            user_data = await get_session_cache().get(session_id)
+            if user_data:
                 evaluator = user_data.get("name", "unknown")
         except Exception as e:
             # Log the error but continue with default evaluator
             print(f"Error retrieving session data: {e}")
-    
 
-        db_user = User(
-            name=postData.userData.name,
-            degree=postData.userData.degree,
-            topic=postData.userData.topic,
-            total_score=postData.userData.total_score,
-            evaluator=evaluator,  # Use the evaluator from session
-            rubric_name=postData.rubric_name
-        )
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
-
-    # Update or insert user score data
-    existing_scores = {score.dimension_name: score for score in db_user.scores}
-    for score_data in postData.userScores:
-
-            # Insert new score
-            db_score = UserScore(
-                user_id=db_user.id,
-                dimension_name=score_data.dimension_name,
-                score=score_data.score,
-                data=score_data.data
-            )
-            db.add(db_score)
-    
-    db.commit()
+    # Insert the user and all its scores in one transaction
+    user_id = await save_evaluation(db, Evaluation(
+        name=postData.userData.name,
+        degree=postData.userData.degree,
+        topic=postData.userData.topic,
+        total_score=postData.userData.total_score,
+        evaluator=evaluator,  # Use the evaluator from session
+        rubric_name=postData.rubric_name,
+        scores=[
+            {"dimension_name": score_data.dimension_name, "score": score_data.score, "data": score_data.data}
+            for score_data in postData.userScores
+        ]
+    ))
 
-    return {"message": "Data successfully stored", "user_id": db_user.id}
+    return {"message": "Data successfully stored", "user_id": user_id}
 
 
 @app.post("/dissertation/api/submitFeedback")
-def submit_feedback(feedback_data: FeedbackData, db: Session = Depends(get_db)):
+async def submit_feedback(feedback_data: FeedbackData, db: AsyncSession = Depends(get_async_db)):
     try:
         # Insert the feedback into the database
         feedback_entry = Feedback(
@@ -259,13 +233,12 @@ def submit_feedback(feedback_data: FeedbackData, db: Session = Depends(get_db)):
             pre_analysis=feedback_data.preAnalysisData
         )
         db.add(feedback_entry)
-        db.commit()
-        db.refresh(feedback_entry)
+        await db.commit()
 
         return {"message": "Feedback stored successfully", "feedback_id": feedback_entry.id}
     
     except Exception as e:
-        db.rollback()  # Ensure rollback on error
+        await db.rollback()  # Ensure rollback on error
         print(f"Error inserting feedback: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
@@ -273,12 +246,9 @@ def submit_feedback(feedback_data: FeedbackData, db: Session = Depends(get_db)):
 @app.post("/dissertation/api/extract_text_from_file_and_analyze_images")
 async def analyze_file(file: UploadFile = File(...)):
     try:
-        if file.filename.endswith(".pdf"):
-            return await process_pdf(file)
-        elif file.filename.endswith(".docx"):
-            return await process_docx(file)
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file type.")
+        return await extract_document(file)
+    except UnsupportedFileTypeError:
+        raise HTTPException(status_code=400, detail="Unsupported file type.")
     except Exception as e:
         logger.exception("An error occurred while processing the file.")
         raise HTTPException(status_code=500, detail="Failed to process the file. Please try again.") from e
@@ -287,24 +257,7 @@ async def analyze_file(file: UploadFile = File(...)):
 @app.post("/dissertation/api/pre_analyze")
 async def pre_analysis(request: QueryRequestThesis):
     try:
-        # Process initial agents in batch
-        initial_results = await process_initial_agents(request.thesis)
-        
-        # Use the topic from batch results for summary
-        summary_of_thesis = await summarize_and_analyze_agent(
-            request.thesis, 
-            initial_results["topic"]
-        )
-        
-        response = {
-            "degree": initial_results["degree"],
-            "name": initial_results["name"],
-            "topic": initial_results["topic"],
-            "pre_analyzed_summary": summary_of_thesis
-        }
-        
-        return response
-        
+        return await pre_analyze(request.thesis)
     except Exception as e:
         logger.error(f"Failed to pre-analyze thesis: {e}")
         raise HTTPException(
@@ -313,6 +266,33 @@ async def pre_analysis(request: QueryRequestThesis):
         )
 
 
+@app.post("/dissertation/api/analysis_jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_analysis_job(
+    request: Request,
+    file: UploadFile = File(...),
+    rubric: str = Form(...),
+    feedback: Optional[str] = Form(None),
+    rubric_name: Optional[str] = Form(None)
+):
+    """
+    Queue a document for extraction, pre-analysis and evaluation by a worker. Progress is
+    streamed on the reconnect WebSocket with the returned session id, and the evaluation is
+    stored when it completes.
+    """
+    if not file.filename.endswith((".pdf", ".docx")):
+        raise HTTPException(status_code=400, detail="Unsupported file type.")
+    try:
+        rubric_data = json.loads(rubric)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid rubric JSON.")
+    await reject_if_queue_full()
+
+    session_id = str(uuid.uuid4())
+    await enqueue_document(session_id, file.filename, await file.read(), rubric_data, feedback,
+                           evaluator=await get_evaluator_name(request.cookies), rubric_name=rubric_name)
+    return {"session_id": session_id}
+
+
 @app.post("/dissertation/api/scope_extraction")
 async def scope_extractor(dissertation_pre_analysis: QueryRequestThesis):
     try:
@@ -345,13 +325,26 @@ async def scoped_feedback(request: QueryScope):
         )
 
 
+async def get_evaluator_name(cookies) -> str:
+    """Name of the signed-in evaluator, from the SAML session in the cookies, or "unknown"."""
+    session_id = cookies.get("session_id")
+    if session_id:
+        try:
+            user_data = await get_session_cache().get(session_id)
+            if user_data:
+                return user_data.get("name", "unknown")
+        except Exception as e:
+            print(f"Error retrieving session data: {e}")
+    return "unknown"
+
+
 @app.websocket("/dissertation/api/ws/dissertation_analysis")
 async def websocket_dissertation(websocket: WebSocket):
     """
     WebSocket endpoint for dissertation analysis.
     Handles direct WebSocket calls.
     """
-    cancellation_token = CancellationToken()
+    lease = None
 
     try:
         # Accept WebSocket connection
@@ -395,23 +388,45 @@ async def websocket_dissertation(websocket: WebSocket):
         topic = request.pre_analysis.topic
         logger.info(f"Processing request for {name_of_author} on topic {topic}")
 
-        # Check slot availability
-        active_users = await get_active_users()
-        if active_users >= MAX_CONCURRENT_USERS:
+        # Generate session ID for tracking
+        session_id = str(uuid.uuid4())
+        evaluator = await get_evaluator_name(websocket.cookies)
+
+        # Take a slot atomically; if none is free across the deployment or the inference backends
+        # are saturated, queue the request
+        lease = await get_scheduler().try_acquire(session_id, evaluator, Priority.INTERACTIVE, cost=estimate_job(data))
+        if lease is None:
+            retry_after = retry_after_if_full(await get_queue_tracker().status())
+            if retry_after is not None:
+                logger.info(f"Queue full. Turning away request for {name_of_author}")
+                await websocket.send_json({
+                    "type": "error",
+                    "data": {
+                        "message": "The analysis queue is full. Please try again later.",
+                        "retry_after_seconds": retry_after
+                    }
+                })
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                return
+
             logger.info(f"No slots available. Queuing request for {name_of_author}")
 
             try:
-                # Generate session ID for tracking
-                session_id = str(uuid.uuid4())
                 data["session_id"] = session_id
+                data["evaluator"] = evaluator
+                data["priority"] = Priority.INTERACTIVE.name.lower()
 
                 # Send the request to Kafka
                 await send_to_kafka(data)
 
-                # Notify the frontend
+                # Notify the frontend, with where it stands in the queue
                 await websocket.send_json({
                     "type": "queue_status",
-                    "data": {"message": "Your request has been queued. Please wait...", "session_id": session_id}
+                    "data": {
+                        "message": "Your request has been queued. Please wait...",
+                        "session_id": session_id,
+                        **(await get_queue_tracker().position(session_id) or {})
+                    }
                 })
             except Exception as e:
                 logger.error(f"Error queuing request: {e}")
@@ -420,11 +435,11 @@ async def websocket_dissertation(websocket: WebSocket):
                 await websocket.close()
             return
 
-        # Increment active users for direct requests
-        await increment_users()
-
-        # Process the request immediately
-        await process_request(websocket, request, cancellation_token)
+        # Process the request immediately. If the connection drops, the evaluation keeps running
+        # and the client can resume it with the session id from the first message.
+        await get_queue_tracker().start(session_id, estimate_job(data))
+        with deadline_scope(ANALYSIS_DEADLINE_SECONDS):
+            await run_resumable_request(websocket, request, session_id)
 
     except WebSocketDisconnect:
         logger.info("WebSocket disconnected during processing.")
@@ -432,10 +447,10 @@ async def websocket_dissertation(websocket: WebSocket):
         logger.error(f"Error in WebSocket processing: {e}")
         await websocket.send_json({"type": "error", "data": {"message": str(e)}})
     finally:
-        # Decrement users only if it was a direct request
-        if not cancellation_token.ws_closed:
-            await websocket.close()
-        await decrement_users()
+        # Free the slot only if it was a direct request
+        if lease:
+            await lease.release()
+            await get_queue_tracker().finish(session_id)
 
 
 
@@ -446,7 +461,7 @@ async def post_dissertation(
     request: QueryRequestThesisAndRubric,
     rubric_name: str,
     evaluator: Optional[str],
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Post endpoint for dissertation analysis.
@@ -458,42 +473,23 @@ async def post_dissertation(
     try:
         logger.info(f"Processing request for {request.pre_analysis.name} on topic {request.pre_analysis.topic}")
         # Process the request immediately
-        result = await batch_process_request(request)
+        with deadline_scope(ANALYSIS_DEADLINE_SECONDS):
+            result = await batch_process_request(request)
     except Exception as e:
         logger.error(f"Error in processing: {e}")
         return {"type": "error", "data": {"message": str(e)}}
     
     if result:
+        # Always insert a new user (no duplicate check)
+        evaluation = Evaluation.from_result(result, rubric_name, evaluator)
         try:
             if isinstance(db, params.Depends):
-                db = SessionLocal()
-            
-            # Always insert a new user (no duplicate check)
-            db_user = User(
-                name=result['name'],
-                degree=result['degree'],
-                topic=result['topic'],
-                total_score=result['total_score'],
-                evaluator=evaluator,
-                rubric_name=rubric_name
-            )
-            db.add(db_user)
-            db.commit()
-            db.refresh(db_user)
-
-            # Insert associated scores
-            for criterion in result["criteria_evaluations"]:
-                score_entry = UserScore(
-                    user_id=db_user.id,
-                    dimension_name=criterion,
-                    score=result["criteria_evaluations"][criterion]['score'],
-                    data=result["criteria_evaluations"][criterion]['feedback']
-                )
-                db.add(score_entry)
-            db.commit()
-
+                # Called directly by batch_input rather than as an endpoint; concurrent batch
+                # jobs may share a transaction
+                await get_results_writer().submit(evaluation)
+            else:
+                await save_evaluation(db, evaluation)
         except Exception as e:
-            db.rollback()
             logger.error(f"Error inserting user data: {e}")
             raise HTTPException(status_code=500, detail="Internal server error")
 
@@ -507,34 +503,36 @@ async def batch_upload(
     rubric_name:str = Form(...),
     files: List[UploadFile] = File(...),
     process_count: Optional[int] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Parse rubric JSON string to dictionary
     try:
         rubric_data = json.loads(rubric)
     except json.JSONDecodeError:
         return {"error": "Invalid rubric format. Must be valid JSON."}
+    await reject_if_queue_full()
 
-    session_id = request.cookies.get("session_id")
-    
-    evaluator = "unknown"  # Default evaluator
+    evaluator = await get_evaluator_name(request.cookies)
 
-    if session_id:
-        try:
-            user_data_str = redis_client.get(session_id)
-            if user_data_str:
-                user_data = json.loads(user_data_str)
-                evaluator = user_data.get("name", "unknown")
-        except Exception as e:
-            print(f"Error retrieving session data: {e}")
+    # Predict each file's duration from its structure, so short files are not stuck behind long ones
+    estimates = await asyncio.gather(*(predict_upload_seconds(file, rubric_data) for file in files))
 
     # Asynchronous processing
-    tasks = [asyncio.create_task(limit_concurrency(file, rubric_data,rubric_name, evaluator)) for file in files]
+    tasks = [
+        asyncio.create_task(limit_concurrency(file, rubric_data, rubric_name, evaluator, estimate))
+        for file, estimate in zip(files, estimates)
+    ]
     results = await asyncio.gather(*tasks)
     
     return results
 
 
+async def predict_upload_seconds(file: UploadFile, rubric: dict) -> float:
+    content = await file.read()
+    await file.seek(0)
+    return await predict_document_seconds(file.filename, content, rubric)
+
+
 @app.post("/dissertation/api/batch_input/download")
 async def batch_download(files: List[UploadFile] = File(...), username: Optional[str] = Form(None)):
     """
@@ -563,9 +561,21 @@ async def batch_download(files: List[UploadFile] = File(...), username: Optional
         new_index += 1
     return {"message": "Files processed successfully"}
 
-async def limit_concurrency(file: UploadFile, rubric: Dict[str, RubricCriteria], rubric_name: str,evaluator: Optional[str] = None):
-    async with semaphore:
-        return await spawner(file, rubric,rubric_name,evaluator)
+async def limit_concurrency(file: UploadFile, rubric: Dict[str, RubricCriteria], rubric_name: str,evaluator: Optional[str] = None, estimate: float = 60.0):
+    # Batch files share the analysis slots with interactive requests, at bulk priority; the
+    # scheduler runs each evaluator's shortest expected files first
+    job_id = f"batch:{uuid.uuid4()}"
+    tracker = get_queue_tracker()
+    await tracker.enqueue(job_id, estimate, Priority.BULK, evaluator or "unknown")
+    try:
+        lease = await get_scheduler().acquire(job_id, evaluator or "unknown", Priority.BULK, cost=estimate)
+        try:
+            await tracker.start(job_id, estimate)
+            return await spawner(file, rubric,rubric_name,evaluator)
+        finally:
+            await lease.release()
+    finally:
+        await tracker.finish(job_id)
 
 async def spawner(file: UploadFile, rubric: Dict[str, RubricCriteria],rubric_name: str, evaluator: Optional[str] = None):
     try:
@@ -586,7 +596,7 @@ async def spawner(file: UploadFile, rubric: Dict[str, RubricCriteria],rubric_nam
     file.close()
 
 @app.get("/dissertation/api/dbtest")
-async def test_sql(db: Session = Depends(get_db)):
+async def test_sql(db: AsyncSession = Depends(get_async_db)):
     print(type(db))
     print(isinstance(db, params.Depends))
     ## SAMPLE adding an entry
@@ -598,11 +608,10 @@ async def test_sql(db: Session = Depends(get_db)):
     #         evaluator='test1'  # Use the evaluator from session
     #     )
     # db.add(db_user)
-    # db.commit()
-    # db.refresh(db_user)
+    # await db.commit()
 
     ## SAMPLE querying an entry
-    res = db.query(User).all()
+    res = (await db.scalars(select(User))).all()
     for user in res:
         print(user.name)
     return
@@ -658,25 +667,24 @@ async def verify_session_middleware(request: Request):
             detail="Authentication required"
         )
 
-    user_data_json = redis_client.get(session_id)
-    if not user_data_json:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Session expired"
-        )
-
     try:
-        user_data = json.loads(user_data_json)
-
-        request.state.user_data = user_data
-        return user_data
-    
+        # Served from the in-process cache for repeated calls of the same session
+        user_data = await get_session_cache().get(session_id)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Authentication error: {str(e)}"
         )
 
+    if not user_data:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Session expired"
+        )
+
+    request.state.user_data = user_data
+    return user_data
+
 
 def get_verified_user(allowed_roles: list = None):
     """Returns a dependency function that verifies session with allowed roles"""
@@ -690,12 +698,12 @@ def get_verified_user(allowed_roles: list = None):
 async def get_all_rubrics(
     request: Request,  # Missing request parameter
     user_data: dict = Depends(get_verified_user(["staff", "STAFF", "admin", "ADMIN"])),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all rubrics"""
     print("USER DATA",user_data)
     try:
-        rubrics = db.query(Rubric).all()
+        rubrics = (await db.scalars(select(Rubric))).all()
         return rubrics
     except Exception as e:
         logger.error(f"Error fetching rubrics: {e}")
@@ -707,26 +715,58 @@ async def get_all_rubrics(
 @app.get("/dissertation/api/users", response_model=List[UserDataResponse])
 async def get_users_by_name(
     request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    before_id: Optional[int] = None,
+    include_data: bool = True,
     user_data: dict = Depends(get_verified_user(["staff", "STAFF", "admin", "ADMIN"])),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    """
+    The latest evaluation of each (name, rubric_name) by the signed-in evaluator, newest first.
+
+    Args:
+        limit: Page size; without it every evaluation is returned
+        before_id: Return evaluations older than this id, i.e. the X-Next-Before-Id header of
+            the previous page
+        include_data: False leaves out the feedback text of each score, for list views
+    """
     evaluator_name = user_data.get("name")
 
     if not evaluator_name:
         raise HTTPException(status_code=400, detail="Name not found in session")
 
-    # Get all entries by this evaluator, sorted by ID descending
-    users = db.query(User).filter(User.evaluator == evaluator_name).order_by(User.id.desc()).all()
-
-    if not users:
+    # Rank each (name, rubric_name) group of this evaluator newest first and keep the first;
+    # served by the (evaluator, name, rubric_name, id) index
+    latest = (
+        select(
+            User.id,
+            func.row_number().over(
+                partition_by=(User.name, User.rubric_name),
+                order_by=User.id.desc()
+            ).label("rank")
+        )
+        .where(User.evaluator == evaluator_name)
+        .subquery()
+    )
+    scores = selectinload(User.scores)
+    query = (
+        select(User)
+        .join(latest, User.id == latest.c.id)
+        .where(latest.c.rank == 1)
+        .order_by(User.id.desc())
+        .options(scores if include_data else scores.load_only(UserScore.dimension_name, UserScore.score))
+    )
+    if before_id is not None:
+        query = query.where(User.id < before_id)
+    if limit is not None:
+        query = query.limit(limit)
+    users = (await db.scalars(query)).all()
+
+    if not users and before_id is None:
         raise HTTPException(status_code=404, detail=f"No evaluations found with name {evaluator_name}")
-
-    # Keep only the latest (name, rubric_name) entry
-    latest_entries = dict()
-    for user in users:
-        key = (user.name, user.rubric_name)
-        if key not in latest_entries:
-            latest_entries[key] = user  # First seen will be latest due to descending order
+    if limit is not None and len(users) == limit:
+        response.headers["X-Next-Before-Id"] = str(users[-1].id)
 
     return [
         UserDataResponse(
@@ -740,10 +780,10 @@ async def get_users_by_name(
                 DimensionScoreResponse(
                     dimension_name=score.dimension_name,
                     score=score.score,
-                    data=score.data
+                    data=score.data if include_data else None
                 ) for score in user.scores
             ]
-        ) for user in latest_entries.values()
+        ) for user in users
     ]
 
 @app.put("/dissertation/api/users/{user_id}/scores")
@@ -752,29 +792,14 @@ async def update_user_scores(
     scores: List[DimensionScoreResponse],
     request: Request,  
     user_data: dict = Depends(get_verified_user(["staff", "STAFF", "admin", "ADMIN"])),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = db.query(User).filter(User.id == user_id).first()
+    # Update the scores with one statement and recalculate the total score
+    total_score = await update_scores(db, user_id, {score.dimension_name: score.score for score in scores})
     
-    if not user:
+    if total_score is None:
         raise HTTPException(status_code=404, detail=f"User with ID {user_id} not found")
     
-    # Update user scores
-    for score_update in scores:
-        score_obj = db.query(UserScore).filter(
-            UserScore.user_id == user_id,
-            UserScore.dimension_name == score_update.dimension_name
-        ).first()
-        
-        if score_obj:
-            score_obj.score = score_update.score
-    
-    # Recalculate total score
-    total_score = sum(score.score for score in user.scores)
-    user.total_score = total_score
-    
-    db.commit()
-    
     return {
         "message": "Scores updated successfully",
         "user_id": user_id,
@@ -785,10 +810,10 @@ async def update_user_scores(
 async def get_rubric_by_id(rubric_id: int, 
     request: Request,  # Missing request parameter
     user_data: dict = Depends(get_verified_user(["staff", "STAFF", "admin", "ADMIN"])),
-    db: Session = Depends(get_db)):
+    db: AsyncSession = Depends(get_async_db)):
     """Get a specific rubric by ID"""
     try:
-        rubric = db.query(Rubric).filter(Rubric.id == rubric_id).first()
+        rubric = await db.get(Rubric, rubric_id)
         if not rubric:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -808,11 +833,11 @@ async def get_rubric_by_id(rubric_id: int,
 async def create_rubric(rubric: RubricCreate,
     request: Request,  # Missing request parameter
     user_data: dict = Depends(get_verified_user(["staff", "STAFF", "admin", "ADMIN"])),
-      db: Session = Depends(get_db)):
+      db: AsyncSession = Depends(get_async_db)):
     """Create a new rubric"""
     try:
         # Check for existing rubric with same name
-        existing_rubric = db.query(Rubric).filter(Rubric.name == rubric.name).first()
+        existing_rubric = await db.scalar(select(Rubric).where(Rubric.name == rubric.name))
         if existing_rubric:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -825,13 +850,13 @@ async def create_rubric(rubric: RubricCreate,
             dimensions=[dimension.dict() for dimension in rubric.dimensions]
         )
         db.add(db_rubric)
-        db.commit()
-        db.refresh(db_rubric)
+        await db.commit()
+        await db.refresh(db_rubric)
         return db_rubric
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error creating rubric: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -841,11 +866,11 @@ async def create_rubric(rubric: RubricCreate,
 @app.put("/dissertation/api/rubrics/{rubric_id}", response_model=RubricResponse)
 async def update_rubric(rubric_id: int, rubric: RubricUpdate,
     request: Request,  # Missing request parameter
-    user_data: dict = Depends(get_verified_user(["staff", "STAFF", "admin", "ADMIN"])),db: Session = Depends(get_db)):
+    user_data: dict = Depends(get_verified_user(["staff", "STAFF", "admin", "ADMIN"])),db: AsyncSession = Depends(get_async_db)):
     """Update an existing rubric"""
     try:
         # Get existing rubric
-        db_rubric = db.query(Rubric).filter(Rubric.id == rubric_id).first()
+        db_rubric = await db.get(Rubric, rubric_id)
         if not db_rubric:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -854,10 +879,10 @@ async def update_rubric(rubric_id: int, rubric: RubricUpdate,
         
         # Check for name conflict (if name is changing)
         if rubric.name != db_rubric.name:
-            name_conflict = db.query(Rubric).filter(
+            name_conflict = await db.scalar(select(Rubric).where(
                 Rubric.name == rubric.name,
                 Rubric.id != rubric_id
-            ).first()
+            ))
             if name_conflict:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -868,13 +893,13 @@ async def update_rubric(rubric_id: int, rubric: RubricUpdate,
         db_rubric.name = rubric.name
         db_rubric.dimensions = [dimension.dict() for dimension in rubric.dimensions]
         
-        db.commit()
-        db.refresh(db_rubric)
+        await db.commit()
+        await db.refresh(db_rubric)
         return db_rubric
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error updating rubric {rubric_id}: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -884,11 +909,11 @@ async def update_rubric(rubric_id: int, rubric: RubricUpdate,
 @app.delete("/dissertation/api/rubrics/{rubric_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_rubric(rubric_id: int,
     request: Request,  # Missing request parameter
-    user_data: dict = Depends(get_verified_user(["staff", "STAFF", "admin", "ADMIN"])), db: Session = Depends(get_db)):
+    user_data: dict = Depends(get_verified_user(["staff", "STAFF", "admin", "ADMIN"])), db: AsyncSession = Depends(get_async_db)):
     """Delete a rubric"""
     try:
         # Get existing rubric
-        db_rubric = db.query(Rubric).filter(Rubric.id == rubric_id).first()
+        db_rubric = await db.get(Rubric, rubric_id)
         if not db_rubric:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -896,13 +921,13 @@ async def delete_rubric(rubric_id: int,
             )
         
         # Delete rubric
-        db.delete(db_rubric)
-        db.commit()
+        await db.delete(db_rubric)
+        await db.commit()
         return None
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error deleting rubric {rubric_id}: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -926,10 +951,11 @@ async def handle_logout(request: Request, response: Response):
     user_role = request.cookies.get("user_role")
     
     if session_id:
-        redis_client.delete(session_id)
+        # Revoked on every replica, including their session caches
+        await get_session_cache().revoke(session_id)
 
     if user_role:
-        redis_client.delete(user_role)
+        await get_session_redis().delete(user_role)
     
     # Clear session_id cookie
     response.set_cookie(key="session_id", value="", httponly=True, secure=True, max_age=0, samesite="None")
@@ -940,8 +966,6 @@ async def handle_logout(request: Request, response: Response):
 
 
 
-redis_client = redis.StrictRedis(host="localhost", port=6379, decode_responses=True)
-
 # In-memory storage
 stored_data = {
     "api_data": None
@@ -989,7 +1013,7 @@ async def receive_saml_response(request: Request):
             "name": user_name,
             "role": user_role
         }
-        redis_client.setex(session_id, 18000, json.dumps(user_data))
+        await get_session_redis().setex(session_id, 18000, json.dumps(user_data))
 
         redirect_url = "http://localhost:4002/HomePage"
         response = HTMLResponse(content=f"""
@@ -1052,14 +1076,11 @@ async def verify_session(request: Request):
     if not session_id or not user_role_cookie:
         return {"isValid": False}
 
-    # Check if the session exists in Redis
-    user_data_json = redis_client.get(session_id)
-    if not user_data_json:
-        return {"isValid": False}
-        
-    # Parse the user data from Redis
+    # Check if the session exists (recently verified sessions are cached)
     try:
-        user_data = json.loads(user_data_json)
+        user_data = await get_session_cache().get(session_id)
+        if not user_data:
+            return {"isValid": False}
         # Check if the user role in Redis matches the cookie
         if user_data.get("role") == user_role_cookie:
             return {"isValid": True}
@@ -0,0 +1,85 @@
+from backend.Agents.text_agents import summarize_and_analyze_agent
+from backend.src.logic import process_request
+from backend.src.session_stream import AnalysisSession
+from backend.src.types import PreAnalysis, QueryRequestThesisAndRubric, RubricCriteria
+from backend.src.utils import process_pdf, process_docx, process_initial_agents
+
+from fastapi import UploadFile
+from io import BytesIO
+import logging
+from typing import Dict, Optional
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class UnsupportedFileTypeError(ValueError):
+    """The uploaded document is neither a PDF nor a DOCX file."""
+
+
+async def extract_document(file: UploadFile) -> Dict[str, str]:
+    """
+    Extract the text of a dissertation and the analysis of its images.
+
+    Raises:
+        UnsupportedFileTypeError: If the file is not a .pdf or .docx
+    """
+    if file.filename.endswith(".pdf"):
+        return await process_pdf(file)
+    elif file.filename.endswith(".docx"):
+        return await process_docx(file)
+    raise UnsupportedFileTypeError(file.filename)
+
+
+async def pre_analyze(thesis: str) -> Dict[str, str]:
+    """Extract degree, name and topic of a thesis and summarize it."""
+    # Process initial agents in batch
+    initial_results = await process_initial_agents(thesis)
+
+    # Use the topic from batch results for summary
+    summary_of_thesis = await summarize_and_analyze_agent(thesis, initial_results["topic"])
+
+    return {
+        "degree": initial_results["degree"],
+        "name": initial_results["name"],
+        "topic": initial_results["topic"],
+        "pre_analyzed_summary": summary_of_thesis
+    }
+
+
+async def process_document(
+    session: AnalysisSession,
+    filename: str,
+    content: bytes,
+    rubric: Dict[str, RubricCriteria],
+    feedback: Optional[str] = None
+) -> Optional[dict]:
+    """
+    Run the whole pipeline for an uploaded document: extraction, pre-analysis and criterion
+    evaluation. Progress is published to the session's event log as "stage" events, followed
+    by the usual evaluation messages. Returns the final results like process_request.
+    """
+    async def stage(name: str, status: str) -> bool:
+        return await session.publish({"type": "stage", "data": {"stage": name, "status": status}})
+
+    try:
+        if not await stage("extraction", "started"):
+            return None
+        extracted = await extract_document(UploadFile(file=BytesIO(content), filename=filename))
+        if not await stage("extraction", "complete"):
+            return None
+
+        if not await stage("pre_analysis", "started"):
+            return None
+        pre_analysis = await pre_analyze(extracted["text_and_image_analysis"])
+        if not await stage("pre_analysis", "complete"):
+            return None
+
+    except Exception as e:
+        logger.error(f"Error preparing document {filename} for session {session.session_id}: {e}")
+        await session.publish({"type": "error", "data": {"message": f"Failed to process {filename}: {e}"}})
+        return None
+
+    request = QueryRequestThesisAndRubric(rubric=rubric, pre_analysis=PreAnalysis(**pre_analysis), feedback=feedback)
+    return await process_request(session, request)
@@ -0,0 +1,277 @@
+from backend.src.durations import QUEUE_STATUS_BACKEND, get_duration_model
+from backend.src.redis_client import get_redis
+from backend.src.scheduler import PendingJob, Priority, get_scheduler
+from backend.src.session_router import get_session_router
+from backend.src.slots import MAX_CONCURRENT_USERS
+
+from abc import ABC, abstractmethod
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How often queued sessions are sent their position and ETA (only when it changed)
+QUEUE_STATUS_INTERVAL_SECONDS = float(os.getenv("QUEUE_STATUS_INTERVAL_SECONDS", 5))
+# Entries of jobs whose process died without finishing them are dropped after this long
+QUEUE_STATUS_STALE_SECONDS = float(os.getenv("QUEUE_STATUS_STALE_SECONDS", 24 * 3600))
+# Arrival and completion rates are measured over this window
+QUEUE_STATUS_RATE_WINDOW_SECONDS = 3600
+
+
+def estimate_job(request: dict) -> float:
+    """
+    Expected seconds for a queued request: a pre-analysed one, or a "document" job whose
+    "units" were read from the file's structure when it was queued.
+    """
+    units = dict(request.get("units") or {})
+    if request.get("kind") != "document":
+        units.update(page=0, image=0, chunk=0)
+    if request.get("rubric"):
+        units["criterion"] = len(request["rubric"])
+    return get_duration_model().estimate(**units)
+
+
+class QueueTracker(ABC):
+    """
+    Knows which jobs wait for a slot and which run, with their estimated durations, to tell a
+    queued job its position and when it should start. Waiting jobs are put in the order the
+    scheduler would grant them slots: by priority class, fair share between evaluators and
+    each evaluator's shortest job first.
+    """
+
+    def __init__(self, capacity: int = MAX_CONCURRENT_USERS):
+        self.capacity = capacity
+
+    @abstractmethod
+    async def enqueue(self, job_id: str, estimate: float, priority: Priority = Priority.INTERACTIVE, evaluator: str = "unknown"):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def start(self, job_id: str, estimate: float):
+        """The job got a slot."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def finish(self, job_id: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _snapshot(self) -> Tuple[List[PendingJob], List[Tuple[float, float]], int, int]:
+        """Waiting jobs (cost is their estimate), running jobs as (started, estimate), arrivals and completions in the rate window."""
+        raise NotImplementedError
+
+    def _slot_free_times(self, running: List[Tuple[float, float]], now: float) -> List[float]:
+        # Seconds until each slot frees up; jobs past their estimate are assumed nearly done
+        free_at = [max(started + estimate - now, 0.0) for started, estimate in running]
+        free_at += [0.0] * max(self.capacity - len(free_at), 0)
+        heapq.heapify(free_at)
+        return free_at
+
+    async def positions(self) -> Dict[str, Dict]:
+        """Position and expected start of every waiting job, by job id."""
+        waiting, running, _, _ = await self._snapshot()
+        now = time.time()
+        free_at = self._slot_free_times(running, now)
+        positions = {}
+        for ahead, job in enumerate(get_scheduler().dispatch_order(waiting, now)):
+            starts_in = heapq.heappop(free_at)
+            positions[job.holder_id] = {
+                "position": ahead + 1,
+                "eta_seconds": round(starts_in),
+                "estimated_duration_seconds": round(job.cost)
+            }
+            heapq.heappush(free_at, starts_in + job.cost)
+        return positions
+
+    async def position(self, job_id: str) -> Optional[Dict]:
+        """Position and expected start of a waiting job, or None if it is not waiting."""
+        return (await self.positions()).get(job_id)
+
+    async def status(self) -> Dict:
+        waiting, running, arrivals, completions = await self._snapshot()
+        free_at = self._slot_free_times(running, time.time())
+        for job in waiting:
+            heapq.heappush(free_at, heapq.heappop(free_at) + job.cost)
+        window_hours = QUEUE_STATUS_RATE_WINDOW_SECONDS / 3600
+        model = get_duration_model()
+        return {
+            "capacity": self.capacity,
+            "running": len(running),
+            "waiting": len(waiting),
+            "waiting_by_priority": {
+                priority.name.lower(): sum(1 for job in waiting if job.priority == priority) for priority in Priority
+            },
+            # When a job submitted now would start
+            "eta_seconds_for_new_job": round(free_at[0]),
+            "arrivals_per_hour": arrivals / window_hours,
+            "completions_per_hour": completions / window_hours,
+            "seconds_per_unit": {stage: round(seconds, 3) for stage, seconds in model.seconds_per_unit.items()}
+        }
+
+
+class LocalQueueTracker(QueueTracker):
+    """Jobs of this process only."""
+
+    def __init__(self, capacity: int = MAX_CONCURRENT_USERS):
+        super().__init__(capacity)
+        self.waiting: Dict[str, PendingJob] = {}
+        self.running: Dict[str, Tuple[float, float]] = {}
+        self.arrivals: List[float] = []
+        self.completions: List[float] = []
+
+    async def enqueue(self, job_id: str, estimate: float, priority: Priority = Priority.INTERACTIVE, evaluator: str = "unknown"):
+        self.waiting[job_id] = PendingJob(job_id, evaluator, priority, estimate, time.time())
+        self.arrivals.append(time.time())
+
+    async def start(self, job_id: str, estimate: float):
+        self.waiting.pop(job_id, None)
+        self.running[job_id] = (time.time(), estimate)
+
+    async def finish(self, job_id: str):
+        self.waiting.pop(job_id, None)
+        if self.running.pop(job_id, None) is not None:
+            self.completions.append(time.time())
+
+    async def _snapshot(self):
+        now = time.time()
+        cutoff = now - QUEUE_STATUS_RATE_WINDOW_SECONDS
+        self.arrivals = [t for t in self.arrivals if t > cutoff]
+        self.completions = [t for t in self.completions if t > cutoff]
+        for job_id, (started, _) in list(self.running.items()):
+            if started < now - QUEUE_STATUS_STALE_SECONDS:
+                del self.running[job_id]
+        for job_id, job in list(self.waiting.items()):
+            if job.enqueued_at < now - QUEUE_STATUS_STALE_SECONDS:
+                del self.waiting[job_id]
+        return (
+            list(self.waiting.values()),
+            list(self.running.values()),
+            len(self.arrivals),
+            len(self.completions)
+        )
+
+
+class RedisQueueTracker(QueueTracker):
+    """Jobs of every replica and worker."""
+
+    def __init__(self, client, capacity: int = MAX_CONCURRENT_USERS, prefix: str = "dissertation:queue_status"):
+        super().__init__(capacity)
+        self.client = client
+        self.waiting_key = f"{prefix}:waiting"  # zset: job id by arrival time
+        self.jobs_key = f"{prefix}:jobs"  # hash: job id -> {"estimate", "priority", "evaluator", "started"}
+        self.running_key = f"{prefix}:running"  # zset: job id by start time
+        self.arrivals_key = f"{prefix}:arrivals"
+        self.completions_key = f"{prefix}:completions"
+
+    async def _record_event(self, key: str, job_id: str, now: float):
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {job_id: now})
+            pipe.zremrangebyscore(key, "-inf", now - QUEUE_STATUS_RATE_WINDOW_SECONDS)
+            await pipe.execute()
+
+    async def enqueue(self, job_id: str, estimate: float, priority: Priority = Priority.INTERACTIVE, evaluator: str = "unknown"):
+        now = time.time()
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(self.jobs_key, job_id, json.dumps({"estimate": estimate, "priority": int(priority), "evaluator": evaluator}))
+            pipe.zadd(self.waiting_key, {job_id: now})
+            await pipe.execute()
+        await self._record_event(self.arrivals_key, job_id, now)
+
+    async def start(self, job_id: str, estimate: float):
+        now = time.time()
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.waiting_key, job_id)
+            pipe.hset(self.jobs_key, job_id, json.dumps({"estimate": estimate, "started": now}))
+            pipe.zadd(self.running_key, {job_id: now})
+            await pipe.execute()
+
+    async def finish(self, job_id: str):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.waiting_key, job_id)
+            pipe.zrem(self.running_key, job_id)
+            pipe.hdel(self.jobs_key, job_id)
+            results = await pipe.execute()
+        if results[1]:
+            await self._record_event(self.completions_key, job_id, time.time())
+
+    async def _snapshot(self):
+        now = time.time()
+        cutoff = now - QUEUE_STATUS_RATE_WINDOW_SECONDS
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.zrange(self.waiting_key, 0, -1, withscores=True)
+            pipe.zrange(self.running_key, 0, -1)
+            pipe.hgetall(self.jobs_key)
+            pipe.zcount(self.arrivals_key, cutoff, "+inf")
+            pipe.zcount(self.completions_key, cutoff, "+inf")
+            waiting_ids, running_ids, jobs, arrivals, completions = await pipe.execute()
+
+        decode = lambda value: value.decode() if isinstance(value, bytes) else value
+        jobs = {decode(job_id): json.loads(job) for job_id, job in jobs.items()}
+        waiting, running, stale = [], [], []
+        for job_id, enqueued_at in waiting_ids:
+            job_id = decode(job_id)
+            job = jobs.get(job_id)
+            if job is None or enqueued_at < now - QUEUE_STATUS_STALE_SECONDS:
+                await self.client.zrem(self.waiting_key, job_id)
+            else:
+                waiting.append(PendingJob(
+                    job_id, job.get("evaluator", "unknown"), Priority(job.get("priority", 0)), job["estimate"], enqueued_at
+                ))
+        for job_id in map(decode, running_ids):
+            job = jobs.get(job_id)
+            if job is None or job["started"] < now - QUEUE_STATUS_STALE_SECONDS:
+                stale.append(job_id)
+            else:
+                running.append((job["started"], job["estimate"]))
+        if stale:
+            await self.client.zrem(self.running_key, *stale)
+            await self.client.hdel(self.jobs_key, *stale)
+        return waiting, running, arrivals, completions
+
+
+_tracker: Optional[QueueTracker] = None
+
+
+def get_queue_tracker() -> QueueTracker:
+    """Return the process-wide queue tracker chosen by QUEUE_STATUS_BACKEND."""
+    global _tracker
+    if _tracker is None:
+        _tracker = RedisQueueTracker(get_redis()) if QUEUE_STATUS_BACKEND == "redis" else LocalQueueTracker()
+    return _tracker
+
+
+def _changed_little(sent: Optional[Dict], position: Dict) -> bool:
+    # The ETA counts down on its own; only resend it when it moves by more than 30 s
+    return sent is not None and sent["position"] == position["position"] \
+        and abs(sent["eta_seconds"] - position["eta_seconds"]) <= 30
+
+
+async def push_queue_positions():
+    """
+    Send each queued session whose notification socket this process holds its position and
+    ETA, whenever either changes.
+    """
+    router = get_session_router()
+    tracker = get_queue_tracker()
+    last_sent: Dict[str, Dict] = {}
+    while True:
+        await asyncio.sleep(QUEUE_STATUS_INTERVAL_SECONDS)
+        try:
+            await get_duration_model().refresh()
+            positions = await tracker.positions()
+            for session_id in list(router.clients):
+                position = positions.get(session_id)
+                if position is None or _changed_little(last_sent.get(session_id), position):
+                    continue
+                if await router.send(session_id, {"type": "queue_position", "session_id": session_id, "data": position}, wait=0):
+                    last_sent[session_id] = position
+            last_sent = {session_id: sent for session_id, sent in last_sent.items() if session_id in router.clients}
+        except Exception as e:
+            logger.error(f"Error sending queue positions: {e}")
@@ -0,0 +1,53 @@
+import logging
+import os
+import redis.asyncio as aioredis
+from typing import Optional
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+# Redis holding the SAML login sessions
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", REDIS_URL)
+# Connections the session client keeps in its pool, shared by all requests of the process
+SESSION_REDIS_MAX_CONNECTIONS = int(os.getenv("SESSION_REDIS_MAX_CONNECTIONS", 50))
+
+_redis: Optional[aioredis.Redis] = None
+
+
+def get_redis() -> aioredis.Redis:
+    """Process-wide asyncio Redis client (connections are pooled by the client)."""
+    global _redis
+    if _redis is None:
+        _redis = aioredis.from_url(REDIS_URL)
+    return _redis
+
+
+_session_redis: Optional[aioredis.Redis] = None
+
+
+def get_session_redis() -> aioredis.Redis:
+    """Process-wide asyncio Redis client for login sessions, with string responses."""
+    global _session_redis
+    if _session_redis is None:
+        pool = aioredis.ConnectionPool.from_url(
+            SESSION_REDIS_URL, max_connections=SESSION_REDIS_MAX_CONNECTIONS, decode_responses=True
+        )
+        _session_redis = aioredis.Redis.from_pool(pool)
+    return _session_redis
+
+
+async def open_session_redis():
+    """Create the session client's pool at startup (called from the app's lifespan)."""
+    try:
+        await get_session_redis().ping()
+    except Exception as e:
+        logger.error(f"Session Redis at {SESSION_REDIS_URL} is not reachable: {e}")
+
+
+async def close_session_redis():
+    global _session_redis
+    if _session_redis is not None:
+        await _session_redis.aclose()
+        _session_redis = None
@@ -0,0 +1,211 @@
+from backend.src.database import AsyncSessionLocal
+from backend.src.types import User, UserScore
+
+import asyncio
+from contextlib import suppress
+from dataclasses import dataclass, field
+import logging
+import os
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Optional, Tuple
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Group the results of concurrent batch jobs into shared transactions
+RESULTS_BUFFERED_WRITES = os.getenv("RESULTS_BUFFERED_WRITES", "false").lower() == "true"
+# A group is written once it has this many evaluations, or this many ms after its first one
+RESULTS_FLUSH_MAX_BATCH = int(os.getenv("RESULTS_FLUSH_MAX_BATCH", 50))
+RESULTS_FLUSH_INTERVAL_MS = float(os.getenv("RESULTS_FLUSH_INTERVAL_MS", 200))
+
+
+@dataclass
+class Evaluation:
+    """An evaluated thesis and its criterion scores, as stored in Users and UserScores."""
+    name: str
+    degree: str
+    topic: str
+    total_score: float
+    evaluator: str
+    rubric_name: Optional[str]
+    # {"dimension_name", "score", "data"} per criterion
+    scores: List[Dict] = field(default_factory=list)
+
+    @classmethod
+    def from_result(cls, result: dict, rubric_name: str, evaluator: str) -> "Evaluation":
+        """From the result of batch_process_request."""
+        return cls(
+            name=result["name"],
+            degree=result["degree"],
+            topic=result["topic"],
+            total_score=result["total_score"],
+            evaluator=evaluator,
+            rubric_name=rubric_name,
+            scores=[
+                {"dimension_name": criterion, "score": evaluation["score"], "data": evaluation["feedback"]}
+                for criterion, evaluation in result["criteria_evaluations"].items()
+            ]
+        )
+
+    def user_row(self) -> Dict:
+        return {
+            "name": self.name,
+            "degree": self.degree,
+            "topic": self.topic,
+            "total_score": self.total_score,
+            "evaluator": self.evaluator,
+            "rubric_name": self.rubric_name
+        }
+
+
+async def insert_evaluations(db: AsyncSession, evaluations: List[Evaluation]) -> List[int]:
+    """
+    Insert evaluations in the session's transaction (without committing). The scores of all
+    of them go in one multi-row insert. Returns the new user ids.
+    """
+    user_ids = []
+    for evaluation in evaluations:
+        result = await db.execute(insert(User).values(**evaluation.user_row()))
+        user_ids.append(result.inserted_primary_key[0])
+
+    score_rows = [
+        {"user_id": user_id, **score}
+        for user_id, evaluation in zip(user_ids, evaluations)
+        for score in evaluation.scores
+    ]
+    if score_rows:
+        await db.execute(insert(UserScore), score_rows)
+    return user_ids
+
+
+async def save_evaluation(db: AsyncSession, evaluation: Evaluation) -> int:
+    """Store an evaluation and its scores in a single transaction. Returns the user id."""
+    try:
+        [user_id] = await insert_evaluations(db, [evaluation])
+        await db.commit()
+        return user_id
+    except Exception:
+        await db.rollback()
+        raise
+
+
+async def update_scores(db: AsyncSession, user_id: int, scores: Dict[str, int]) -> Optional[int]:
+    """
+    Set the scores of some criteria of an evaluation with one statement and recompute its
+    total. Returns the new total, or None if there is no such evaluation.
+    """
+    try:
+        if scores:
+            await db.execute(
+                update(UserScore)
+                .where(UserScore.user_id == user_id, UserScore.dimension_name.in_(scores))
+                .values(score=case(scores, value=UserScore.dimension_name))
+                .execution_options(synchronize_session=False)
+            )
+        total = select(func.coalesce(func.sum(UserScore.score), 0)).where(UserScore.user_id == user_id)
+        await db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(total_score=total.scalar_subquery())
+            .execution_options(synchronize_session=False)
+        )
+        total_score = await db.scalar(select(User.total_score).where(User.id == user_id))
+        if total_score is None:
+            await db.rollback()
+            return None
+        await db.commit()
+        return total_score
+    except Exception:
+        await db.rollback()
+        raise
+
+
+class ResultsWriter:
+    """
+    Stores the evaluations of batch jobs. With buffering, evaluations submitted while a group
+    is open are written together in one transaction, one round trip for all their scores;
+    each submitter still waits until its own evaluation is committed.
+    """
+
+    def __init__(
+        self,
+        buffered: bool = RESULTS_BUFFERED_WRITES,
+        max_batch: int = RESULTS_FLUSH_MAX_BATCH,
+        interval: float = RESULTS_FLUSH_INTERVAL_MS / 1000
+    ):
+        self.buffered = buffered
+        self.max_batch = max_batch
+        self.interval = interval
+        self.pending: List[Tuple[Evaluation, asyncio.Future]] = []
+        self._full = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def submit(self, evaluation: Evaluation) -> int:
+        """Store an evaluation; returns its user id once committed."""
+        if AsyncSessionLocal is None:
+            raise RuntimeError("Database session factory is not initialized.")
+        if not self.buffered:
+            async with AsyncSessionLocal() as db:
+                return await save_evaluation(db, evaluation)
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((evaluation, future))
+        if len(self.pending) >= self.max_batch:
+            self._full.set()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_after_interval())
+        return await future
+
+    async def _flush_after_interval(self):
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._full.wait(), self.interval)
+        while self.pending:
+            self._full.clear()
+            group, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            await self._write(group)
+
+    async def _write(self, group: List[Tuple[Evaluation, asyncio.Future]]):
+        try:
+            async with AsyncSessionLocal() as db:
+                try:
+                    user_ids = await insert_evaluations(db, [evaluation for evaluation, _ in group])
+                    await db.commit()
+                except Exception:
+                    await db.rollback()
+                    raise
+        except Exception as e:
+            # Write them one by one, so one bad evaluation does not fail the others
+            logger.warning(f"Grouped write of {len(group)} evaluations failed, writing them separately: {e}")
+            for evaluation, future in group:
+                try:
+                    async with AsyncSessionLocal() as db:
+                        user_id = await save_evaluation(db, evaluation)
+                    if not future.done():
+                        future.set_result(user_id)
+                except Exception as error:
+                    if not future.done():
+                        future.set_exception(error)
+            return
+        logger.info(f"Stored {len(group)} evaluations in one transaction")
+        for (_, future), user_id in zip(group, user_ids):
+            if not future.done():
+                future.set_result(user_id)
+
+    async def stop(self):
+        """Write what is still buffered."""
+        if self._flusher is not None and not self._flusher.done():
+            self._full.set()
+            await self._flusher
+
+
+_writer: Optional[ResultsWriter] = None
+
+
+def get_results_writer() -> ResultsWriter:
+    """Return the process-wide writer for batch results."""
+    global _writer
+    if _writer is None:
+        _writer = ResultsWriter()
+    return _writer
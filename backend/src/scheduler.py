@@ -0,0 +1,296 @@
+from backend.InferenceEngine.metrics import counter, gauge
+from backend.src.admission import AdmissionController, get_admission_controller
+from backend.src.slots import MAX_CONCURRENT_USERS, SlotLease, SlotSemaphore, get_slot_semaphore
+
+import asyncio
+from enum import IntEnum
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+import uuid
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Analyses of one evaluator this process runs at once (0: no cap)
+SCHED_EVALUATOR_MAX_ACTIVE = int(os.getenv("SCHED_EVALUATOR_MAX_ACTIVE", 0))
+# Bulk analyses this process runs at once, so interactive ones always find a slot soon
+SCHED_BULK_MAX_ACTIVE = int(os.getenv("SCHED_BULK_MAX_ACTIVE", max(1, MAX_CONCURRENT_USERS - 1)))
+# Fair-share weights, e.g. "alice=2,bob=0.5"; evaluators not listed weigh 1
+SCHED_EVALUATOR_WEIGHTS = os.getenv("SCHED_EVALUATOR_WEIGHTS", "")
+# An evaluator's shortest expected job goes first; every second spent waiting counts as this many
+# seconds less expected duration, so long jobs are not passed over forever
+SCHED_AGING_RATE = float(os.getenv("SCHED_AGING_RATE", 0.5))
+
+waiting_gauge = gauge("dissertation_scheduler_waiting", "Analyses waiting for a slot, by priority class")
+granted_counter = counter("dissertation_scheduler_granted_total", "Slots granted by the scheduler, by priority class")
+
+
+class Priority(IntEnum):
+    """Priority classes; a lower value is always served first."""
+    INTERACTIVE = 0
+    BULK = 1
+
+    @classmethod
+    def parse(cls, name: Optional[str]) -> "Priority":
+        return cls[name.upper()] if name else cls.INTERACTIVE
+
+
+def parse_weights(text: str) -> Dict[str, float]:
+    weights = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, weight = item.rpartition("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+class PendingJob:
+    """A job waiting for a slot, as the scheduler orders it."""
+
+    def __init__(self, holder_id: str, evaluator: str, priority: Priority, cost: float, enqueued_at: float):
+        self.holder_id = holder_id
+        self.evaluator = evaluator
+        self.priority = priority
+        self.cost = cost
+        self.enqueued_at = enqueued_at
+
+
+class _Waiter(PendingJob):
+    def __init__(self, holder_id: str, evaluator: str, priority: Priority, cost: float):
+        super().__init__(holder_id, evaluator, priority, cost, time.monotonic())
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class ScheduledLease(SlotLease):
+    """A slot granted by the scheduler, wrapping the slot semaphore's own lease."""
+
+    def __init__(self, scheduler: "FairScheduler", holder_id: str, evaluator: str, priority: Priority, slot: SlotLease):
+        super().__init__(scheduler, holder_id)
+        self.evaluator = evaluator
+        self.priority = priority
+        self.slot = slot
+
+
+class FairScheduler(SlotSemaphore):
+    """
+    Hands out analysis slots in priority order: interactive analyses before bulk ones. Within a
+    class, slots are shared between evaluators by weighted fair queuing, so one evaluator's
+    large batch cannot starve another's single upload. Each evaluator's own jobs run shortest
+    expected first, aged by their wait. Bulk analyses and each evaluator are capped, keeping
+    slots free for the next interactive request. With an admission controller, no slot is
+    granted while the inference backends are saturated.
+    """
+
+    def __init__(
+        self,
+        slots: SlotSemaphore,
+        evaluator_cap: int = SCHED_EVALUATOR_MAX_ACTIVE,
+        bulk_cap: int = SCHED_BULK_MAX_ACTIVE,
+        weights: Optional[Dict[str, float]] = None,
+        aging_rate: float = SCHED_AGING_RATE,
+        admission: Optional[AdmissionController] = None
+    ):
+        super().__init__(slots.capacity)
+        self.slots = slots
+        self.admission = admission
+        self.evaluator_cap = evaluator_cap
+        self.bulk_cap = bulk_cap
+        self.weights = parse_weights(SCHED_EVALUATOR_WEIGHTS) if weights is None else weights
+        self.aging_rate = aging_rate
+        self.waiting: List[_Waiter] = []
+        self.virtual_time: Dict[Priority, float] = {priority: 0.0 for priority in Priority}
+        self.last_finish: Dict[Tuple[Priority, str], float] = {}
+        self.active_by_evaluator: Dict[str, int] = {}
+        self.active_by_priority: Dict[Priority, int] = {priority: 0 for priority in Priority}
+        self._changed = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _tags(
+        self,
+        evaluator: str,
+        priority: Priority,
+        cost: float,
+        virtual_time: Optional[Dict[Priority, float]] = None,
+        last_finish: Optional[Dict[Tuple[Priority, str], float]] = None
+    ) -> Tuple[float, float]:
+        # Virtual start and finish times: an evaluator's jobs are spaced cost / weight apart
+        virtual_time = self.virtual_time if virtual_time is None else virtual_time
+        last_finish = self.last_finish if last_finish is None else last_finish
+        start = max(virtual_time[priority], last_finish.get((priority, evaluator), 0.0))
+        return start, start + cost / self.weights.get(evaluator, 1.0)
+
+    def _eligible(self, evaluator: str, priority: Priority) -> bool:
+        if self.evaluator_cap and self.active_by_evaluator.get(evaluator, 0) >= self.evaluator_cap:
+            return False
+        if priority == Priority.BULK and self.active_by_priority[Priority.BULK] >= self.bulk_cap:
+            return False
+        return True
+
+    def _pick(
+        self,
+        jobs: List[PendingJob],
+        now: float,
+        virtual_time: Optional[Dict[Priority, float]] = None,
+        last_finish: Optional[Dict[Tuple[Priority, str], float]] = None
+    ) -> Optional[Tuple[PendingJob, float, float]]:
+        """The job to serve next, with its virtual start and finish times."""
+        aged = lambda job: (job.cost - self.aging_rate * (now - job.enqueued_at), job.enqueued_at)
+        heads: Dict[Tuple[Priority, str], PendingJob] = {}
+        for job in jobs:
+            flow = (job.priority, job.evaluator)
+            if flow not in heads or aged(job) < aged(heads[flow]):
+                heads[flow] = job
+
+        best = None
+        for (priority, evaluator), job in heads.items():
+            start, finish = self._tags(evaluator, priority, job.cost, virtual_time, last_finish)
+            if best is None or (priority, finish, job.enqueued_at) < (best[0].priority, best[2], best[0].enqueued_at):
+                best = (job, start, finish)
+        return best
+
+    def _next_waiter(self) -> Optional[Tuple[_Waiter, float, float]]:
+        # A cancelled waiter stays listed until its task runs again to remove itself
+        eligible = [
+            waiter for waiter in self.waiting
+            if not waiter.future.done() and self._eligible(waiter.evaluator, waiter.priority)
+        ]
+        return self._pick(eligible, time.monotonic())
+
+    def dispatch_order(self, jobs: List[PendingJob], now: float) -> List[PendingJob]:
+        """
+        The order in which the scheduler would grant slots to these jobs if no others arrived,
+        leaving the caps aside. Their enqueued_at must be on the same clock as now.
+        """
+        virtual_time = dict(self.virtual_time)
+        last_finish = dict(self.last_finish)
+        remaining = list(jobs)
+        order = []
+        while remaining:
+            job, start, finish = self._pick(remaining, now, virtual_time, last_finish)
+            last_finish[(job.priority, job.evaluator)] = finish
+            virtual_time[job.priority] = max(virtual_time[job.priority], start)
+            remaining.remove(job)
+            order.append(job)
+        return order
+
+    def _grant(
+        self,
+        holder_id: str,
+        evaluator: str,
+        priority: Priority,
+        tags: Tuple[float, float],
+        slot: SlotLease
+    ) -> ScheduledLease:
+        start, finish = tags
+        self.last_finish[(priority, evaluator)] = finish
+        self.virtual_time[priority] = max(self.virtual_time[priority], start)
+        self.active_by_evaluator[evaluator] = self.active_by_evaluator.get(evaluator, 0) + 1
+        self.active_by_priority[priority] += 1
+        granted_counter.inc(priority=priority.name.lower())
+        logger.info(f"Slot granted to {holder_id} ({priority.name.lower()}, evaluator {evaluator})")
+        return ScheduledLease(self, holder_id, evaluator, priority, slot)
+
+    def _update_waiting_gauge(self):
+        for priority in Priority:
+            waiting_gauge.set(sum(1 for waiter in self.waiting if waiter.priority == priority), priority=priority.name.lower())
+
+    async def try_acquire(
+        self,
+        holder_id: str,
+        evaluator: str = "unknown",
+        priority: Priority = Priority.INTERACTIVE,
+        cost: float = 60.0
+    ) -> Optional[SlotLease]:
+        """
+        Take a slot without waiting, unless that would jump ahead of a waiter of the same or a
+        higher class or the inference backends are saturated.
+        """
+        if not self._eligible(evaluator, priority):
+            return None
+        if any(waiter.priority <= priority and self._eligible(waiter.evaluator, waiter.priority) for waiter in self.waiting):
+            return None
+        slot = await self.slots.try_acquire(holder_id)
+        if slot is None:
+            return None
+        if self.admission is not None and not await self.admission.admits():
+            await slot.release()
+            return None
+        return self._grant(holder_id, evaluator, priority, self._tags(evaluator, priority, cost), slot)
+
+    async def acquire(
+        self,
+        holder_id: str,
+        evaluator: str = "unknown",
+        priority: Priority = Priority.INTERACTIVE,
+        cost: float = 60.0
+    ) -> SlotLease:
+        """
+        Wait for a slot.
+
+        Args:
+            cost: Expected duration of the job in seconds; longer jobs wait behind their
+                evaluator's shorter ones and use up more of the evaluator's fair share
+        """
+        waiter = _Waiter(holder_id, evaluator, priority, cost)
+        self.waiting.append(waiter)
+        self._update_waiting_gauge()
+        self._changed.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self.waiting:
+                self.waiting.remove(waiter)
+                self._update_waiting_gauge()
+            elif waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the wait was cancelled
+                await waiter.future.result().release()
+            raise
+
+    async def _dispatch(self):
+        while True:
+            if self._next_waiter() is None:
+                self._changed.clear()
+                await self._changed.wait()
+                continue
+
+            # Wait for the backends before taking a slot, so no slot (possibly shared by every
+            # replica) sits idle meanwhile. Take the slot first and choose who gets it
+            # afterwards, so a request that arrived while we waited is not passed over.
+            if self.admission is not None:
+                await self.admission.wait_until_admitted()
+            slot = await self.slots.acquire(f"scheduler:{uuid.uuid4().hex}")
+            chosen = self._next_waiter()
+            if chosen is None:
+                await slot.release()
+                continue
+            waiter, start, finish = chosen
+            self.waiting.remove(waiter)
+            self._update_waiting_gauge()
+            waiter.future.set_result(self._grant(waiter.holder_id, waiter.evaluator, waiter.priority, (start, finish), slot))
+
+    async def release(self, lease: ScheduledLease):
+        self.active_by_evaluator[lease.evaluator] -= 1
+        if not self.active_by_evaluator[lease.evaluator]:
+            del self.active_by_evaluator[lease.evaluator]
+        self.active_by_priority[lease.priority] -= 1
+        await lease.slot.release()
+        # A cap may no longer hold a waiter back
+        self._changed.set()
+
+    async def active(self) -> int:
+        return await self.slots.active()
+
+
+_scheduler: Optional[FairScheduler] = None
+
+
+def get_scheduler() -> FairScheduler:
+    """Return the process-wide scheduler in front of the analysis slots."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FairScheduler(get_slot_semaphore(), admission=get_admission_controller())
+    return _scheduler
@@ -0,0 +1,129 @@
+from backend.src.redis_client import get_session_redis
+
+import asyncio
+from collections import OrderedDict
+from contextlib import suppress
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How long a verified session is trusted without asking Redis again (never longer than its Redis expiry)
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS", 30))
+# Sessions kept per process; the least recently used are evicted first (0 disables the cache)
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", 10000))
+# Logouts are published here so every replica drops the session at once
+SESSION_INVALIDATION_CHANNEL = "dissertation:session_invalidations"
+
+
+class SessionCache:
+    """
+    Decoded login sessions of recent requests, so a page firing dozens of API calls reads
+    Redis once. Entries expire after the cache TTL or when the session expires in Redis,
+    whichever comes first, and are dropped on every replica when a session is revoked. The
+    cache is only used while the invalidation listener is subscribed; until then (or after
+    it loses its connection) every lookup goes to Redis.
+    """
+
+    def __init__(self, client, ttl: float = SESSION_CACHE_TTL_SECONDS, max_entries: int = SESSION_CACHE_MAX_ENTRIES):
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Tuple[Dict, float]]" = OrderedDict()
+        self.subscribed = False
+        # Bumped on every invalidation, so a lookup that overlapped one does not cache its result
+        self.generation = 0
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.max_entries and (self._listener is None or self._listener.done()):
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._listener
+            self._listener = None
+
+    async def _listen(self):
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(SESSION_INVALIDATION_CHANNEL)
+                self.subscribed = True
+                async for item in pubsub.listen():
+                    self._invalidate(item["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Session invalidation listener lost its connection: {e}")
+            finally:
+                # Invalidations may be missed while not subscribed
+                self.subscribed = False
+                self.generation += 1
+                self.entries.clear()
+                with suppress(Exception):
+                    await pubsub.aclose()
+            await asyncio.sleep(1)
+
+    def _invalidate(self, session_id: str):
+        self.generation += 1
+        self.entries.pop(session_id, None)
+
+    def _cached(self, session_id: str) -> Optional[Dict]:
+        entry = self.entries.get(session_id)
+        if entry is None:
+            return None
+        user_data, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self.entries[session_id]
+            return None
+        self.entries.move_to_end(session_id)
+        return user_data
+
+    async def get(self, session_id: str) -> Optional[Dict]:
+        """The decoded session data, or None if the session does not exist (or expired)."""
+        if self.subscribed:
+            user_data = self._cached(session_id)
+            if user_data is not None:
+                return user_data
+
+        generation = self.generation
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.get(session_id)
+            pipe.pttl(session_id)
+            user_data_json, pttl = await pipe.execute()
+        if not user_data_json:
+            return None
+        user_data = json.loads(user_data_json)
+
+        if self.subscribed and generation == self.generation:
+            ttl = self.ttl if pttl < 0 else min(self.ttl, pttl / 1000)
+            self.entries[session_id] = (user_data, time.monotonic() + ttl)
+            self.entries.move_to_end(session_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return user_data
+
+    async def revoke(self, session_id: str):
+        """Delete a session and drop it from the cache of every replica."""
+        await self.client.delete(session_id)
+        self._invalidate(session_id)
+        await self.client.publish(SESSION_INVALIDATION_CHANNEL, session_id)
+
+
+_cache: Optional[SessionCache] = None
+
+
+def get_session_cache() -> SessionCache:
+    """Return the process-wide cache of verified login sessions."""
+    global _cache
+    if _cache is None:
+        _cache = SessionCache(get_session_redis())
+    return _cache
@@ -0,0 +1,201 @@
+from backend.src.redis_client import get_redis
+
+import asyncio
+from contextlib import suppress
+from fastapi import WebSocket
+import json
+import logging
+import os
+import socket
+from typing import Dict, List, Optional
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# "memory" delivers only to sockets held by this process; "redis" routes to whichever replica holds them
+SESSION_ROUTER_BACKEND = os.getenv("SESSION_ROUTER_BACKEND", "memory").lower()
+# Identifies this replica in the routing table (the pod name under Kubernetes)
+POD_ID = os.getenv("POD_ID") or socket.gethostname()
+# Routes of sockets whose pod died without unregistering them expire after this long
+SESSION_ROUTE_TTL_SECONDS = int(os.getenv("SESSION_ROUTE_TTL_SECONDS", 6 * 3600))
+# How long a message waits for the session's notification socket to register
+NOTIFICATION_WAIT_SECONDS = float(os.getenv("NOTIFICATION_WAIT_SECONDS", 30))
+
+
+class SessionRouter:
+    """
+    Delivers messages to the notification WebSocket of a session. Sockets register on the
+    process that accepted them; send() finds the socket and waits briefly for it to register.
+    """
+
+    def __init__(self):
+        self.clients: Dict[str, WebSocket] = {}
+        self.waiters: Dict[str, List[asyncio.Future]] = {}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def register(self, session_id: str, websocket: WebSocket):
+        self.clients[session_id] = websocket
+        for waiter in self.waiters.pop(session_id, []):
+            if not waiter.done():
+                waiter.set_result(websocket)
+
+    async def unregister(self, session_id: str, websocket: WebSocket):
+        if self.clients.get(session_id) is websocket:
+            del self.clients[session_id]
+
+    async def _wait_for_local(self, session_id: str, timeout: float) -> Optional[WebSocket]:
+        if session_id in self.clients:
+            return self.clients[session_id]
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(session_id, []).append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self.waiters.get(session_id)
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self.waiters[session_id]
+
+    async def _deliver(self, session_id: str, message: dict) -> bool:
+        websocket = self.clients.get(session_id)
+        if websocket is None:
+            return False
+        try:
+            await websocket.send_json(message)
+            return True
+        except Exception as e:
+            logger.error(f"Error notifying frontend for session {session_id}: {e}")
+            await self.unregister(session_id, websocket)
+            return False
+
+    async def send(self, session_id: str, message: dict, wait: float = NOTIFICATION_WAIT_SECONDS) -> bool:
+        """
+        Send a message to the session's notification socket.
+
+        Args:
+            wait: Seconds to wait for the socket to register if it has not yet
+
+        Returns:
+            True if the message was handed to the socket's owner
+        """
+        if await self._wait_for_local(session_id, wait) is None:
+            return False
+        return await self._deliver(session_id, message)
+
+
+class RedisSessionRouter(SessionRouter):
+    """
+    Routes across replicas. Each registered socket is recorded in Redis as
+    session id -> pod id; a message for a socket held elsewhere is published on that pod's
+    channel and delivered by the pod's listener.
+    """
+
+    def __init__(self, client, pod_id: str = POD_ID):
+        super().__init__()
+        self.client = client
+        self.pod_id = pod_id
+        self.pod_channel = f"dissertation:pod:{pod_id}"
+        self._listener: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _route_key(session_id: str) -> str:
+        return f"dissertation:notify:{session_id}"
+
+    @staticmethod
+    def _registered_channel(session_id: str) -> str:
+        return f"dissertation:notify:{session_id}:registered"
+
+    async def start(self):
+        """Listen for messages routed to this pod. Returns once subscribed, so none sent after are missed."""
+        if self._listener is None or self._listener.done():
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(self.pod_channel)
+            logger.info(f"Session router listening on {self.pod_channel}")
+            self._listener = asyncio.create_task(self._listen(pubsub))
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._listener
+            self._listener = None
+
+    async def _listen(self, pubsub):
+        try:
+            async for item in pubsub.listen():
+                try:
+                    envelope = json.loads(item["data"])
+                    await self._deliver(envelope["session_id"], envelope["message"])
+                except Exception as e:
+                    logger.error(f"Error delivering routed message: {e}")
+        finally:
+            await pubsub.unsubscribe(self.pod_channel)
+            await pubsub.aclose()
+
+    async def register(self, session_id: str, websocket: WebSocket):
+        # Messages for this socket may be routed here from now on
+        await self.start()
+        await super().register(session_id, websocket)
+        await self.client.set(self._route_key(session_id), self.pod_id, ex=SESSION_ROUTE_TTL_SECONDS)
+        await self.client.publish(self._registered_channel(session_id), self.pod_id)
+
+    async def unregister(self, session_id: str, websocket: WebSocket):
+        if self.clients.get(session_id) is websocket:
+            await super().unregister(session_id, websocket)
+            # Only remove the route if it still points here (the client may have moved pods)
+            with suppress(Exception):
+                if (await self.client.get(self._route_key(session_id))) in (self.pod_id, self.pod_id.encode()):
+                    await self.client.delete(self._route_key(session_id))
+
+    async def _find_owner(self, session_id: str, wait: float) -> Optional[str]:
+        # Subscribe before looking, so a registration in between is not missed
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self._registered_channel(session_id))
+        try:
+            deadline = asyncio.get_running_loop().time() + wait
+            while True:
+                owner = await self.client.get(self._route_key(session_id))
+                if owner is not None:
+                    return owner.decode() if isinstance(owner, bytes) else owner
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    return None
+                await pubsub.get_message(timeout=remaining)
+        finally:
+            await pubsub.unsubscribe(self._registered_channel(session_id))
+            await pubsub.aclose()
+
+    async def send(self, session_id: str, message: dict, wait: float = NOTIFICATION_WAIT_SECONDS) -> bool:
+        if session_id in self.clients:
+            return await self._deliver(session_id, message)
+
+        owner = await self._find_owner(session_id, wait)
+        if owner is None:
+            return False
+        if owner == self.pod_id:
+            return await self._deliver(session_id, message)
+        receivers = await self.client.publish(
+            f"dissertation:pod:{owner}",
+            json.dumps({"session_id": session_id, "message": message})
+        )
+        return receivers > 0
+
+
+_router: Optional[SessionRouter] = None
+
+
+def get_session_router() -> SessionRouter:
+    """Return the process-wide session router chosen by SESSION_ROUTER_BACKEND."""
+    global _router
+    if _router is None:
+        _router = RedisSessionRouter(get_redis()) if SESSION_ROUTER_BACKEND == "redis" else SessionRouter()
+    return _router
@@ -0,0 +1,268 @@
+from backend.InferenceEngine.inference_engines import CancellationToken
+from backend.src.redis_client import get_redis
+from backend.src.stream_coalescer import ConnectionStats
+
+from abc import ABC, abstractmethod
+import asyncio
+from collections import deque
+import json
+import logging
+import os
+import redis.asyncio as aioredis
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Where the per-session event logs live: "memory" (this process only) or "redis" (any replica can replay)
+SESSION_LOG_BACKEND = os.getenv("SESSION_LOG_BACKEND", "memory").lower()
+# Events kept per session; older ones are trimmed and a reconnecting client is told about the gap
+SESSION_LOG_MAX_EVENTS = int(os.getenv("SESSION_LOG_MAX_EVENTS", 20000))
+# How long a finished session can still be replayed
+SESSION_LOG_TTL_SECONDS = int(os.getenv("SESSION_LOG_TTL_SECONDS", 3600))
+# How long generation continues with no client attached before it is cancelled
+ANALYSIS_RESUME_GRACE_SECONDS = float(os.getenv("ANALYSIS_RESUME_GRACE_SECONDS", 120))
+
+_REDIS_BLOCK_MS = 5000
+
+
+class SessionEventLog(ABC):
+    """
+    Append-only, bounded log of the messages emitted by one evaluation. Every event gets a
+    sequence number starting at 1; follow(after_seq) replays everything newer than after_seq
+    and then yields new events live until the log is closed.
+    """
+
+    @abstractmethod
+    async def append(self, event: dict) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def close(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def follow(self, after_seq: int = 0) -> AsyncIterator[Tuple[int, dict]]:
+        raise NotImplementedError
+
+    async def has_followers(self) -> bool:
+        """Whether a client on another replica is following this log."""
+        return False
+
+
+def _truncated(first_seq: int) -> dict:
+    return {"type": "replay_truncated", "data": {"first_seq": first_seq}}
+
+
+class InMemorySessionEventLog(SessionEventLog):
+    def __init__(self, max_events: int = SESSION_LOG_MAX_EVENTS):
+        self.events: Deque[Tuple[int, dict]] = deque(maxlen=max_events)
+        self.last_seq = 0
+        self.closed = False
+        self._changed = asyncio.Condition()
+
+    async def append(self, event: dict) -> int:
+        async with self._changed:
+            self.last_seq += 1
+            self.events.append((self.last_seq, event))
+            self._changed.notify_all()
+            return self.last_seq
+
+    async def close(self):
+        async with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+    async def follow(self, after_seq: int = 0) -> AsyncIterator[Tuple[int, dict]]:
+        last = after_seq
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.last_seq > last or self.closed)
+                pending = [(seq, event) for seq, event in self.events if seq > last] if self.last_seq > last else []
+                closed = self.closed
+
+            if pending and pending[0][0] > last + 1:
+                yield pending[0][0] - 1, _truncated(pending[0][0])
+            for seq, event in pending:
+                yield seq, event
+            if pending:
+                last = pending[-1][0]
+            if closed and last >= self.last_seq:
+                return
+
+
+class RedisSessionEventLog(SessionEventLog):
+    """
+    Session log kept in a Redis stream. Sequence number n is stored under the explicit
+    stream id "0-n", so a reconnecting client on any replica can resume with XRANGE/XREAD.
+    """
+
+    def __init__(self, client: aioredis.Redis, session_id: str, max_events: int = SESSION_LOG_MAX_EVENTS):
+        self.client = client
+        self.key = f"dissertation:session:{session_id}:events"
+        self.followers_key = f"{self.key}:followers"
+        self.max_events = max_events
+        self.last_seq = 0
+
+    async def append(self, event: dict) -> int:
+        self.last_seq += 1
+        await self.client.xadd(
+            self.key,
+            {"event": json.dumps(event, ensure_ascii=False)},
+            id=f"0-{self.last_seq}",
+            maxlen=self.max_events,
+            approximate=True
+        )
+        if self.last_seq == 1:
+            # Bounds the lifetime of logs whose producer died before closing them
+            await self.client.expire(self.key, SESSION_LOG_TTL_SECONDS * 2)
+        return self.last_seq
+
+    async def close(self):
+        await self.client.xadd(self.key, {"end": "1"}, id=f"0-{self.last_seq + 1}")
+        await self.client.expire(self.key, SESSION_LOG_TTL_SECONDS)
+
+    async def has_followers(self) -> bool:
+        return bool(await self.client.exists(self.followers_key))
+
+    async def follow(self, after_seq: int = 0) -> AsyncIterator[Tuple[int, dict]]:
+        last = after_seq
+        first = True
+        while True:
+            await self.client.set(self.followers_key, 1, px=_REDIS_BLOCK_MS * 2)
+            entries = await self.client.xrange(self.key, min=f"(0-{last}", max="+", count=500)
+            if not entries:
+                response = await self.client.xread({self.key: f"0-{last}"}, count=500, block=_REDIS_BLOCK_MS)
+                entries = response[0][1] if response else []
+
+            for entry_id, fields in entries:
+                entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+                seq = int(entry_id.split("-")[1])
+                fields = {(k.decode() if isinstance(k, bytes) else k): v for k, v in fields.items()}
+                if "end" in fields:
+                    return
+                if first and seq > last + 1:
+                    yield seq - 1, _truncated(seq)
+                first = False
+                last = seq
+                yield seq, json.loads(fields["event"])
+
+
+def create_event_log(session_id: str) -> SessionEventLog:
+    if SESSION_LOG_BACKEND == "redis":
+        return RedisSessionEventLog(get_redis(), session_id)
+    return InMemorySessionEventLog()
+
+
+class AnalysisSession:
+    """
+    One evaluation, decoupled from the WebSocket that started it.
+
+    The pipeline publishes its messages to the session's event log; clients attach and detach
+    as they connect. When no client is attached for ANALYSIS_RESUME_GRACE_SECONDS the
+    generation is cancelled, so nobody pays for an evaluation that nobody will read. Without
+    a grace period (grace_seconds None) the session runs to the end whether or not anyone
+    follows it, for jobs whose results are stored.
+    """
+
+    def __init__(self, session_id: str, log: SessionEventLog, grace_seconds: Optional[float] = ANALYSIS_RESUME_GRACE_SECONDS):
+        self.session_id = session_id
+        self.log = log
+        self.grace_seconds = grace_seconds
+        self.cancellation_token = CancellationToken()
+        self.stats = ConnectionStats()
+        self.attached = 0
+        self.task: Optional[asyncio.Task] = None
+        self._grace_timer: Optional[asyncio.TimerHandle] = None
+        self._start_grace_timer()
+
+    async def publish(self, message: dict) -> bool:
+        """
+        Append a message to the session log.
+
+        Returns:
+            False if the evaluation was cancelled and should stop
+        """
+        if self.cancellation_token.is_cancelled:
+            return False
+        await self.log.append(message)
+        return True
+
+    def cancel(self):
+        self.cancellation_token.cancel()
+
+    def attach(self):
+        self.attached += 1
+        if self._grace_timer:
+            self._grace_timer.cancel()
+            self._grace_timer = None
+
+    def detach(self):
+        self.attached = max(0, self.attached - 1)
+        if self.attached == 0 and not self.cancellation_token.is_cancelled:
+            self._start_grace_timer()
+
+    def _start_grace_timer(self):
+        if self.grace_seconds is None:
+            return
+        self._grace_timer = asyncio.get_running_loop().call_later(self.grace_seconds, self._grace_expired)
+
+    def _grace_expired(self):
+        self._grace_timer = None
+        if self.attached == 0:
+            asyncio.create_task(self._expire_if_abandoned())
+
+    async def _expire_if_abandoned(self):
+        try:
+            if await self.log.has_followers():
+                self._start_grace_timer()
+                return
+        except Exception as e:
+            logger.warning(f"Could not check followers of session {self.session_id}: {e}")
+        if self.attached == 0:
+            logger.info(f"No client reattached to session {self.session_id} within {self.grace_seconds}s, cancelling")
+            self.cancel()
+
+    async def finish(self):
+        """Close the log once generation has ended and stop the grace timer."""
+        if self._grace_timer:
+            self._grace_timer.cancel()
+            self._grace_timer = None
+        _sessions.pop(self.session_id, None)
+        try:
+            await self.log.close()
+        except Exception as e:
+            logger.error(f"Error closing event log of session {self.session_id}: {e}")
+        if isinstance(self.log, InMemorySessionEventLog):
+            # Keep a finished in-memory log around for late reconnects
+            _finished_logs[self.session_id] = self.log
+            asyncio.get_running_loop().call_later(SESSION_LOG_TTL_SECONDS, _finished_logs.pop, self.session_id, None)
+
+
+# Sessions generating on this process, and finished in-memory logs that can still be replayed
+_sessions: Dict[str, AnalysisSession] = {}
+_finished_logs: Dict[str, SessionEventLog] = {}
+
+
+def create_session(session_id: str, headless: bool = False) -> AnalysisSession:
+    """A new session; a headless one is never cancelled for lack of a client."""
+    grace_seconds = None if headless else ANALYSIS_RESUME_GRACE_SECONDS
+    session = AnalysisSession(session_id, create_event_log(session_id), grace_seconds)
+    _sessions[session_id] = session
+    return session
+
+
+def get_session(session_id: str) -> Optional[AnalysisSession]:
+    return _sessions.get(session_id)
+
+
+async def find_event_log(session_id: str) -> Optional[SessionEventLog]:
+    """Log to replay for a session that is not generating on this process, if there is one."""
+    if session_id in _finished_logs:
+        return _finished_logs[session_id]
+    if SESSION_LOG_BACKEND == "redis":
+        log = RedisSessionEventLog(get_redis(), session_id)
+        if await log.client.exists(log.key):
+            return log
+    return None
@@ -0,0 +1,219 @@
+from backend.src.redis_client import get_redis
+
+from abc import ABC, abstractmethod
+import asyncio
+from contextlib import suppress
+import logging
+import os
+import redis.asyncio as aioredis
+from typing import Dict, Optional
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Analyses that may run at once. With SLOT_BACKEND=redis this is the limit across all
+# replicas; with "memory" it applies to each process on its own.
+MAX_CONCURRENT_USERS = int(os.getenv("MAX_CONCURRENT_USERS", 3))
+SLOT_BACKEND = os.getenv("SLOT_BACKEND", "memory").lower()
+SLOT_KEY = os.getenv("SLOT_KEY", "dissertation:analysis_slots")
+# A slot whose holder stops renewing it (e.g. the pod crashed) is freed after this long
+SLOT_LEASE_SECONDS = float(os.getenv("SLOT_LEASE_SECONDS", 60))
+# Waiters re-check at least this often, to notice slots freed by an expired lease (no release message)
+SLOT_RECHECK_SECONDS = float(os.getenv("SLOT_RECHECK_SECONDS", SLOT_LEASE_SECONDS / 3))
+
+
+class SlotLease:
+    """A held analysis slot. Call release() exactly once when the analysis is over."""
+
+    def __init__(self, semaphore: "SlotSemaphore", holder_id: str):
+        self.semaphore = semaphore
+        self.holder_id = holder_id
+        self.released = False
+
+    async def release(self):
+        if self.released:
+            return
+        self.released = True
+        await self.semaphore.release(self)
+
+
+class SlotSemaphore(ABC):
+    """
+    Counting semaphore over analysis slots. try_acquire is atomic, so two requests can
+    never both take the last slot.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+
+    @abstractmethod
+    async def try_acquire(self, holder_id: str) -> Optional[SlotLease]:
+        """Take a slot for holder_id if one is free, without waiting."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def acquire(self, holder_id: str) -> SlotLease:
+        """Take a slot for holder_id, waiting until one is released."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def release(self, lease: SlotLease):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def active(self) -> int:
+        """Number of slots currently held."""
+        raise NotImplementedError
+
+
+class LocalSlotSemaphore(SlotSemaphore):
+    """In-process slots, for single-node runs and tests."""
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self.holders: Dict[str, SlotLease] = {}
+        self._released = asyncio.Condition()
+
+    async def try_acquire(self, holder_id: str) -> Optional[SlotLease]:
+        if holder_id not in self.holders and len(self.holders) >= self.capacity:
+            return None
+        lease = SlotLease(self, holder_id)
+        self.holders[holder_id] = lease
+        logger.info(f"Slot acquired by {holder_id}: {len(self.holders)}/{self.capacity} in use")
+        return lease
+
+    async def acquire(self, holder_id: str) -> SlotLease:
+        async with self._released:
+            while (lease := await self.try_acquire(holder_id)) is None:
+                await self._released.wait()
+            return lease
+
+    async def release(self, lease: SlotLease):
+        if self.holders.get(lease.holder_id) is lease:
+            del self.holders[lease.holder_id]
+        logger.info(f"Slot released by {lease.holder_id}: {len(self.holders)}/{self.capacity} in use")
+        async with self._released:
+            self._released.notify()
+
+    async def active(self) -> int:
+        return len(self.holders)
+
+
+# KEYS[1] = slot zset, ARGV = holder, capacity, lease seconds. Members are holders scored by
+# lease expiry (Redis server time), so every replica agrees on which leases have lapsed.
+_ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) or redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+    return 1
+end
+return 0
+"""
+
+_RENEW_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local expiry = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if expiry and tonumber(expiry) > now then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[1])
+    return 1
+end
+return 0
+"""
+
+_ACTIVE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+return redis.call('ZCARD', KEYS[1])
+"""
+
+
+class RedisSlotLease(SlotLease):
+    def __init__(self, semaphore: "RedisSlotSemaphore", holder_id: str):
+        super().__init__(semaphore, holder_id)
+        self._renewer = asyncio.create_task(self._renew_loop())
+
+    async def _renew_loop(self):
+        interval = self.semaphore.lease_seconds / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not await self.semaphore.renew(self.holder_id):
+                    logger.warning(f"Slot lease of {self.holder_id} expired before it could be renewed")
+                    return
+            except Exception as e:
+                logger.warning(f"Could not renew slot lease of {self.holder_id}: {e}")
+
+    async def release(self):
+        self._renewer.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._renewer
+        await super().release()
+
+
+class RedisSlotSemaphore(SlotSemaphore):
+    """
+    Slots shared by every replica, held in a Redis sorted set. Holders renew their lease every
+    lease_seconds / 3; slots of a pod that dies are reclaimed once their lease runs out.
+    """
+
+    def __init__(self, client: aioredis.Redis, capacity: int, key: str = SLOT_KEY, lease_seconds: float = SLOT_LEASE_SECONDS):
+        super().__init__(capacity)
+        self.client = client
+        self.key = key
+        self.released_channel = f"{key}:released"
+        self.lease_seconds = lease_seconds
+        self._acquire = client.register_script(_ACQUIRE_SCRIPT)
+        self._renew = client.register_script(_RENEW_SCRIPT)
+        self._active = client.register_script(_ACTIVE_SCRIPT)
+
+    async def try_acquire(self, holder_id: str) -> Optional[SlotLease]:
+        if not await self._acquire(keys=[self.key], args=[holder_id, self.capacity, self.lease_seconds]):
+            return None
+        logger.info(f"Slot acquired by {holder_id}")
+        return RedisSlotLease(self, holder_id)
+
+    async def acquire(self, holder_id: str) -> SlotLease:
+        # Subscribe before trying, so a release between the attempt and the wait is not missed
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.released_channel)
+        try:
+            while (lease := await self.try_acquire(holder_id)) is None:
+                await pubsub.get_message(timeout=SLOT_RECHECK_SECONDS)
+            return lease
+        finally:
+            await pubsub.unsubscribe(self.released_channel)
+            await pubsub.aclose()
+
+    async def renew(self, holder_id: str) -> bool:
+        return bool(await self._renew(keys=[self.key], args=[holder_id, self.lease_seconds]))
+
+    async def release(self, lease: SlotLease):
+        try:
+            if await self.client.zrem(self.key, lease.holder_id):
+                await self.client.publish(self.released_channel, lease.holder_id)
+            logger.info(f"Slot released by {lease.holder_id}")
+        except Exception as e:
+            # The lease runs out on its own
+            logger.error(f"Error releasing slot of {lease.holder_id}: {e}")
+
+    async def active(self) -> int:
+        return int(await self._active(keys=[self.key]))
+
+
+_semaphore: Optional[SlotSemaphore] = None
+
+
+def get_slot_semaphore() -> SlotSemaphore:
+    """Return the process-wide analysis slot semaphore chosen by SLOT_BACKEND."""
+    global _semaphore
+    if _semaphore is None:
+        if SLOT_BACKEND == "redis":
+            _semaphore = RedisSlotSemaphore(get_redis(), MAX_CONCURRENT_USERS)
+        else:
+            _semaphore = LocalSlotSemaphore(MAX_CONCURRENT_USERS)
+    return _semaphore
@@ -0,0 +1,114 @@
+from backend.InferenceEngine.metrics import counter
+
+import asyncio
+from contextlib import suppress
+from dataclasses import dataclass
+import logging
+import os
+import time
+from typing import AsyncGenerator, AsyncIterator
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Tokens are sent to the browser at most every STREAM_FLUSH_INTERVAL_MS, or as soon as
+# STREAM_FLUSH_BYTES have accumulated, whichever comes first
+STREAM_FLUSH_INTERVAL_MS = float(os.getenv("STREAM_FLUSH_INTERVAL_MS", 50))
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", 2048))
+
+websocket_frames = counter("websocket_frames_sent_total", "WebSocket frames sent to analysis clients")
+websocket_bytes = counter("websocket_bytes_sent_total", "Bytes of JSON sent to analysis clients")
+
+_END = object()
+
+
+@dataclass
+class ConnectionStats:
+    """Per-connection counters of what was sent to the client."""
+    frames: int = 0
+    bytes: int = 0
+    # Pieces of output received from the model; each network read can hold several tokens
+    chunks: int = 0
+
+    def record_frame(self, size: int):
+        self.frames += 1
+        self.bytes += size
+        websocket_frames.inc()
+        websocket_bytes.inc(size)
+
+
+async def coalesce_tokens(
+    tokens: AsyncIterator[str],
+    flush_interval_ms: float = STREAM_FLUSH_INTERVAL_MS,
+    flush_bytes: int = STREAM_FLUSH_BYTES,
+    stats: ConnectionStats | None = None
+) -> AsyncGenerator[str, None]:
+    """
+    Merge a stream of model tokens into fewer, larger chunks.
+
+    The first token is passed through immediately to keep first-token latency low. After that,
+    tokens are buffered and flushed when the time window since the last flush has elapsed or
+    the buffer reaches flush_bytes, whichever comes first. The upstream stream is consumed by
+    its own task so a flush never waits for the next token; closing this generator cancels
+    that task, which closes the upstream stream.
+
+    Args:
+        tokens: Token stream, e.g. from stream_llm
+        flush_interval_ms: Maximum time a token is held back
+        flush_bytes: Buffer size (in characters) that triggers an immediate flush
+        stats: Optional per-connection counters; the pieces of output received are counted in it
+
+    Returns:
+        Async generator of coalesced chunks
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for token in tokens:
+                queue.put_nowait(token)
+            queue.put_nowait(_END)
+        except Exception as e:
+            queue.put_nowait(e)
+
+    pump_task = asyncio.create_task(pump())
+    window = flush_interval_ms / 1000
+    buffer = []
+    buffered = 0
+    first = True
+    last_flush = time.monotonic()
+    try:
+        while True:
+            timeout = None
+            if buffer:
+                timeout = max(0.0, window - (time.monotonic() - last_flush))
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout) if timeout is not None else await queue.get()
+            except asyncio.TimeoutError:
+                item = None
+
+            if item is _END or isinstance(item, Exception):
+                if buffer:
+                    yield "".join(buffer)
+                if isinstance(item, Exception):
+                    raise item
+                return
+
+            if item is not None:
+                if stats is not None:
+                    stats.chunks += 1
+                buffer.append(item)
+                buffered += len(item)
+
+            if buffer and (first or buffered >= flush_bytes or time.monotonic() - last_flush >= window):
+                chunk = buffer[0] if len(buffer) == 1 else "".join(buffer)
+                buffer = []
+                buffered = 0
+                first = False
+                last_flush = time.monotonic()
+                yield chunk
+    finally:
+        pump_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await pump_task
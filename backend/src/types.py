@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, UniqueConstraint,JSON
+from sqlalchemy import Column, Index, Integer, String, Text, ForeignKey, UniqueConstraint,JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from typing import Any, Dict, List, Optional
@@ -22,12 +22,14 @@ class User(Base):
 
     __table_args__ = (
         UniqueConstraint('name', 'degree', 'topic', name='unique_user'),  
+        # An evaluator's latest evaluation per (name, rubric_name)
+        Index('ix_users_evaluator_latest', 'evaluator', 'name', 'rubric_name', 'id'),
     )
 
 class UserScore(Base):
     __tablename__ = 'UserScores'
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey('Users.id'))
+    user_id = Column(Integer, ForeignKey('Users.id'), index=True)
     dimension_name = Column(String(255))
     score = Column(Integer)
     data = Column(Text)  
@@ -136,7 +138,7 @@ class RubricResponse(BaseModel):
 class DimensionScoreResponse(BaseModel):
     dimension_name: str
     score: int
-    data:str
+    data: Optional[str] = None
     
 class UserDataResponse(BaseModel):
     id: int
@@ -1,5 +1,6 @@
 # from backend.Agents.text_agents import extract_name_agent, extract_topic_agent, extract_degree_agent
 from backend.Agents.vision_agents import analyze_image
+from backend.src.durations import record_stage
 
 import asyncio
 from docx import Document
@@ -9,8 +10,10 @@ from fastapi import UploadFile
 import fitz
 from io import BytesIO
 import logging
+import os
 from PIL import Image
 import re
+import time
 from typing import Dict, Tuple, List
 
 
@@ -20,6 +23,9 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Messages a SimulatedWebSocket keeps locally; older ones are discarded
+SIMULATED_WS_MAX_MESSAGES = int(os.getenv("SIMULATED_WS_MAX_MESSAGES", 256))
+
 class WebSocketManager:
     def __init__(self, max_slots):
         self.active_users = 0
@@ -177,6 +183,7 @@ async def process_pdf(pdf_file: UploadFile) -> Dict[str, str]:
     # Start image analysis from page 7
     image_analysis_start_page = 6  # Pages are zero-indexed, so page 7 is index 6
 
+    started = time.monotonic()
     for page_num in range(doc.page_count):
         page = doc[page_num]
         
@@ -195,9 +202,12 @@ async def process_pdf(pdf_file: UploadFile) -> Dict[str, str]:
                     images_data.append((page_num + 1, image_bytes))
                 except Exception as e:
                     logger.error(f"Failed to extract image on page {page_num + 1}: {e}")
+    record_stage("page", doc.page_count, time.monotonic() - started)
 
     # Process images in batches
+    started = time.monotonic()
     image_analyses = await process_images_in_batch(images_data) if images_data else {}
+    record_stage("image", len(images_data), time.monotonic() - started)
     
     # Insert image analyses into the final_elements list in their original positions
     for page_num, analysis in image_analyses.items():
@@ -251,7 +261,9 @@ async def process_docx(docx_file: UploadFile):
 
     # Process images in batches
     if images_data:
+        started = time.monotonic()
         analysis_results = await process_images_in_batch(images_data)
+        record_stage("image", len(images_data), time.monotonic() - started)
 
         # Add results to final text
         for idx, analysis_result in sorted(analysis_results.items()):
@@ -345,7 +357,7 @@ async def process_initial_agents(thesis_text: str) -> Dict[str, str]:
 class SimulatedWebSocket:
     def __init__(self, data, real_websocket=None):
         self.data = data  # Store initial data payload
-        self.messages = asyncio.Queue()  # Queue for sent messages
+        self.messages = asyncio.Queue(maxsize=SIMULATED_WS_MAX_MESSAGES)  # Bounded queue for sent messages
         self.closed = False  # Status to track if WebSocket is closed
         self.real_websocket = real_websocket  # Optional disconnect handler
 
@@ -377,7 +389,25 @@ class SimulatedWebSocket:
             await self.real_websocket.send_json(data)
 
         # Also enqueue the message locally (if needed for testing)
-        await self.messages.put(data)
+        self._enqueue(data)
+
+    async def send_text(self, data):
+        """
+        Simulate sending a text frame, forwarding to the real WebSocket if provided.
+        """
+        if self.closed:
+            raise RuntimeError("WebSocket is closed.")
+
+        if self.real_websocket and not self.real_websocket.client_state.closed:
+            await self.real_websocket.send_text(data)
+
+        self._enqueue(data)
+
+    def _enqueue(self, data):
+        # Nobody may be reading the local copy, so keep only the most recent messages
+        if self.messages.full():
+            self.messages.get_nowait()
+        self.messages.put_nowait(data)
 
     async def close(self, code=1000, reason=""):
         """
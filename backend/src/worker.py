@@ -0,0 +1,110 @@
+from backend.InferenceEngine.metrics import render_prometheus
+from backend.src import kafka_utils
+from backend.src.job_queue import get_job_queue
+from backend.src.kafka_utils import consume_messages, stop_kafka
+from backend.src.session_router import SESSION_ROUTER_BACKEND, get_session_router
+from backend.src.session_stream import SESSION_LOG_BACKEND
+
+import asyncio
+from contextlib import suppress
+from dotenv import load_dotenv
+import logging
+import os
+import signal
+
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds a stopping worker lets running analyses finish before cancelling them
+WORKER_DRAIN_SECONDS = float(os.getenv("WORKER_DRAIN_SECONDS", 300))
+# Serve Prometheus metrics on this port; 0 disables the endpoint
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", 9106))
+
+
+async def _serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Answer any HTTP request with the metrics page."""
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = render_prometheus().encode("utf-8")
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4\r\n"
+            + f"Content-Length: {len(body)}\r\n".encode()
+            + b"Connection: close\r\n\r\n"
+            + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def drain_running_jobs(timeout: float):
+    """Wait for dequeued analyses to finish, cancelling whatever is left after timeout."""
+    jobs = set(kafka_utils.running_jobs)
+    if not jobs:
+        return
+    logger.info(f"Waiting up to {timeout:.0f}s for {len(jobs)} running analyses")
+    _, pending = await asyncio.wait(jobs, timeout=timeout)
+    for job in pending:
+        job.cancel()
+    if pending:
+        logger.warning(f"Cancelled {len(pending)} analyses still running after {timeout:.0f}s")
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def run_worker():
+    """
+    Consume queued analyses without serving the API. Clients follow progress through the API
+    pods, so sessions and notifications must go through Redis (SESSION_LOG_BACKEND and
+    SESSION_ROUTER_BACKEND set to "redis").
+    """
+    if SESSION_LOG_BACKEND != "redis" or SESSION_ROUTER_BACKEND != "redis":
+        logger.warning("SESSION_LOG_BACKEND and SESSION_ROUTER_BACKEND should be 'redis' on workers; "
+                       "clients cannot follow sessions held in this process")
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    metrics_server = None
+    if WORKER_METRICS_PORT:
+        metrics_server = await asyncio.start_server(_serve_metrics, "0.0.0.0", WORKER_METRICS_PORT)
+
+    await get_session_router().start()
+    consumer = None
+    try:
+        await get_job_queue().ensure()
+        consumer = asyncio.create_task(consume_messages())
+        logger.info("Worker consuming analysis queue")
+        stop_requested = asyncio.create_task(stopping.wait())
+        await asyncio.wait({consumer, stop_requested}, return_when=asyncio.FIRST_COMPLETED)
+        stop_requested.cancel()
+        if consumer.done():
+            # Surface why consumption stopped
+            consumer.result()
+    finally:
+        logger.info("Worker stopping: no longer taking queued analyses")
+        if consumer:
+            consumer.cancel()
+            with suppress(asyncio.CancelledError):
+                await consumer
+        await drain_running_jobs(WORKER_DRAIN_SECONDS)
+        await stop_kafka()
+        await get_session_router().stop()
+        if metrics_server:
+            metrics_server.close()
+            await metrics_server.wait_closed()
+
+
+def main():
+    asyncio.run(run_worker())
+
+
+if __name__ == "__main__":
+    main()
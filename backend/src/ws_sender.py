@@ -0,0 +1,159 @@
+from backend.src.stream_coalescer import ConnectionStats
+
+import asyncio
+from collections import deque
+from contextlib import suppress
+from fastapi import WebSocket
+import json
+import logging
+import os
+from typing import Deque, Optional, Tuple
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Once this many messages are waiting for a slow client, new analysis chunks are merged
+# into the pending chunk of the same criterion instead of being queued separately
+WS_SEND_QUEUE_SOFT_LIMIT = int(os.getenv("WS_SEND_QUEUE_SOFT_LIMIT", 32))
+# A client that lets this many bytes pile up is disconnected (close code 1013, try again later)
+WS_SEND_QUEUE_MAX_BYTES = int(os.getenv("WS_SEND_QUEUE_MAX_BYTES", 4 * 1024 * 1024))
+# How long closing a connection waits for the queue to drain
+WS_SEND_DRAIN_TIMEOUT = float(os.getenv("WS_SEND_DRAIN_TIMEOUT", 10))
+
+# Close code sent to clients dropped for falling behind
+SLOW_CLIENT_CLOSE_CODE = 1013
+
+# Rough size of the JSON envelope around an analysis chunk
+_CHUNK_OVERHEAD = 64
+
+
+def _serialize(message: dict) -> str:
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class WebSocketSender:
+    """
+    Bounded outbound queue for one analysis WebSocket, drained by a dedicated writer task.
+
+    send() never blocks, so a slow or stalled browser cannot throttle the LLM stream feeding
+    it. When the client falls behind, consecutive analysis chunks of the same criterion are
+    merged; once more than max_bytes are pending the client is dropped with close code 1013.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        soft_limit: int = WS_SEND_QUEUE_SOFT_LIMIT,
+        max_bytes: int = WS_SEND_QUEUE_MAX_BYTES,
+        stats: Optional[ConnectionStats] = None
+    ):
+        self.websocket = websocket
+        self.soft_limit = soft_limit
+        self.max_bytes = max_bytes
+        self.stats = stats if stats is not None else ConnectionStats()
+        self.closed = False
+        self.dropped = False
+        self.merged = 0
+
+        # Each entry is (message, estimated size in bytes)
+        self._pending: Deque[Tuple[dict, int]] = deque()
+        self._pending_bytes = 0
+        self._wakeup = asyncio.Event()
+        self._writer = asyncio.create_task(self._write_loop())
+        self._on_close = None
+
+    def on_close(self, callback):
+        """Run callback if the connection is lost (failed send or slow-client drop)."""
+        self._on_close = callback
+
+    @staticmethod
+    def _estimate(message: dict) -> int:
+        if message.get("type") == "analysis_chunk":
+            return len(message["data"]["chunk"]) + _CHUNK_OVERHEAD
+        return len(_serialize(message))
+
+    def send(self, message: dict) -> bool:
+        """
+        Queue a message for the client without waiting.
+
+        Returns:
+            False if the connection is closed and the message was discarded
+        """
+        if self.closed:
+            return False
+
+        if message.get("type") == "analysis_chunk" and len(self._pending) >= self.soft_limit:
+            tail, size = self._pending[-1]
+            if tail.get("type") == "analysis_chunk" and tail["data"]["criterion"] == message["data"]["criterion"]:
+                chunk = message["data"]["chunk"]
+                # The merged message carries the newest message's other fields (e.g. its seq)
+                merged = {**message, "data": {"criterion": tail["data"]["criterion"], "chunk": tail["data"]["chunk"] + chunk}}
+                self._pending[-1] = (merged, size + len(chunk))
+                self._pending_bytes += len(chunk)
+                self.merged += 1
+                return self._check_limit()
+
+        size = self._estimate(message)
+        self._pending.append((message, size))
+        self._pending_bytes += size
+        self._wakeup.set()
+        return self._check_limit()
+
+    def _check_limit(self) -> bool:
+        if self._pending_bytes <= self.max_bytes:
+            return True
+        logger.warning(f"Client fell {self._pending_bytes} bytes behind, dropping the connection")
+        self.dropped = True
+        self._fail()
+        asyncio.create_task(self._close_socket(SLOW_CLIENT_CLOSE_CODE, "Client too slow, reconnect to resume"))
+        return False
+
+    async def _write_loop(self):
+        try:
+            while True:
+                while not self._pending:
+                    if self.closed:
+                        return
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                message, size = self._pending.popleft()
+                self._pending_bytes -= size
+                payload = _serialize(message)
+                await self.websocket.send_text(payload)
+                self.stats.record_frame(len(payload))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"WebSocket send failed: {e}")
+            self._fail()
+
+    def _fail(self):
+        # The client is gone or too far behind: discard the backlog and tell the owner once
+        self._pending.clear()
+        self._pending_bytes = 0
+        if not self.closed:
+            self.closed = True
+            self._wakeup.set()
+            if self._on_close:
+                self._on_close()
+
+    async def _close_socket(self, code: int, reason: str):
+        self._writer.cancel()
+        with suppress(Exception, asyncio.CancelledError):
+            await self._writer
+        with suppress(Exception):
+            await self.websocket.close(code=code, reason=reason)
+
+    async def aclose(self, timeout: Optional[float] = WS_SEND_DRAIN_TIMEOUT):
+        """Stop accepting messages, give the writer up to timeout seconds to drain the queue, then stop it."""
+        self.closed = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._writer), timeout)
+        except (asyncio.TimeoutError, Exception):
+            pass
+        finally:
+            self._writer.cancel()
+            with suppress(Exception, asyncio.CancelledError):
+                await self._writer
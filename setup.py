@@ -24,8 +24,11 @@ setup(
         "python-multipart",
         "python-docx",
         "pdf2image",
-        "sqlalchemy",
+        "sqlalchemy[asyncio]",
         "pymysql",
+        "aiomysql",
+        "asyncpg",
+        "aiosqlite",
         "aiokafka",
         "kafka-python",
         "psycopg2",
@@ -33,11 +36,18 @@ setup(
         "mysql-connector-python",
         "cryptography",
         "redis",
-        "xmltodict"
+        "xmltodict",
+        "orjson",
+        "zstandard",
+        "cramjam"
     ],
+    extras_require={
+        "test": ["pytest", "fakeredis[lua]"]
+    },
     entry_points={
         'console_scripts': [
-            "da-start = backend.src.main:main"  # Use the new run_server function
+            "da-start = backend.src.main:main",  # Use the new run_server function
+            "da-worker = backend.src.worker:main"  # Consume queued analyses without serving the API
         ],
     },
 )
@@ -0,0 +1,32 @@
+import os
+import pytest
+import sys
+import tempfile
+
+# The backend reads its configuration at import time
+_tmp = tempfile.mkdtemp(prefix="dissertation-tests-")
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", f"sqlite:///{_tmp}/test.db")
+os.environ.setdefault("QUEUE_BACKEND", "memory")
+os.environ.setdefault("BLOB_STORE_DIR", f"{_tmp}/blobs")
+os.environ.setdefault("SESSION_CACHE_MAX_ENTRIES", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def fresh_singletons():
+    """Each test runs its own event loop, so process-wide clients and queues start over."""
+    from backend.src import (
+        admission, job_queue, kafka_utils, queue_status, redis_client, results, scheduler,
+        session_cache, session_router, slots
+    )
+    for module, name in [
+        (admission, "_controller"), (job_queue, "_queue"), (queue_status, "_tracker"),
+        (redis_client, "_redis"), (redis_client, "_session_redis"), (results, "_writer"),
+        (scheduler, "_scheduler"), (session_cache, "_cache"), (session_router, "_router"),
+        (slots, "_semaphore"), (kafka_utils, "consumer_task")
+    ]:
+        setattr(module, name, None)
+    kafka_utils.running_jobs.clear()
+    kafka_utils.waiting_jobs.clear()
+    yield
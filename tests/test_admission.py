@@ -0,0 +1,51 @@
+import asyncio
+import functools
+
+import httpx
+
+from backend.InferenceEngine.inference_engines import ModelType
+from backend.src.admission import AdmissionController
+
+
+class FakeConfig:
+    """Only Ollama, or no inference backend at all."""
+
+    ollama_url = "http://ollama:11434"
+
+    def __init__(self, ollama: bool):
+        self.ollama = ollama
+
+    def is_vllm_available(self, model_type: ModelType) -> bool:
+        return False
+
+    def is_ollama_available(self, model_type: ModelType) -> bool:
+        return self.ollama
+
+
+def serve_ollama(monkeypatch, status: int):
+    transport = httpx.MockTransport(lambda request: httpx.Response(status, json={"models": []}))
+    monkeypatch.setattr(httpx, "AsyncClient", functools.partial(httpx.AsyncClient, transport=transport))
+
+
+def admitted(controller: AdmissionController, attempts: int) -> int:
+    async def scenario():
+        return sum([await controller.admits() for _ in range(attempts)])
+
+    return asyncio.run(scenario())
+
+
+def test_answering_ollama_leaves_the_bound_to_the_slots(monkeypatch):
+    serve_ollama(monkeypatch, 200)
+    controller = AdmissionController(config=FakeConfig(ollama=True), scrape_seconds=60)
+    assert admitted(controller, 10) == 10
+
+
+def test_ollama_that_does_not_answer_holds_analyses_back(monkeypatch):
+    serve_ollama(monkeypatch, 503)
+    controller = AdmissionController(config=FakeConfig(ollama=True), scrape_seconds=60)
+    assert admitted(controller, 3) == 0
+
+
+def test_no_backend_to_watch_admits_everything():
+    controller = AdmissionController(config=FakeConfig(ollama=False), scrape_seconds=60)
+    assert admitted(controller, 10) == 10
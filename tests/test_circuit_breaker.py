@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from backend.InferenceEngine import circuit_breaker, inference_engines
+from backend.InferenceEngine.circuit_breaker import CircuitBreaker
+from backend.InferenceEngine.inference_engines import Backend, CancellationToken, ModelType
+from backend.InferenceEngine.request_policy import InferenceConnectionError
+
+
+class VllmOnly:
+    def get_backends(self, model_type):
+        return [Backend.VLLM]
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    # Every call counts as slow if its latency is measured at all
+    breaker = CircuitBreaker(Backend.VLLM.value, ModelType.ANALYSIS.value, slow_call_seconds=0)
+    monkeypatch.setattr(circuit_breaker, "_breakers", {(Backend.VLLM.value, ModelType.ANALYSIS.value): breaker})
+    return breaker
+
+
+def test_whole_generation_is_not_a_slow_call(monkeypatch, breaker):
+    async def invoke_backend(*args):
+        return {"answer": "done"}
+
+    monkeypatch.setattr(inference_engines, "_invoke_backend", invoke_backend)
+    asyncio.run(inference_engines.invoke_llm("system", "user", ModelType.ANALYSIS, config=VllmOnly()))
+    assert list(breaker.outcomes) == [(False, False)]
+
+
+def test_stream_failing_after_first_token_is_a_failure(monkeypatch, breaker):
+    async def stream_backend(*args):
+        yield "partial"
+        raise InferenceConnectionError("connection dropped")
+
+    async def consume():
+        chunks = []
+        stream = inference_engines.stream_llm("system", "user", ModelType.ANALYSIS, CancellationToken(), config=VllmOnly())
+        with pytest.raises(InferenceConnectionError):
+            async for chunk in stream:
+                chunks.append(chunk)
+        return chunks
+
+    monkeypatch.setattr(inference_engines, "_stream_backend", stream_backend)
+    assert asyncio.run(consume()) == ["partial"]
+    assert [failed for failed, _ in breaker.outcomes] == [True]
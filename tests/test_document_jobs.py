@@ -0,0 +1,60 @@
+import asyncio
+
+from sqlalchemy import select
+
+from backend.src import database, kafka_utils, session_stream
+from backend.src.blob_store import get_blob_store
+from backend.src.types import User, UserScore
+
+
+def test_document_job_finishes_and_is_stored_without_a_client(monkeypatch):
+    # Far shorter than the document takes: a session waiting for a client would be cancelled
+    monkeypatch.setattr(session_stream, "ANALYSIS_RESUME_GRACE_SECONDS", 0.05)
+
+    async def process_document(session, filename, content, rubric, feedback=None):
+        await asyncio.sleep(0.2)
+        result = {
+            "criteria_evaluations": {"Clarity": {"score": 4, "feedback": "Clear enough"}},
+            "total_score": 4,
+            "name": "Headless Author",
+            "degree": "MSc",
+            "topic": f"Read from {filename}"
+        }
+        await session.publish({"type": "complete", "data": result})
+        return result
+
+    async def notify_frontend_to_reconnect(session_id):
+        pass  # Nobody follows the session
+
+    monkeypatch.setattr(kafka_utils, "process_document", process_document)
+    monkeypatch.setattr(kafka_utils, "notify_frontend_to_reconnect", notify_frontend_to_reconnect)
+
+    class Lease:
+        released = False
+
+        async def release(self):
+            self.released = True
+
+    async def scenario():
+        await database.init_db()
+        try:
+            data = {
+                "session_id": "document-job",
+                "kind": "document",
+                "filename": "thesis.pdf",
+                "file": await get_blob_store().put(b"%PDF"),
+                "rubric": {"Clarity": {}},
+                "evaluator": "alice",
+                "rubric_name": "default"
+            }
+            lease = Lease()
+            await kafka_utils.process_dequeued_request(data, "document-job", lease)
+
+            async with database.AsyncSessionLocal() as db:
+                user = await db.scalar(select(User).where(User.name == "Headless Author"))
+                scores = (await db.scalars(select(UserScore).where(UserScore.user_id == user.id))).all()
+            return lease.released, user.evaluator, user.rubric_name, [(s.dimension_name, s.score) for s in scores]
+        finally:
+            await database.close_db()
+
+    assert asyncio.run(scenario()) == (True, "alice", "default", [("Clarity", 4)])
@@ -0,0 +1,42 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+from backend.src.job_queue import ClaimingConsumer, JobQueue, SqliteJobQueue
+
+
+def test_sqlite_publish_on_fresh_file_creates_the_queue():
+    async def scenario():
+        queue = SqliteJobQueue(os.path.join(tempfile.mkdtemp(), "queue.sqlite3"), "analysis")
+        # Nothing called ensure() before this replica's first publish
+        await queue.publish("session-1", b"payload")
+        consumer = queue.consumer()
+        await consumer.start()
+        try:
+            message = await asyncio.wait_for(consumer.get(), 5)
+            await consumer.ack(message)
+        finally:
+            await consumer.stop()
+        return message.key, message.value
+
+    assert asyncio.run(scenario()) == ("session-1", b"payload")
+
+
+def test_incomplete_backend_fails_at_construction():
+    class PublishOnly(JobQueue):
+        async def publish(self, key: str, value: bytes):
+            pass
+
+    class NoRenewal(ClaimingConsumer):
+        async def get(self):
+            pass
+
+        async def ack(self, message) -> bool:
+            return True
+
+    with pytest.raises(TypeError, match="consumer"):
+        PublishOnly()
+    with pytest.raises(TypeError, match="_renew"):
+        NoRenewal()
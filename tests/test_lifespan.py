@@ -0,0 +1,17 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import inspect
+
+from backend.src import database, kafka_utils, main
+
+
+def test_startup_creates_tables():
+    with TestClient(main.app):
+        tables = inspect(database.engine).get_table_names()
+    assert {"Users", "UserScores", "Feedbacks", "rubrics"} <= set(tables)
+    assert "ix_users_evaluator_latest" in {index["name"] for index in inspect(database.engine).get_indexes("Users")}
+
+
+def test_shutdown_stops_consumer():
+    with TestClient(main.app):
+        assert kafka_utils.consumer_task is not None
+    assert kafka_utils.consumer_task is None or kafka_utils.consumer_task.done()
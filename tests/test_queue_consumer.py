@@ -0,0 +1,108 @@
+import asyncio
+import json
+import time
+
+from fastapi.testclient import TestClient
+
+from backend.src import kafka_utils, main, scheduler
+from backend.src.job_queue import get_job_queue
+from backend.src.queue_status import get_queue_tracker
+from backend.src.scheduler import FairScheduler
+from backend.src.session_router import get_session_router
+from backend.src.slots import LocalSlotSemaphore
+
+
+def test_replica_consumes_without_publishing_first(monkeypatch):
+    processed = []
+
+    async def check_out_request(data):
+        return data
+
+    async def process_dequeued_request(data, session_id, lease):
+        processed.append(session_id)
+        await lease.release()
+
+    monkeypatch.setattr(kafka_utils, "check_out_request", check_out_request)
+    monkeypatch.setattr(kafka_utils, "process_dequeued_request", process_dequeued_request)
+
+    with TestClient(main.app) as client:
+        # Another replica queued the job; this one never called send_to_kafka
+        message = {"session_id": "queued-elsewhere", "rubric": {}, "priority": "bulk"}
+        client.portal.call(get_job_queue().publish, "queued-elsewhere", json.dumps(message).encode())
+        deadline = time.monotonic() + 5
+        while not processed and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    assert processed == ["queued-elsewhere"]
+    assert kafka_utils.consumer_task is None
+
+
+def test_bulk_job_at_the_head_does_not_hold_back_interactive_ones(monkeypatch):
+    async def scenario():
+        # One bulk analysis may run at once, and one is running already
+        scheduler._scheduler = FairScheduler(LocalSlotSemaphore(3), bulk_cap=1, weights={})
+        started = []
+        finish = asyncio.Event()
+
+        async def check_out_request(data):
+            return data
+
+        async def process_dequeued_request(data, session_id, lease):
+            started.append(session_id)
+            try:
+                await finish.wait()
+            finally:
+                await lease.release()
+
+        monkeypatch.setattr(kafka_utils, "check_out_request", check_out_request)
+        monkeypatch.setattr(kafka_utils, "process_dequeued_request", process_dequeued_request)
+
+        queue = get_job_queue()
+        for session_id, priority in [("bulk-1", "bulk"), ("bulk-2", "bulk"), ("interactive", "interactive")]:
+            message = {"session_id": session_id, "rubric": {}, "priority": priority, "evaluator": "alice"}
+            await queue.publish(session_id, json.dumps(message).encode())
+
+        consumer = asyncio.create_task(kafka_utils.consume_messages())
+        try:
+            for _ in range(100):
+                if len(started) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            return sorted(started)
+        finally:
+            consumer.cancel()
+            await asyncio.gather(consumer, return_exceptions=True)
+            finish.set()
+            await asyncio.gather(*kafka_utils.running_jobs, return_exceptions=True)
+
+    # bulk-2 waits for the bulk cap; the interactive analysis behind it starts anyway
+    assert asyncio.run(scenario()) == ["bulk-1", "interactive"]
+
+
+def test_request_that_cannot_be_loaded_is_reported_to_its_session():
+    class FakeWebSocket:
+        def __init__(self):
+            self.sent = []
+
+        async def send_json(self, message):
+            self.sent.append(message)
+
+    async def scenario():
+        websocket = FakeWebSocket()
+        await get_session_router().register("lost", websocket)
+        await get_queue_tracker().enqueue("lost", 60)
+        # The blob was written where this consumer cannot read it
+        await get_job_queue().publish("lost", json.dumps({"session_id": "lost", "blob": "0" * 64}).encode())
+
+        consumer = asyncio.create_task(kafka_utils.consume_messages())
+        try:
+            for _ in range(100):
+                if websocket.sent:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            consumer.cancel()
+            await asyncio.gather(consumer, return_exceptions=True)
+        return [message["type"] for message in websocket.sent], await get_queue_tracker().position("lost")
+
+    assert asyncio.run(scenario()) == (["error"], None)
@@ -0,0 +1,34 @@
+import asyncio
+
+from backend.src import scheduler
+from backend.src.queue_status import LocalQueueTracker
+from backend.src.scheduler import FairScheduler, Priority
+from backend.src.slots import LocalSlotSemaphore
+
+
+def test_positions_follow_the_schedulers_grant_order():
+    async def scenario():
+        scheduler._scheduler = FairScheduler(LocalSlotSemaphore(1), bulk_cap=1, weights={}, aging_rate=0.5)
+        tracker = LocalQueueTracker(capacity=1)
+        running = await scheduler._scheduler.try_acquire("running", "carol", Priority.INTERACTIVE, cost=60)
+        granted = []
+
+        async def wait_for_slot(job_id, evaluator, cost):
+            lease = await scheduler._scheduler.acquire(job_id, evaluator, Priority.BULK, cost=cost)
+            granted.append(job_id)
+            await lease.release()
+
+        # Alice's long file arrives first, then her short one, then Bob's
+        tasks = []
+        for job_id, evaluator, cost in [("alice-long", "alice", 600), ("alice-short", "alice", 60), ("bob", "bob", 60)]:
+            await tracker.enqueue(job_id, cost, Priority.BULK, evaluator)
+            tasks.append(asyncio.create_task(wait_for_slot(job_id, evaluator, cost)))
+            await asyncio.sleep(0.01)
+
+        positions = await tracker.positions()
+        await running.release()
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        return sorted(positions, key=lambda job_id: positions[job_id]["position"]), granted
+
+    predicted, granted = asyncio.run(scenario())
+    assert predicted == granted == ["alice-short", "bob", "alice-long"]
@@ -0,0 +1,36 @@
+import asyncio
+
+from sqlalchemy import func, select
+
+from backend.src import database
+from backend.src.results import Evaluation, ResultsWriter
+from backend.src.types import User, UserScore
+
+
+def test_stop_commits_buffered_evaluations():
+    async def scenario():
+        await database.init_db()
+        try:
+            # The interval is long enough that only stop() can write the group
+            writer = ResultsWriter(buffered=True, max_batch=50, interval=600)
+            submissions = [
+                asyncio.create_task(writer.submit(Evaluation(
+                    name="Stop Test", degree=f"degree-{i}", topic="Buffered writes", total_score=7,
+                    evaluator="alice", rubric_name="rubric",
+                    scores=[{"dimension_name": "Clarity", "score": 7, "data": "Clear"}]
+                )))
+                for i in range(3)
+            ]
+            await asyncio.sleep(0.05)
+            assert not any(submission.done() for submission in submissions)
+
+            await asyncio.wait_for(writer.stop(), 5)
+            user_ids = [submission.result() for submission in submissions]
+            async with database.AsyncSessionLocal() as db:
+                users = await db.scalar(select(func.count()).select_from(User).where(User.id.in_(user_ids)))
+                scores = await db.scalar(select(func.count()).select_from(UserScore).where(UserScore.user_id.in_(user_ids)))
+            return len(set(user_ids)), users, scores
+        finally:
+            await database.close_db()
+
+    assert asyncio.run(scenario()) == (3, 3, 3)
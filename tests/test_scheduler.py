@@ -0,0 +1,59 @@
+import asyncio
+
+from backend.src.scheduler import FairScheduler, Priority
+from backend.src.slots import LocalSlotSemaphore
+
+
+class GatedAdmission:
+    """Admits everything, but the dispatcher's waits are held until the gate opens."""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+
+    async def admits(self):
+        return True
+
+    async def wait_until_admitted(self):
+        await self.gate.wait()
+
+
+def test_waiter_cancelled_during_dispatch_does_not_leak_the_slot():
+    async def scenario():
+        admission = GatedAdmission()
+        slots = LocalSlotSemaphore(1)
+        scheduler = FairScheduler(slots, weights={}, admission=admission)
+        running = await scheduler.try_acquire("running")
+        cancelled = asyncio.create_task(scheduler.acquire("cancelled"))
+        await asyncio.sleep(0.01)
+
+        # The dispatcher waits for admission; a slot is free by the time it is admitted
+        await running.release()
+        await asyncio.sleep(0.01)
+        # It takes the slot before the cancelled waiter's task can remove itself
+        admission.gate.set()
+        cancelled.cancel()
+        await asyncio.sleep(0.01)
+
+        lease = await asyncio.wait_for(scheduler.acquire("next", priority=Priority.INTERACTIVE), 1)
+        await lease.release()
+        return cancelled.cancelled(), await slots.active()
+
+    assert asyncio.run(scenario()) == (True, 0)
+
+
+def test_dispatcher_holds_no_slot_while_waiting_for_admission():
+    async def scenario():
+        admission = GatedAdmission()
+        slots = LocalSlotSemaphore(1)
+        scheduler = FairScheduler(slots, weights={}, admission=admission)
+        waiter = asyncio.create_task(scheduler.acquire("waiter"))
+        await asyncio.sleep(0.01)
+        held_while_waiting = await slots.active()
+
+        admission.gate.set()
+        lease = await asyncio.wait_for(waiter, 1)
+        held_once_granted = await slots.active()
+        await lease.release()
+        return held_while_waiting, held_once_granted
+
+    assert asyncio.run(scenario()) == (0, 1)
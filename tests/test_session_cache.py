@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+import fakeredis
+
+from backend.src.session_cache import SessionCache
+
+
+class GatedPipeline:
+    """Holds the results of a lookup until the gate opens, as if the reply were slow to arrive."""
+
+    def __init__(self, pipeline, gate):
+        self.pipeline = pipeline
+        self.gate = gate
+
+    async def __aenter__(self):
+        await self.pipeline.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await self.pipeline.__aexit__(*exc_info)
+
+    def get(self, key):
+        self.pipeline.get(key)
+
+    def pttl(self, key):
+        self.pipeline.pttl(key)
+
+    async def execute(self):
+        result = await self.pipeline.execute()
+        await self.gate.wait()
+        return result
+
+
+def test_lookup_overlapping_a_revocation_is_not_cached():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        await client.set("session-1", json.dumps({"username": "alice"}), ex=600)
+        cache = SessionCache(client, ttl=30, max_entries=10)
+        other_replica = SessionCache(fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+        await cache.start()
+        try:
+            while not cache.subscribed:
+                await asyncio.sleep(0.01)
+
+            gate = asyncio.Event()
+            pipeline = client.pipeline
+            client.pipeline = lambda transaction=False: GatedPipeline(pipeline(transaction=transaction), gate)
+            lookup = asyncio.create_task(cache.get("session-1"))
+            await asyncio.sleep(0.05)
+
+            # Revoked on another replica after the lookup read Redis, before it stored the result
+            generation = cache.generation
+            await other_replica.revoke("session-1")
+            while cache.generation == generation:
+                await asyncio.sleep(0.01)
+            gate.set()
+            await lookup
+
+            client.pipeline = pipeline
+            return "session-1" in cache.entries, await cache.get("session-1")
+        finally:
+            await cache.stop()
+
+    assert asyncio.run(scenario()) == (False, None)
@@ -0,0 +1,35 @@
+import asyncio
+
+import fakeredis
+
+from backend.src.session_router import RedisSessionRouter
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+
+def test_message_reaches_socket_on_other_replica_without_start():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        holder = RedisSessionRouter(fakeredis.FakeAsyncRedis(server=server), pod_id="pod-a")
+        sender = RedisSessionRouter(fakeredis.FakeAsyncRedis(server=server), pod_id="pod-b")
+        websocket = FakeWebSocket()
+        try:
+            # Neither router was started by a lifespan; registering starts the holder's listener
+            await holder.register("session-1", websocket)
+            assert await sender.send("session-1", {"type": "done"}, wait=1)
+            for _ in range(100):
+                if websocket.sent:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await holder.stop()
+            await sender.stop()
+        return websocket.sent
+
+    assert asyncio.run(scenario()) == [{"type": "done"}]
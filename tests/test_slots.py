@@ -0,0 +1,74 @@
+import asyncio
+
+import fakeredis
+
+from backend.src.slots import RedisSlotSemaphore
+
+
+def replicas(count: int, capacity: int = 1, lease_seconds: float = 60):
+    """Semaphores of several replicas sharing one Redis; the Lua scripts need lupa installed."""
+    server = fakeredis.FakeServer()
+    return [
+        RedisSlotSemaphore(fakeredis.FakeAsyncRedis(server=server), capacity, key="test:slots", lease_seconds=lease_seconds)
+        for _ in range(count)
+    ]
+
+
+def test_capacity_holds_across_replicas():
+    async def scenario():
+        a, b = replicas(2, capacity=2)
+        first = await a.try_acquire("job-1")
+        second = await b.try_acquire("job-2")
+        refused = await a.try_acquire("job-3")
+        # A holder taking its slot again does not use up another one
+        again = await b.try_acquire("job-2")
+        active = await a.active()
+        for lease in (first, second, again):
+            await lease.release()
+        return first is not None, second is not None, refused, again is not None, active, await b.active()
+
+    assert asyncio.run(scenario()) == (True, True, None, True, 2, 0)
+
+
+def test_renewed_lease_outlives_its_duration():
+    async def scenario():
+        a, b = replicas(2, lease_seconds=0.3)
+        lease = await a.try_acquire("job-1")
+        await asyncio.sleep(0.8)
+        refused = await b.try_acquire("job-2")
+        active = await b.active()
+        await lease.release()
+        return refused, active
+
+    assert asyncio.run(scenario()) == (None, 1)
+
+
+def test_lease_of_a_dead_holder_expires():
+    async def scenario():
+        a, b = replicas(2, lease_seconds=0.3)
+        lease = await a.try_acquire("job-1")
+        # The holder's pod dies: nothing renews the lease any more
+        lease._renewer.cancel()
+        await asyncio.sleep(0.5)
+        renewed = await a.renew("job-1")
+        active = await b.active()
+        taken = await b.try_acquire("job-2")
+        await taken.release()
+        return renewed, active, taken is not None
+
+    assert asyncio.run(scenario()) == (False, 0, True)
+
+
+def test_waiter_is_woken_by_a_release_on_another_replica():
+    async def scenario():
+        a, b = replicas(2)
+        held = await a.try_acquire("job-1")
+        waiter = asyncio.create_task(b.acquire("job-2"))
+        await asyncio.sleep(0.05)
+        waiting = not waiter.done()
+        await held.release()
+        lease = await asyncio.wait_for(waiter, 1)
+        await lease.release()
+        return waiting, lease.holder_id
+
+    assert asyncio.run(scenario()) == (True, "job-2")
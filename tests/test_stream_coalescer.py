@@ -0,0 +1,102 @@
+import asyncio
+from contextlib import aclosing
+import time
+
+import pytest
+
+from backend.src.stream_coalescer import ConnectionStats, coalesce_tokens
+
+
+async def tokens(*items, pause: float = 0.0, then: asyncio.Event | None = None):
+    for item in items:
+        yield item
+    if then is not None:
+        await then.wait()
+    await asyncio.sleep(pause)
+
+
+async def collect(stream) -> list:
+    async with aclosing(stream):
+        return [chunk async for chunk in stream]
+
+
+def test_first_token_is_passed_through_at_once():
+    async def scenario():
+        release = asyncio.Event()
+        stream = coalesce_tokens(tokens("first", "second", then=release), flush_interval_ms=10_000)
+        async with aclosing(stream):
+            # The rest of the stream is held back until the first chunk is out
+            first = await asyncio.wait_for(anext(stream), 1)
+            release.set()
+            return first, [chunk async for chunk in stream]
+
+    assert asyncio.run(scenario()) == ("first", ["second"])
+
+
+def test_tokens_are_merged_within_the_window():
+    async def scenario():
+        started = time.monotonic()
+        received = []
+        stream = coalesce_tokens(tokens("a", "b", "c", pause=1.0), flush_interval_ms=100, flush_bytes=1000)
+        async with aclosing(stream):
+            async for chunk in stream:
+                received.append((chunk, time.monotonic() - started))
+        return received
+
+    (first, _), (merged, flushed_after) = asyncio.run(scenario())
+    assert (first, merged) == ("a", "bc")
+    # Flushed when the window elapsed, not held until the stream ended
+    assert 0.05 < flushed_after < 0.5
+
+
+def test_buffer_reaching_the_byte_threshold_is_flushed_at_once():
+    async def scenario():
+        started = time.monotonic()
+        chunks = await collect(coalesce_tokens(tokens("a", "bb", "cc", "d"), flush_interval_ms=10_000, flush_bytes=4))
+        return chunks, time.monotonic() - started
+
+    chunks, elapsed = asyncio.run(scenario())
+    assert chunks == ["a", "bbcc", "d"]
+    assert elapsed < 1
+
+
+def test_pieces_received_are_counted():
+    stats = ConnectionStats()
+    asyncio.run(collect(coalesce_tokens(tokens("a", "b", "c"), flush_interval_ms=10_000, stats=stats)))
+    assert stats.chunks == 3
+
+
+def test_error_is_raised_after_the_buffered_tokens():
+    async def failing():
+        yield "a"
+        yield "b"
+        raise RuntimeError("connection dropped")
+
+    async def scenario():
+        received = []
+        with pytest.raises(RuntimeError):
+            async for chunk in coalesce_tokens(failing(), flush_interval_ms=10_000):
+                received.append(chunk)
+        return received
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+
+
+def test_closing_the_stream_closes_the_upstream():
+    closed = asyncio.Event()
+
+    async def endless():
+        try:
+            while True:
+                yield "token"
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+
+    async def scenario():
+        stream = coalesce_tokens(endless(), flush_interval_ms=10)
+        await anext(stream)
+        await stream.aclose()
+        return closed.is_set()
+
+    assert asyncio.run(scenario())
@@ -0,0 +1,72 @@
+import json
+
+from backend.InferenceEngine.stream_decoder import NDJSONDecoder, SSEDecoder
+
+
+def sse_event(token: str) -> bytes:
+    return b"data: " + json.dumps({"choices": [{"delta": {"content": token}}]}).encode() + b"\n\n"
+
+
+def ndjson_event(token: str, done: bool = False) -> bytes:
+    return json.dumps({"response": token, "done": done}).encode() + b"\n"
+
+
+def feed_in_pieces(decoder, stream: bytes, size: int) -> list:
+    tokens = []
+    for start in range(0, len(stream), size):
+        tokens.extend(decoder.feed(stream[start:start + size]))
+    return tokens + decoder.flush()
+
+
+def test_sse_events_split_across_reads():
+    stream = sse_event("Hel") + sse_event("lo, ") + b": keep-alive\n\n" + sse_event("wörld") + b"data: [DONE]\n\n"
+    for size in (1, 2, 7, len(stream)):
+        decoder = SSEDecoder()
+        assert feed_in_pieces(decoder, stream, size) == ["Hel", "lo, ", "wörld"]
+        assert decoder.done
+
+
+def test_sse_split_between_carriage_return_and_newline():
+    decoder = SSEDecoder()
+    assert decoder.feed(b'data: {"choices": [{"delta": {"content": "a"}}]}\r') == []
+    assert decoder.feed(b"\n\r") == []
+    assert decoder.feed(b"\n") == ["a"]
+
+
+def test_sse_event_with_several_data_lines():
+    decoder = SSEDecoder()
+    assert decoder.feed(b'data: {"choices": [{"delta":\ndata: {"content": "x"}}]}\n\n') == ["x"]
+
+
+def test_sse_event_without_trailing_blank_line_is_flushed():
+    decoder = SSEDecoder()
+    stream = sse_event("first") + sse_event("last")[:-2]
+    assert decoder.feed(stream) == ["first"]
+    assert decoder.flush() == ["last"]
+
+
+def test_sse_ignores_what_follows_done():
+    decoder = SSEDecoder()
+    assert decoder.feed(b"data: [DONE]\n\n" + sse_event("late")) == []
+    assert decoder.done
+    assert decoder.flush() == []
+
+
+def test_ndjson_objects_split_across_reads():
+    stream = ndjson_event("Hel") + b"\n" + ndjson_event("lo") + ndjson_event("", done=True)
+    for size in (1, 3, 16, len(stream)):
+        decoder = NDJSONDecoder()
+        assert feed_in_pieces(decoder, stream, size) == ["Hel", "lo"]
+        assert decoder.done
+
+
+def test_ndjson_object_without_trailing_newline_is_flushed():
+    decoder = NDJSONDecoder()
+    assert decoder.feed(ndjson_event("a") + ndjson_event("b")[:-1]) == ["a"]
+    assert decoder.flush() == ["b"]
+    assert not decoder.done
+
+
+def test_ndjson_skips_malformed_lines():
+    decoder = NDJSONDecoder()
+    assert decoder.feed(b"not json\n[1, 2]\n" + ndjson_event("ok")) == ["ok"]
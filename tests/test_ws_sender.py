@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+from backend.src.ws_sender import SLOW_CLIENT_CLOSE_CODE, WebSocketSender
+
+
+class StalledWebSocket:
+    """Holds every send until the gate opens, like a client that stopped reading."""
+
+    def __init__(self, fail: bool = False):
+        self.gate = asyncio.Event()
+        self.fail = fail
+        self.sent = []
+        self.closed_with = None
+
+    async def send_text(self, payload: str):
+        if self.fail:
+            raise RuntimeError("connection reset")
+        await self.gate.wait()
+        self.sent.append(json.loads(payload))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed_with = code
+
+
+def chunk(seq: int, criterion: str, text: str) -> dict:
+    return {"seq": seq, "type": "analysis_chunk", "data": {"criterion": criterion, "chunk": text}}
+
+
+def test_client_that_keeps_up_gets_every_chunk_on_its_own():
+    async def scenario():
+        websocket = StalledWebSocket()
+        websocket.gate.set()
+        sender = WebSocketSender(websocket, soft_limit=2)
+        for seq in range(1, 6):
+            assert sender.send(chunk(seq, "A", str(seq)))
+            # A client that keeps up has read each chunk before the next one
+            await asyncio.sleep(0)
+        await sender.aclose()
+        return websocket.sent, sender.merged, sender.stats.frames
+
+    sent, merged, frames = asyncio.run(scenario())
+    assert [message["seq"] for message in sent] == [1, 2, 3, 4, 5]
+    assert (merged, frames) == (0, 5)
+
+
+def test_chunks_are_merged_once_the_soft_limit_is_reached():
+    async def scenario():
+        websocket = StalledWebSocket()
+        sender = WebSocketSender(websocket, soft_limit=2)
+        sender.send(chunk(1, "A", "a"))
+        # The writer takes the first message and blocks on the client
+        await asyncio.sleep(0.01)
+        for message in (chunk(2, "A", "b"), chunk(3, "A", "c"), chunk(4, "A", "d"), chunk(5, "A", "e"), chunk(6, "B", "f")):
+            assert sender.send(message)
+        websocket.gate.set()
+        await sender.aclose()
+        return websocket.sent, sender.merged
+
+    sent, merged = asyncio.run(scenario())
+    assert sent == [
+        chunk(1, "A", "a"),
+        chunk(2, "A", "b"),
+        # Merged into the pending chunk of its criterion, under the newest seq
+        chunk(5, "A", "cde"),
+        # Another criterion is never merged into it
+        chunk(6, "B", "f"),
+    ]
+    assert merged == 2
+
+
+def test_client_too_far_behind_is_closed_with_1013():
+    async def scenario():
+        websocket = StalledWebSocket()
+        lost = []
+        sender = WebSocketSender(websocket, soft_limit=1, max_bytes=300)
+        sender.on_close(lambda: lost.append(True))
+        sender.send(chunk(1, "A", "a"))
+        await asyncio.sleep(0.01)
+        accepted = [sender.send(chunk(seq, "A", "x" * 50)) for seq in range(2, 10)]
+        await asyncio.sleep(0.01)
+        return accepted, sender.dropped, lost, websocket.closed_with, sender.send(chunk(10, "A", "late"))
+
+    accepted, dropped, lost, closed_with, late = asyncio.run(scenario())
+    # Merged chunks still count towards the cap
+    assert accepted[:4] == [True] * 4 and accepted[-1] is False
+    assert dropped and lost == [True]
+    assert closed_with == SLOW_CLIENT_CLOSE_CODE
+    assert late is False
+
+
+def test_failed_send_closes_the_sender():
+    async def scenario():
+        websocket = StalledWebSocket(fail=True)
+        lost = []
+        sender = WebSocketSender(websocket)
+        sender.on_close(lambda: lost.append(True))
+        sender.send({"type": "metadata", "data": {}})
+        await asyncio.sleep(0.01)
+        late = sender.send({"type": "complete", "data": {}})
+        await sender.aclose()
+        return lost, late, sender.dropped
+
+    assert asyncio.run(scenario()) == ([True], False, False)